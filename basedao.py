@@ -6,17 +6,35 @@
 '''
 __author__ = "阮程"
 
+import asyncio
+import atexit
+import csv
+import importlib
+import json
 import logging
+import os
+import random
+import re
+import threading
 import time
+import weakref
+from bisect import bisect_left
+from collections import OrderedDict, namedtuple
+from concurrent import futures
+from contextlib import contextmanager
+from functools import lru_cache, wraps
+from itertools import chain, islice
 
 import pymysql
-from DBUtils import PooledDB
+from DBUtils import PooledDB, SteadyDB
+
+try:
+    import aiomysql
+except ImportError:
+    aiomysql = None
+
+logger = logging.getLogger(__name__)
 
-logging.basicConfig(
-    level=logging.INFO,
-    datefmt='%Y-%m-%d %H:%M:%S',
-    format='%(asctime)s [%(levelname)s] %(message)s'
-)
 
 def get_time(fmt=None):
     '''
@@ -37,10 +55,9 @@ def stitch_sequence(seq=None, is_field=True, suf=None):
     if seq is None:
         raise Exception("Parameter seq is None")
     suf = suf or ","
-    res = str()
-    for item in seq:
-        res += '`%s`%s' % (item, suf) if is_field else '%s%s' % (item, suf)
-    return res[:-len(suf)]
+    if is_field:
+        return suf.join(['`%s`' % item for item in seq])
+    return suf.join(['%s' % item for item in seq])
 
 def escape_quotes(val):
     '转换单引号和双引号'
@@ -48,11 +65,1822 @@ def escape_quotes(val):
         return val.replace("'","\\\'")
     return val
 
+
+class PoolTimeoutError(Exception):
+    '连接池在限定时间内没有可用连接'
+    pass
+
+
+class _NoFailover(Exception):
+    '''
+    传给 DBUtils 的 failures 参数，关闭 SteadyDB 游标出错后自动重连并重新执行的机制(它也会重新执行更新语句)，
+    断线重连和查询重试由 BaseDao 按错误类型处理
+    '''
+
+
+class ConnectionChecker(object):
+    '''
+    连接健康检查，借出连接时按空闲时间 ping、按存活时间回收
+    - :ping_idle: 空闲超过该秒数的连接借出时先 ping，失败则重新连接(默认: None, 不检查)
+    - :max_lifetime: 连接最长存活秒数，超过后借出时重新连接(默认: None, 不限制)
+    - 重新连接使用 DBUtils.SteadyDB 连接的 _create/_store 方法，不是 SteadyDB 连接时不处理
+    '''
+
+    def __init__(self, ping_idle=None, max_lifetime=None):
+        self.ping_idle = ping_idle
+        self.max_lifetime = max_lifetime
+        # {SteadyDB 连接: [创建时间, 最后使用时间]}
+        self._meta = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _steady(conn):
+        '''获取连接对应的 SteadyDB 连接(连接池借出的连接是它的包装)'''
+        if isinstance(conn, SteadyDB.SteadyDBConnection):
+            return conn
+        inner = getattr(conn, "_con", None)
+        if isinstance(inner, SteadyDB.SteadyDBConnection):
+            return inner
+        inner = getattr(inner, "con", None)
+        return inner if isinstance(inner, SteadyDB.SteadyDBConnection) else None
+
+    def on_checkout(self, conn):
+        '''借出连接时检查, 返回是否重新连接'''
+        steady = self._steady(conn)
+        if steady is None:
+            return False
+        now = time.time()
+        with self._lock:
+            meta = self._meta.get(steady)
+            if meta is None:
+                self._meta[steady] = [now, now]
+                return False
+        if self.max_lifetime is not None and now - meta[0] >= self.max_lifetime:
+            logger.debug("连接存活超过 %s 秒, 重新连接", self.max_lifetime)
+            return self.reconnect(conn)
+        if self.ping_idle is not None and now - meta[1] >= self.ping_idle \
+                and not self.ping(conn):
+            logger.info("连接空闲 %.1f 秒后 ping 失败, 重新连接", now - meta[1])
+            return self.reconnect(conn)
+        return False
+
+    def on_checkin(self, conn):
+        '''归还连接时记录最后使用时间'''
+        steady = self._steady(conn)
+        if steady is not None:
+            meta = self._meta.get(steady)
+            if meta is not None:
+                meta[1] = time.time()
+
+    def ping(self, conn):
+        '''ping 连接, 驱动不支持 ping 时返回 True'''
+        try:
+            try:
+                alive = conn.ping(False)
+            except TypeError:
+                alive = conn.ping()
+        except AttributeError:
+            return True
+        except Exception:
+            return False
+        return alive is None or bool(alive)
+
+    def reconnect(self, conn):
+        '''关闭底层连接并重新连接, 返回是否成功'''
+        steady = self._steady(conn)
+        if steady is None:
+            return False
+        try:
+            new_conn = steady._create()
+        except Exception as e:
+            logger.warning("重新连接失败: %s", e)
+            return False
+        steady._close()
+        steady._store(new_conn)
+        now = time.time()
+        with self._lock:
+            self._meta[steady] = [now, now]
+        return True
+
+
+class ConnectionPool(object):
+    '''
+    基于 DBUtils.PooledDB 的连接池，同一 DSN 只会创建一个实例(见 get_pool)
+    - :config: 连接参数(包含 creator)
+    - :mincached: 初始化时创建的空闲连接数(默认: 0)
+    - :maxcached: 池中最多保留的空闲连接数(默认: 10, 0 表示不限制)
+    - :maxshared: 最多共享的连接数(默认: 0, 只有驱动 threadsafety > 1 时才生效)
+    - :maxconnections: 最多同时借出的连接数(默认: 0, 表示不限制)
+    - :timeout: 连接池耗尽时借出连接的最长等待秒数(默认: None, 一直等待)
+    - :ping_idle: 空闲超过该秒数的连接借出时先 ping(默认: None, 由 DBUtils 在每次借出时 ping)
+    - :max_lifetime: 连接最长存活秒数, 超过后借出时重新连接(默认: None, 不限制)
+    '''
+
+    def __init__(self, config, mincached=0, maxcached=10, maxshared=0,
+                 maxconnections=0, timeout=None, ping_idle=None, max_lifetime=None):
+        self._pool = PooledDB.PooledDB(
+            mincached=mincached, maxcached=maxcached, maxshared=maxshared,
+            maxconnections=maxconnections, blocking=True, failures=_NoFailover,
+            ping=0 if ping_idle is not None else 1, **config)
+        self.checker = ConnectionChecker(ping_idle, max_lifetime)
+        self._shareable = maxshared > 0
+        self._timeout = timeout
+        # PooledDB 的阻塞等待没有超时，借出数量由信号量限制
+        self._semaphore = threading.BoundedSemaphore(
+            maxconnections) if maxconnections else None
+
+    def checkout(self):
+        '借出连接，池耗尽时最多等待 timeout 秒'
+        if self._semaphore is not None:
+            if not self._semaphore.acquire(timeout=self._timeout):
+                raise PoolTimeoutError(
+                    "No connection available in %s seconds." % self._timeout)
+        try:
+            conn = self._pool.connection(self._shareable)
+            self.checker.on_checkout(conn)
+            return conn
+        except Exception:
+            if self._semaphore is not None:
+                self._semaphore.release()
+            raise
+
+    def checkin(self, conn):
+        '归还连接'
+        try:
+            self.checker.on_checkin(conn)
+            conn.close()
+        finally:
+            if self._semaphore is not None:
+                self._semaphore.release()
+
+    @contextmanager
+    def connection(self):
+        '以上下文管理器的方式借出连接，退出时自动归还'
+        conn = self.checkout()
+        try:
+            yield conn
+        finally:
+            self.checkin(conn)
+
+    def close(self):
+        '关闭连接池中的所有连接'
+        self._pool.close()
+
+
+# 按 DSN 缓存的连接池
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(config, **kwargs):
+    '''
+    获取 config 对应 DSN 的连接池，不存在时创建
+    - :config: 连接参数(包含 creator)
+    - :kwargs: ConnectionPool 的连接池参数，只在首次创建时生效
+    '''
+    key = tuple(sorted(config.items(), key=lambda item: item[0]))
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(config, **kwargs)
+        return pool
+
+
+class Replica(object):
+    '''
+    一个从库: 连接池及其路由状态
+    - :name: 从库名称(host:port)
+    - :pool: 从库的 ConnectionPool
+    '''
+
+    def __init__(self, name, pool):
+        self.name = name
+        self.pool = pool
+        # 当前借出(执行中)的连接数
+        self.outstanding = 0
+        self.reads = 0
+        self.failures = 0
+        # 摘除到该时间点，之后重新参与路由
+        self.ejected_until = 0
+
+
+class ReplicaSet(object):
+    '''
+    从库集合，负责读请求的负载均衡和故障摘除
+    - :replicas: Replica 列表
+    - :balance: 负载均衡策略, round_robin 轮询, least_outstanding 选择执行中请求最少的从库
+    - :eject_seconds: 从库连接或执行失败后摘除的秒数，到期后重新尝试(默认: 30)
+    '''
+    BALANCES = ("round_robin", "least_outstanding")
+
+    def __init__(self, replicas, balance="round_robin", eject_seconds=30):
+        if balance not in self.BALANCES:
+            raise ValueError("Parameter [balance] must be one of %s." % (self.BALANCES,))
+        self.replicas = list(replicas)
+        self._balance = balance
+        self._eject_seconds = eject_seconds
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def choose(self):
+        '选择一个可用的从库并计入执行中请求，全部被摘除时返回 None'
+        now = time.time()
+        with self._lock:
+            count = len(self.replicas)
+            start, self._next = self._next, self._next + 1
+            # 从轮询位置开始遍历，least_outstanding 在请求数相同时也能轮流分配
+            candidates = [self.replicas[(start + i) % count] for i in range(count)]
+            candidates = [replica for replica in candidates if replica.ejected_until <= now]
+            if not candidates:
+                return None
+            if self._balance == "least_outstanding":
+                replica = min(candidates, key=lambda replica: replica.outstanding)
+            else:
+                replica = candidates[0]
+            replica.outstanding += 1
+            replica.reads += 1
+            return replica
+
+    def release(self, replica):
+        '请求结束'
+        with self._lock:
+            replica.outstanding -= 1
+
+    def eject(self, replica, error=None):
+        '摘除失败的从库，eject_seconds 秒内不再路由到该从库'
+        with self._lock:
+            replica.failures += 1
+            replica.ejected_until = time.time() + self._eject_seconds
+        logger.warning("从库 [%s] 不可用, 摘除 %s 秒: %s", replica.name, self._eject_seconds, error)
+
+    def stats(self):
+        '各从库的路由统计 {名称: {...}}'
+        now = time.time()
+        with self._lock:
+            return {replica.name: {
+                "outstanding": replica.outstanding, "reads": replica.reads,
+                "failures": replica.failures, "ejected": replica.ejected_until > now,
+            } for replica in self.replicas}
+
+
+class Record(object):
+    '''
+    行记录基类，每张表生成一个使用 __slots__ 的子类(见 TableDescriptor.record_class)，
+    比字典占用更少的内存，同时支持属性访问和 record["字段"] 访问
+    '''
+    __slots__ = ()
+    _fields = ()
+
+    def __init__(self, values):
+        for field, value in zip(self._fields, values):
+            object.__setattr__(self, field, value)
+
+    def __getitem__(self, field):
+        try:
+            return getattr(self, field)
+        except AttributeError:
+            raise KeyError(field)
+
+    def __setitem__(self, field, value):
+        setattr(self, field, value)
+
+    def __iter__(self):
+        return iter(self._fields)
+
+    def __len__(self):
+        return len(self._fields)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self._values() == other._values()
+
+    def __repr__(self):
+        return "%s(%s)" % (type(self).__name__, ", ".join(
+            "%s=%r" % (f, getattr(self, f, None)) for f in self._fields))
+
+    def _values(self):
+        return tuple(getattr(self, f, None) for f in self._fields)
+
+    def get(self, field, default=None):
+        return getattr(self, field, default) if field in self._fields else default
+
+    def keys(self):
+        return self._fields
+
+    def _asdict(self):
+        return dict(zip(self._fields, self._values()))
+
+
+class Relation(object):
+    '''
+    表之间的关联(见 BaseDao.add_relation 和 include 参数)
+    - :table: 父表名
+    - :name: 关联名, 关联的行以该名称加入父表的行字典
+    - :column: 父表中的关联字段
+    - :target: 关联表名
+    - :target_column: 关联表中对应的字段(默认: None, 关联表的单一主键)
+    - :many: 是否为一对多(默认: False)。为 False 时加入关联的一行(不存在时为 None)，为 True 时加入行列表
+    '''
+
+    def __init__(self, table, name, column, target, target_column=None, many=False):
+        self.table = table
+        self.name = name
+        self.column = column
+        self.target = target
+        self.target_column = target_column
+        self.many = many
+
+    def __repr__(self):
+        return "Relation(%s.%s: `%s` -> %s.`%s`%s)" % (
+            self.table, self.name, self.column, self.target, self.target_column,
+            ", many" if self.many else "")
+
+
+class TableDescriptor(object):
+    '''
+    表描述对象，加载表结构时编译一次，CRUD 方法直接使用其中的 SQL 片段和字段信息
+    - :name: 表名
+    - :column_dict: {字段名: information_schema.`COLUMNS` 字段信息}, 按字段顺序排列
+    '''
+
+    def __init__(self, name, column_dict):
+        self.name = name
+        self.column_dict = column_dict
+        # 字段元组
+        self.columns = tuple(column_dict.keys())
+        # {字段名: 下标}
+        self.column_index = {column: i for i, column in enumerate(self.columns)}
+        # 查询字段 SQL 片段
+        self.projection = stitch_sequence(self.columns)
+        # 主键字段元组(支持联合主键)
+        self.primary_keys = tuple(
+            c for c, d in column_dict.items() if d["COLUMN_KEY"] == "PRI")
+        # 第一个主键字段
+        self.primary_key = self.primary_keys[0] if self.primary_keys else None
+        # 按主键定位的 WHERE 片段
+        self.pk_where = " WHERE %s" % stitch_sequence(
+            ["`%s`=%%s" % c for c in self.primary_keys], False, " AND ")
+        # 可以为空的字段集合
+        self.nullable = frozenset(
+            c for c, d in column_dict.items() if d["IS_NULLABLE"] == "YES")
+        self._namedtuple_class = None
+        self._record_class = None
+        # {(投影字段, 是否为 Record): 行类}
+        self._projection_classes = {}
+
+    @property
+    def namedtuple_class(self):
+        '''表对应的 namedtuple 类(第一次使用时生成)'''
+        if self._namedtuple_class is None:
+            self._namedtuple_class = namedtuple(
+                "%sRow" % self.name, self.columns, rename=True)
+        return self._namedtuple_class
+
+    @property
+    def record_class(self):
+        '''表对应的 Record 子类(第一次使用时生成)'''
+        if self._record_class is None:
+            self._record_class = type(str("%sRecord" % self.name), (Record,), {
+                "__slots__": self.namedtuple_class._fields,
+                "_fields": self.namedtuple_class._fields})
+        return self._record_class
+
+    def projection_class(self, columns, record=False):
+        '''投影字段对应的 namedtuple 类或 Record 子类(每种字段组合生成一次)'''
+        key = (columns, record)
+        cls = self._projection_classes.get(key)
+        if cls is None:
+            cls = namedtuple("%sRow" % self.name, columns, rename=True)
+            if record:
+                cls = type(str("%sRecord" % self.name), (Record,), {
+                    "__slots__": cls._fields, "_fields": cls._fields})
+            self._projection_classes[key] = cls
+        return cls
+
+    def projection_columns(self, columns=None):
+        '''校验投影字段, 返回字段元组
+        - :columns: 字段名列表或单个字段名, 为 None 时返回全部字段
+        '''
+        if columns is None:
+            return self.columns
+        if isinstance(columns, str):
+            columns = (columns,)
+        columns = tuple(columns)
+        if not columns:
+            raise ValueError("Parameter [columns] can not be empty.")
+        unknown = [c for c in columns if c not in self.column_index]
+        if unknown:
+            raise ValueError("Columns %s not in [%s]." % (unknown, self.name))
+        return columns
+
+    def key_values(self, value):
+        '''将主键值转换为与 primary_keys 对应的元组
+        - :value: 单一主键时为主键值，联合主键时为元组或字典
+        '''
+        if isinstance(value, dict):
+            value = tuple(value.get(c) for c in self.primary_keys)
+        elif not isinstance(value, (tuple, list)):
+            value = (value,)
+        if len(value) != len(self.primary_keys):
+            raise ValueError("Primary key of [%s] is %s." % (self.name, self.primary_keys))
+        return tuple(value)
+
+    def single_primary_key(self):
+        '''返回单一主键字段，联合主键时抛出异常'''
+        if len(self.primary_keys) != 1:
+            raise ValueError("[%s] must have a single-column primary key." % self.name)
+        return self.primary_key
+
+    def row_parser(self, row_format, columns=None):
+        '''获取行解析函数
+        - :row_format: 行格式, 见 BaseDao.ROW_FORMATS
+        - :columns: 投影字段(默认: None, 全部字段)
+        '''
+        columns = self.projection_columns(columns)
+        if columns != self.columns:
+            if row_format == "dict":
+                return lambda result: dict(zip(columns, result))
+            elif row_format == "tuple":
+                return tuple
+            elif row_format == "namedtuple":
+                return self.projection_class(columns)._make
+            elif row_format == "record":
+                return self.projection_class(columns, True)
+            raise ValueError("Parameter [row_format] must be one of %s." % (BaseDao.ROW_FORMATS,))
+        if row_format == "dict":
+            columns = self.columns
+            return lambda result: dict(zip(columns, result))
+        elif row_format == "tuple":
+            return tuple
+        elif row_format == "namedtuple":
+            return self.namedtuple_class._make
+        elif row_format == "record":
+            return self.record_class
+        raise ValueError("Parameter [row_format] must be one of %s." % (BaseDao.ROW_FORMATS,))
+
+    def select_sql(self, filters=None, columns=None):
+        '''查询语句, 返回 (SQL 模板, 参数列表)
+        - :columns: 投影字段(默认: None, 全部字段)
+        '''
+        projection = self.projection if columns is None else \
+            stitch_sequence(self.projection_columns(columns))
+        return QueryUtil.query_sql(
+            "SELECT %s FROM %s" % (projection, self.name), filters or {})
+
+    def select_pk_sql(self, value):
+        '''按主键查询的语句, 返回 (SQL 模板, 参数列表)'''
+        return self.select_sql(dict(zip(self.primary_keys, self.key_values(value))))
+
+    def select_pks_batches(self, keys, chunk_size=1000):
+        '''按主键批量查询的语句, 按 chunk_size 分块生成 (SQL 模板, 参数列表)'''
+        return self.select_in_batches(self.single_primary_key(), keys, chunk_size)
+
+    def select_in_batches(self, column, values, chunk_size=1000):
+        '''按字段值批量查询的语句(`column` IN (...)), 按 chunk_size 分块生成 (SQL 模板, 参数列表)'''
+        if chunk_size is None or chunk_size <= 0:
+            raise ValueError("Parameter [chunk_size] must be greater than 0.")
+        values = list(values)
+        for i in range(0, len(values), chunk_size):
+            yield self.select_sql({QueryUtil.IN + column: values[i:i + chunk_size]})
+
+    def count_sql(self, filters=None):
+        '''按过滤条件统计记录数的语句(忽略分组、排序和分页), 返回 (SQL 模板, 参数列表)'''
+        filters = {k: v for k, v in (filters or {}).items() if k not in QueryUtil.RESERVED}
+        return QueryUtil.query_sql("SELECT count(*) FROM `%s`" % (self.name), filters)
+
+    def aggregate_sql(self, aggregates, filters=None, groupby=None):
+        '''聚合查询语句, 返回 (SQL 模板, 参数列表, 结果字段元组)
+        - :aggregates: {别名: 聚合表达式}, 如 {"n": "COUNT(*)", "total": "SUM(`amount`)"}，
+        表达式原样拼接到 SQL 中(其中的 % 转义为 %%)，不能来自用户输入
+        - :groupby: 分组字段名或字段名列表, 分组字段排在结果字段的前面
+        '''
+        if not aggregates:
+            raise ValueError("Parameter [aggregates] can not be empty.")
+        for alias in aggregates:
+            if not re.match(r"^\w+$", alias):
+                raise ValueError("Invalid aggregate alias [%s]." % alias)
+        group_columns = self.projection_columns(groupby) if groupby else ()
+        selects = ["`%s`" % c for c in group_columns]
+        # SQL 模板使用 %s 占位，表达式中的 %(如 DATE_FORMAT 的格式)需要转义
+        selects.extend("%s AS `%s`" % (expr.replace("%", "%%"), alias)
+                       for alias, expr in aggregates.items())
+        filters = dict(filters or {})
+        filters.pop("page", None)
+        if group_columns:
+            filters[QueryUtil.GROUP] = stitch_sequence(group_columns)
+        sql, params = QueryUtil.query_sql(
+            "SELECT %s FROM `%s`" % (stitch_sequence(selects, False), self.name), filters)
+        return sql, params, group_columns + tuple(aggregates)
+
+    def key_range_sql(self, filters=None):
+        '''满足过滤条件的单一主键最小值和最大值的语句, 返回 (SQL 模板, 参数列表)'''
+        primary_key = self.single_primary_key()
+        filters = {k: v for k, v in (filters or {}).items() if k not in QueryUtil.RESERVED}
+        return QueryUtil.query_sql("SELECT MIN(`%s`), MAX(`%s`) FROM `%s`" % (
+            primary_key, primary_key, self.name), filters)
+
+    def key_at_sql(self, filters=None):
+        '''按主键排序后第 n 个主键值的语句, 返回 (SQL 模板, 参数列表)，执行时追加参数 n'''
+        primary_key = self.single_primary_key()
+        filters = {k: v for k, v in (filters or {}).items() if k not in QueryUtil.RESERVED}
+        filters[QueryUtil.ORDER] = primary_key
+        sql, params = self.select_sql(filters, (primary_key,))
+        return sql + " LIMIT %s,1", params
+
+    def range_filters(self, filters, lower, upper, inclusive=False):
+        '''在过滤条件上增加主键范围 lower <= 主键 < upper(inclusive 为 True 时 <= upper)'''
+        primary_key = self.single_primary_key()
+        filters = dict(filters or {})
+        filters[QueryUtil.GE + primary_key] = lower
+        filters[(QueryUtil.LE if inclusive else QueryUtil.LT) + primary_key] = upper
+        return filters
+
+    def page_columns(self, page, filters=None, columns=None):
+        '''分页查询的投影字段, 返回字段元组或 None(全部字段)
+        - KeysetPage 没有指定 key 时使用 orderby 字段或单一主键
+        - KeysetPage 的 key 不在投影字段中时追加到最后
+        '''
+        if isinstance(page, KeysetPage) and page.key is None:
+            page.key = (filters or {}).get(QueryUtil.ORDER) or self.single_primary_key()
+        if columns is None:
+            return None
+        columns = self.projection_columns(columns)
+        if isinstance(page, KeysetPage) and page.key not in columns:
+            columns += (page.key,)
+        return columns
+
+    def page_sql(self, page, filters=None, columns=None):
+        '''分页查询语句, 返回 (SQL 模板, 参数列表)
+        - :columns: 投影字段(默认: None, 全部字段), 见 page_columns
+        '''
+        columns = self.page_columns(page, filters, columns)
+        filters = dict(filters or {})
+        filters["page"] = page
+        return self.select_sql(filters, columns)
+
+    def insert_sql(self, obj):
+        '''保存语句, 返回 (SQL 模板, 参数列表)
+        - 单一主键且 obj 中没有主键时插入 None(自增)
+        '''
+        if len(self.primary_keys) == 1 and self.primary_key not in obj.keys():
+            obj[self.primary_key] = None
+        return QueryUtil.insert_sql(self.name, tuple(obj.keys())), list(obj.values())
+
+    def insert_batches(self, objs, batch_size=500, ignore=False, on_duplicate=None):
+        '''批量保存语句, 按字段集合分组后逐批生成 (SQL 模板, 参数列表)，参数见 BaseDao.save_many'''
+        if batch_size is None or batch_size <= 0:
+            raise ValueError("Parameter [batch_size] must be greater than 0.")
+        groups = {}
+        for obj in objs or []:
+            groups.setdefault(frozenset(obj.keys()), (tuple(obj.keys()), []))[1].append(obj)
+        for columns, rows in groups.values():
+            update_columns = None
+            if on_duplicate is True:
+                update_columns = tuple(c for c in columns if c not in self.primary_keys)
+            elif on_duplicate:
+                update_columns = tuple(on_duplicate)
+            for i in range(0, len(rows), batch_size):
+                batch = rows[i:i + batch_size]
+                sql = QueryUtil.insert_sql(self.name, columns, len(batch), ignore, update_columns)
+                yield sql, [obj[column] for obj in batch for column in columns]
+
+    def update_sql(self, obj, selective=False):
+        '''按主键更新的语句, 返回 (SQL 模板, 参数列表)
+        - :selective: 为 True 时跳过空值，否则不可为空的字段将空值更新为 ''
+        '''
+        for primary_key in self.primary_keys:
+            if obj.get(primary_key) is None:
+                raise ValueError("Parameter [obj.%s] is None." % primary_key)
+        kv_list = []
+        params = []
+        for key, value in obj.items():
+            if key not in self.primary_keys:
+                if value is None:
+                    if selective:
+                        continue
+                    if key not in self.nullable:
+                        value = ""
+                kv_list.append("`%s`=%%s" % (key))
+                params.append(value)
+        params.extend(self.key_values(obj))
+        sql = "UPDATE `%s` SET %s%s" % (
+            self.name, stitch_sequence(kv_list, False), self.pk_where)
+        return sql, params
+
+    def update_batches(self, objs, batch_size=500):
+        '''批量按主键更新的语句, 逐批生成 (SQL 模板, 参数列表)，参数见 BaseDao.update_many_by_primarykey'''
+        if batch_size is None or batch_size <= 0:
+            raise ValueError("Parameter [batch_size] must be greater than 0.")
+        primary_key = self.single_primary_key()
+        groups = {}
+        for obj in objs or []:
+            if obj.get(primary_key) is None:
+                raise ValueError("Parameter [obj.%s] is None." % primary_key)
+            columns = tuple(k for k in obj.keys() if k != primary_key)
+            if columns:
+                groups.setdefault(frozenset(columns), (columns, []))[1].append(obj)
+        for columns, rows in groups.values():
+            for i in range(0, len(rows), batch_size):
+                batch = rows[i:i + batch_size]
+                params = []
+                for column in columns:
+                    nullable = column in self.nullable
+                    for obj in batch:
+                        value = obj[column]
+                        if value is None and not nullable:
+                            value = ""
+                        params.extend((obj[primary_key], value))
+                sql = QueryUtil.update_case_sql(self.name, primary_key, columns, len(batch))
+                sql, where_params = QueryUtil.query_sql(
+                    sql, {QueryUtil.IN + primary_key: [obj[primary_key] for obj in batch]})
+                yield sql, params + where_params
+
+    def update_rows_sql(self, objs):
+        '''按主键更新多行的语句(write-behind 刷新使用), 逐条生成 (SQL 模板, 参数列表)
+        - 单一主键的表按字段集合生成 CASE WHEN 批量更新，联合主键逐行更新
+        '''
+        if len(self.primary_keys) == 1:
+            return self.update_batches(objs)
+        return (self.update_sql(obj) for obj in objs)
+
+    def delete_sql(self, value):
+        '''按主键删除的语句, 返回 (SQL 模板, 参数列表)'''
+        if value is None:
+            raise ValueError("Parameter [value] can not be None.")
+        return "DELETE FROM `%s`%s" % (self.name, self.pk_where), self.key_values(value)
+
+    def delete_batches(self, values, chunk_size=1000):
+        '''批量按主键删除的语句, 按 chunk_size 分块生成 (SQL 模板, 参数列表)'''
+        if values is None:
+            raise ValueError("Parameter [values] can not be None.")
+        if chunk_size is None or chunk_size <= 0:
+            raise ValueError("Parameter [chunk_size] must be greater than 0.")
+        primary_key = self.single_primary_key()
+        values = list(values)
+        for i in range(0, len(values), chunk_size):
+            yield QueryUtil.query_sql(
+                "DELETE FROM `%s`" % (self.name),
+                {QueryUtil.IN + primary_key: values[i:i + chunk_size]})
+
+
+class SchemaRegistry(object):
+    '''
+    进程内共享的表结构注册表，同一 (host, port, database) 的所有 BaseDao 共用一份(见 get_schema_registry)
+    - 更新时整体替换字典(写时复制)，读取时不需要加锁
+    - :database: 数据库名
+    - :ttl: 表结构的有效秒数(默认: None, 永久有效), 过期的表在下次使用时重新加载
+    '''
+    # 查询 information_schema.`COLUMNS` 中的列
+    INFORMATION_SCHEMA_COLUMNS_SQL = """   SELECT COLUMN_NAME
+                    FROM information_schema.`COLUMNS`
+                    WHERE TABLE_SCHEMA='information_schema' AND TABLE_NAME='COLUMNS'
+                """
+
+    # 从 information_schema.`TABLES` 读取估算的记录数
+    TABLE_ROWS_SQL = """   SELECT TABLE_ROWS FROM information_schema.`TABLES`
+                    WHERE TABLE_SCHEMA=%s AND TABLE_NAME=%s
+                """
+
+    def __init__(self, database, ttl=None):
+        self.database = database
+        self.ttl = ttl
+        # information_schema.`COLUMNS` 中的列
+        self.information_schema_columns = []
+        # {表名: {字段名: 字段信息}}
+        self.table_dict = {}
+        # {表名: [字段名]}
+        self.table_column_dict_list = {}
+        # {表名: TableDescriptor}
+        self.descriptors = {}
+        # {表名: {索引名: (字段, ...)}}, 只在开启 advisor 时加载
+        self.indexes = {}
+        # 外键列表 [(表名, 字段, 关联表名, 关联字段)], 第一次推断关联时加载
+        self.foreign_keys = None
+        # 磁盘缓存的表结构指纹
+        self.fingerprint = None
+        # 是否已经读取过磁盘缓存
+        self.cache_loaded = False
+        # 是否已经加载整个数据库
+        self.all_loaded = False
+        self._loaded_at = {}
+        self._lock = threading.Lock()
+
+    def columns_sql(self, table_names=None):
+        '''加载表结构的 (SQL, 参数)，需要先加载 information_schema_columns
+        - :table_names: 表名列表, 使用一条 TABLE_NAME IN (...) 查询；为 None 时加载整个数据库
+        '''
+        stitch_str = stitch_sequence(self.information_schema_columns)
+        sql = "SELECT %s FROM information_schema.`COLUMNS`" % (stitch_str)
+        filters = {"TABLE_SCHEMA": self.database, QueryUtil.ORDER: "ORDINAL_POSITION"}
+        if table_names is not None:
+            filters[QueryUtil.IN + "TABLE_NAME"] = list(table_names)
+        return QueryUtil.query_sql(sql, filters)
+
+    def parse_columns(self, column_tuple, table_names=None):
+        '''解析 columns_sql 的查询结果并更新注册表
+        - :column_tuple: 查询结果
+        - :table_names: 查询的表名列表, 为 None 时表示整个数据库
+        - :return: {表名: {字段名: 字段信息}}
+        '''
+        table_dict = {}
+        for column in column_tuple or []:
+            column_dict_item = {key: value for key, value in zip(
+                self.information_schema_columns, column)}
+            table_dict.setdefault(column_dict_item["TABLE_NAME"], {})[
+                column_dict_item["COLUMN_NAME"]] = column_dict_item
+        self.update(table_dict, table_names is None)
+        return table_dict
+
+    def missing(self, table_names):
+        '''返回未加载或已过期的表'''
+        if self.ttl is None:
+            return [t for t in table_names if t not in self.table_dict]
+        expire = time.time() - self.ttl
+        return [t for t in table_names if self._loaded_at.get(t, 0) <= expire]
+
+    def update(self, table_dict, all_loaded=False):
+        '''更新表结构
+        - :table_dict: {表名: {字段名: 字段信息}}
+        - :all_loaded: 是否为整个数据库的表结构
+        '''
+        now = time.time()
+        with self._lock:
+            new_table_dict = dict(self.table_dict)
+            new_table_dict.update(table_dict)
+            new_column_dict_list = dict(self.table_column_dict_list)
+            new_descriptors = dict(self.descriptors)
+            for table, column_dict in table_dict.items():
+                new_column_dict_list[table] = [column for column in column_dict.keys()]
+                new_descriptors[table] = TableDescriptor(table, column_dict)
+                self._loaded_at[table] = now
+            self.table_dict = new_table_dict
+            self.table_column_dict_list = new_column_dict_list
+            self.descriptors = new_descriptors
+            self.all_loaded = self.all_loaded or all_loaded
+
+    def update_indexes(self, indexes):
+        '''更新索引结构
+        - :indexes: {表名: {索引名: (字段, ...)}}
+        '''
+        with self._lock:
+            new_indexes = dict(self.indexes)
+            new_indexes.update(indexes)
+            self.indexes = new_indexes
+
+    def invalidate(self, table_name=None):
+        '''使表结构失效, 下次使用时重新加载
+        - :table_name: 表名(默认: None, 使所有表失效)
+        '''
+        with self._lock:
+            if table_name is None:
+                self.table_dict = {}
+                self.table_column_dict_list = {}
+                self.descriptors = {}
+                self.indexes = {}
+                self.foreign_keys = None
+                self._loaded_at = {}
+            else:
+                self.indexes = {k: v for k, v in self.indexes.items() if k != table_name}
+                self.table_dict = {k: v for k, v in self.table_dict.items() if k != table_name}
+                self.table_column_dict_list = {
+                    k: v for k, v in self.table_column_dict_list.items() if k != table_name}
+                self.descriptors = {
+                    k: v for k, v in self.descriptors.items() if k != table_name}
+                self._loaded_at.pop(table_name, None)
+            self.all_loaded = False
+
+
+# 按 (host, port, database) 缓存的表结构注册表
+_schema_registries = {}
+_schema_registries_lock = threading.Lock()
+
+
+def get_schema_registry(host, port, database, ttl=None):
+    '''
+    获取 (host, port, database) 对应的表结构注册表，不存在时创建
+    - :ttl: 表结构的有效秒数，只在首次创建时生效
+    '''
+    key = (host, port, database)
+    with _schema_registries_lock:
+        registry = _schema_registries.get(key)
+        if registry is None:
+            registry = _schema_registries[key] = SchemaRegistry(database, ttl)
+        return registry
+
+
+class Dialect(object):
+    '''
+    数据库方言，封装连接参数、SQL 转换、事务开始、表结构读取等与数据库相关的部分
+    - 生成的 SQL 统一使用 MySQL 写法(反引号、%s 占位、LIMIT offset,size)，方言不参与 SQL 生成，
+    由 convert 转换为目标数据库可以执行的语句
+    '''
+    # 方言名称
+    name = None
+    # 是否需要 host、port、user、password
+    requires_server = True
+
+    def connect_config(self, creator, host, port, user, password, database, charset):
+        '''传给 creator.connect 的参数(包含 creator)'''
+        raise NotImplementedError
+
+    def convert(self, sql):
+        '''将 MySQL 写法的 SQL 模板转换为目标数据库的语句'''
+        return sql
+
+    def params(self, params):
+        '''转换传给 cursor.execute 的参数'''
+        return params
+
+    def affected_rows(self, cursor, result):
+        '''更新语句的影响行数, result 为 cursor.execute 的返回值'''
+        return result
+
+    def begin(self, conn):
+        '''在连接上开始事务(transaction 最外层调用)
+        - MySQL 连接关闭了 autocommit，第一条语句隐式开始事务，不需要执行
+        '''
+
+    def is_disconnect(self, error):
+        '''错误是否表示连接已断开(需要重新连接)'''
+        return False
+
+    def is_transient(self, error):
+        '''错误是否为暂时性错误(幂等的查询可以重试)'''
+        return self.is_disconnect(error)
+
+    def load_tables(self, dao, table_names=None):
+        '''读取表结构并更新 dao 的表结构注册表, 依次执行 load_tables_steps 生成的查询
+        - :table_names: 表名列表, 为 None 时加载整个数据库
+        - :return: {表名: {字段名: 字段信息}}, 字段信息的 key 与 information_schema.`COLUMNS` 一致
+        '''
+        steps = self.load_tables_steps(dao, table_names)
+        result = None
+        try:
+            while True:
+                sql, params = steps.send(result)
+                result = dao.execute_query(sql, params=params)
+        except StopIteration as e:
+            return e.value
+
+    def load_tables_steps(self, dao, table_names=None):
+        '''读取表结构的生成器, 不执行 SQL: 生成 (SQL, 参数)，接收查询结果，结束时返回 load_tables 的结果
+        - 同步的 load_tables 和 AsyncBaseDao 共用
+        '''
+        raise NotImplementedError
+
+    def load_data_sql(self, table_name, path, columns, file_format, header=False, ignore=False,
+                      charset=None):
+        '''从客户端文件批量导入的语句, 返回 (SQL, 参数列表)；不支持时返回 None，由 bulk_load 使用多行 INSERT'''
+        return None
+
+    def is_load_data_disabled(self, error):
+        '''错误是否表示服务端或客户端禁用了 LOAD DATA LOCAL INFILE'''
+        return False
+
+    def load_indexes(self, dao, table_names=None):
+        '''读取索引结构
+        - :table_names: 表名列表, 为 None 时加载整个数据库
+        - :return: {表名: {索引名: (字段, ...)}}, 字段按在索引中的顺序排列
+        '''
+        raise NotImplementedError
+
+    def load_foreign_keys(self, dao):
+        '''读取整个数据库的单字段外键
+        - :return: [(表名, 字段, 关联表名, 关联字段)]，关联字段为 None 表示关联表的主键
+        '''
+        raise NotImplementedError
+
+    def explain(self, dao, sql, params=None):
+        '''执行计划
+        - :return: {"rows": 估算的扫描行数(未知时为 None), "full_scan": 是否全表扫描, "plan": [执行计划的行字典]}
+        '''
+        raise NotImplementedError
+
+    def fingerprint(self, dao):
+        '''表结构版本指纹, 用于磁盘缓存'''
+        raise NotImplementedError
+
+    def estimate_count_sql(self, database, table_name):
+        '''估算记录数的语句, 返回 (SQL, 参数)，没有估算值时返回 None(使用精确 count)'''
+        return None
+
+    def estimate_count(self, dao, table_name):
+        '''估算的记录数, 没有估算语句时使用精确 count'''
+        statement = self.estimate_count_sql(dao._database, table_name)
+        if statement is None:
+            return dao._count_filters(table_name, {})
+        result = dao.execute_query(statement[0], True, statement[1])
+        return (result[0] or 0) if result else 0
+
+
+class MySQLDialect(Dialect):
+    '''MySQL/MariaDB 方言, 表结构从 information_schema 读取'''
+    name = "mysql"
+    # 连接断开的错误码: 2006 server has gone away, 2013/2055 lost connection
+    DISCONNECT_CODES = frozenset((2006, 2013, 2055))
+    # 可以重试的错误码: 连接断开、2003 无法连接、1040 连接数过多、1205 锁等待超时、1213 死锁
+    TRANSIENT_CODES = DISCONNECT_CODES | frozenset((2003, 1040, 1205, 1213))
+    # 禁用 LOAD DATA LOCAL INFILE 的错误码: 1148 命令不允许、3948 服务端禁用、2068 客户端拒绝
+    LOAD_DATA_DISABLED_CODES = frozenset((1148, 3948, 2068))
+
+    @staticmethod
+    def _error_code(error):
+        '''驱动异常的错误码(pymysql 的 args[0])'''
+        if type(error).__name__ not in ("OperationalError", "InterfaceError", "InternalError"):
+            return None
+        return error.args[0] if error.args else None
+
+    def is_disconnect(self, error):
+        code = self._error_code(error)
+        # pymysql 在已关闭的连接上执行时抛出 InterfaceError(0, '')
+        return code in self.DISCONNECT_CODES or (
+            code == 0 and type(error).__name__ == "InterfaceError")
+
+    def is_transient(self, error):
+        return self.is_disconnect(error) or self._error_code(error) in self.TRANSIENT_CODES
+
+    def connect_config(self, creator, host, port, user, password, database, charset):
+        if host is None:
+            raise ValueError("Parameter [host] is None.")
+        if port is None:
+            raise ValueError("Parameter [port] is None.")
+        if user is None:
+            raise ValueError("Parameter [user] is None.")
+        if password is None:
+            raise ValueError("Parameter [password] is None.")
+        return {
+            "creator": creator, "charset": charset, "host": host, "port": port,
+            "user": user, "password": password, "database": database
+        }
+
+    def load_data_sql(self, table_name, path, columns, file_format, header=False, ignore=False,
+                      charset=None):
+        '''LOAD DATA LOCAL INFILE, 需要连接参数 local_infile=True(见 BaseDao 的 local_infile 参数)'''
+        sql = "LOAD DATA LOCAL INFILE %%s %sINTO TABLE `%s`%s %s%s (%s)" % (
+            "IGNORE " if ignore else "", table_name,
+            " CHARACTER SET %s" % charset if charset else "", file_format.LOAD_DATA_OPTIONS,
+            " IGNORE 1 LINES" if header else "", stitch_sequence(columns))
+        return sql, [path]
+
+    def is_load_data_disabled(self, error):
+        return self._error_code(error) in self.LOAD_DATA_DISABLED_CODES
+
+    def load_tables_steps(self, dao, table_names=None):
+        schema = dao._schema
+        if not schema.information_schema_columns:
+            result_tuple = yield SchemaRegistry.INFORMATION_SCHEMA_COLUMNS_SQL, None
+            schema.information_schema_columns = [r[0] for r in result_tuple or []]
+        result_tuple = yield schema.columns_sql(table_names)
+        return schema.parse_columns(result_tuple, table_names)
+
+    def load_indexes(self, dao, table_names=None):
+        '''从 information_schema.`STATISTICS` 读取'''
+        filters = {"TABLE_SCHEMA": dao._database}
+        if table_names is not None:
+            filters[QueryUtil.IN + "TABLE_NAME"] = list(table_names)
+        sql, params = QueryUtil.query_sql(
+            "SELECT TABLE_NAME, INDEX_NAME, SEQ_IN_INDEX, COLUMN_NAME "
+            "FROM information_schema.`STATISTICS`", filters)
+        indexes = {table_name: {} for table_name in table_names or ()}
+        for table_name, index_name, _, column in sorted(
+                dao.execute_query(sql, params=params) or (), key=lambda r: r[:3]):
+            indexes.setdefault(table_name, {}).setdefault(index_name, []).append(column)
+        return {table_name: {name: tuple(columns) for name, columns in table_indexes.items()}
+                for table_name, table_indexes in indexes.items()}
+
+    def load_foreign_keys(self, dao):
+        '''从 information_schema.`KEY_COLUMN_USAGE` 读取同一数据库内的外键, 多字段外键被忽略'''
+        sql = """   SELECT TABLE_NAME, CONSTRAINT_NAME, COLUMN_NAME, REFERENCED_TABLE_NAME, REFERENCED_COLUMN_NAME
+                    FROM information_schema.`KEY_COLUMN_USAGE`
+                    WHERE TABLE_SCHEMA=%s AND REFERENCED_TABLE_SCHEMA=%s AND REFERENCED_TABLE_NAME IS NOT NULL
+                """
+        constraints = OrderedDict()
+        for table_name, constraint, column, target, target_column in dao.execute_query(
+                sql, params=(dao._database, dao._database)) or ():
+            constraints.setdefault((table_name, constraint), []).append(
+                (table_name, column, target, target_column))
+        return [columns[0] for columns in constraints.values() if len(columns) == 1]
+
+    def explain(self, dao, sql, params=None):
+        '''EXPLAIN 的 type 为 ALL 时为全表扫描, rows 为各表估算行数之和'''
+        plan = dao._query_dicts("EXPLAIN " + sql, params)
+        rows = [int(p["rows"]) for p in plan if p.get("rows") is not None]
+        return {"rows": sum(rows) if rows else None,
+                "full_scan": any(p.get("type") == "ALL" for p in plan), "plan": plan}
+
+    def fingerprint(self, dao):
+        '''按表数量和最后建表时间计算(不使用 UPDATE_TIME, 它会随数据写入变化)'''
+        sql = """   SELECT COUNT(*), MAX(CREATE_TIME) FROM information_schema.`TABLES`
+                    WHERE TABLE_SCHEMA=%s
+                """
+        result = dao.execute_query(sql, True, (dao._database,))
+        return None if result is None else "%s|%s" % tuple(result)
+
+    def estimate_count_sql(self, database, table_name):
+        '''从 information_schema.`TABLES` 读取估算的记录数'''
+        return SchemaRegistry.TABLE_ROWS_SQL, (database, table_name)
+
+
+class SQLiteDialect(Dialect):
+    '''
+    SQLite 方言(creator 为 sqlite3), 用于单元测试和本地缓存
+    - database 为文件路径或 ":memory:"，连接池模式下 ":memory:" 使用进程内共享缓存的内存数据库
+    - 表结构从 sqlite_master 和 PRAGMA table_info 读取
+    - SQLite 本身支持反引号和 LIMIT offset,size，只转换占位符、INSERT IGNORE 和 ON DUPLICATE KEY UPDATE
+    '''
+    name = "sqlite"
+    requires_server = False
+    # 模拟的 information_schema.`COLUMNS` 的列
+    COLUMNS = ("TABLE_SCHEMA", "TABLE_NAME", "COLUMN_NAME", "ORDINAL_POSITION",
+               "DATA_TYPE", "COLUMN_KEY", "IS_NULLABLE")
+    # 内存数据库在连接池模式下使用的共享缓存 URI
+    SHARED_MEMORY = "file:basedao_memory?mode=memory&cache=shared"
+
+    def connect_config(self, creator, host, port, user, password, database, charset):
+        return {"creator": creator, "database": database, "check_same_thread": False}
+
+    @staticmethod
+    def _quote(identifier):
+        '''引用 PRAGMA 语句中的表名、索引名'''
+        return '"%s"' % identifier.replace('"', '""')
+
+    @lru_cache(maxsize=1024)
+    def convert(self, sql):
+        sql = re.sub(r"%[s%]", lambda m: "?" if m.group() == "%s" else "%", sql)
+        if sql.startswith("INSERT IGNORE "):
+            sql = "INSERT OR IGNORE " + sql[len("INSERT IGNORE "):]
+        index = sql.find(" ON DUPLICATE KEY UPDATE ")
+        if index >= 0:
+            update = sql[index + len(" ON DUPLICATE KEY UPDATE "):]
+            sql = "%s ON CONFLICT DO UPDATE SET %s" % (
+                sql[:index], re.sub(r"VALUES\((`[^`]+`)\)", r"excluded.\1", update))
+        return sql
+
+    def params(self, params):
+        return () if params is None else params
+
+    def begin(self, conn):
+        # sqlite3 只在 INSERT/UPDATE/DELETE 前隐式开始事务，事务外的 SAVEPOINT 会自己开始事务并在 RELEASE 时提交
+        cursor = conn.cursor()
+        try:
+            cursor.execute("BEGIN")
+        finally:
+            cursor.close()
+
+    def is_transient(self, error):
+        return type(error).__name__ == "OperationalError" and (
+            "locked" in str(error) or "busy" in str(error))
+
+    def affected_rows(self, cursor, result):
+        return cursor.rowcount
+
+    def load_tables_steps(self, dao, table_names=None):
+        schema = dao._schema
+        schema.information_schema_columns = list(self.COLUMNS)
+        names = table_names
+        if names is None:
+            result_tuple = yield (
+                "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%%'", None)
+            names = [r[0] for r in result_tuple or []]
+        column_tuple = []
+        for table_name in names:
+            sql = "PRAGMA table_info(%s)" % self._quote(table_name)
+            for cid, name, data_type, notnull, _, pk in (yield sql, None) or ():
+                column_tuple.append((dao._database, table_name, name, cid + 1,
+                                     (data_type or "").lower(), "PRI" if pk else "",
+                                     "NO" if notnull or pk else "YES"))
+        return schema.parse_columns(column_tuple, table_names)
+
+    def load_indexes(self, dao, table_names=None):
+        '''从 PRAGMA index_list 和 PRAGMA index_info 读取, 整数主键作为 PRIMARY 索引'''
+        names = table_names
+        if names is None:
+            result_tuple = dao.execute_query(
+                "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%%'")
+            names = [r[0] for r in result_tuple or []]
+        indexes = {}
+        for table_name in names:
+            table_indexes = indexes[table_name] = {}
+            primary_keys = [(pk, name) for _, name, _, _, _, pk in
+                            dao.execute_query("PRAGMA table_info(%s)" % self._quote(table_name)) or ()
+                            if pk]
+            if primary_keys:
+                table_indexes["PRIMARY"] = tuple(name for _, name in sorted(primary_keys))
+            for index in dao.execute_query("PRAGMA index_list(%s)" % self._quote(table_name)) or ():
+                info = dao.execute_query("PRAGMA index_info(%s)" % self._quote(index[1])) or ()
+                table_indexes[index[1]] = tuple(r[2] for r in sorted(info))
+        return indexes
+
+    def load_foreign_keys(self, dao):
+        '''从 PRAGMA foreign_key_list 读取, 多字段外键被忽略'''
+        result_tuple = dao.execute_query(
+            "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%%'")
+        foreign_keys = []
+        for (table_name,) in result_tuple or ():
+            constraints = OrderedDict()
+            sql = "PRAGMA foreign_key_list(%s)" % self._quote(table_name)
+            for row in dao.execute_query(sql) or ():
+                constraints.setdefault(row[0], []).append((table_name, row[3], row[2], row[4]))
+            foreign_keys.extend(columns[0] for columns in constraints.values() if len(columns) == 1)
+        return foreign_keys
+
+    def explain(self, dao, sql, params=None):
+        '''EXPLAIN QUERY PLAN 没有估算行数, detail 以 SCAN 开头时为全表(或全索引)扫描'''
+        plan = dao._query_dicts("EXPLAIN QUERY PLAN " + sql, params)
+        return {"rows": None, "plan": plan,
+                "full_scan": any(str(p.get("detail", "")).startswith("SCAN") for p in plan)}
+
+    def fingerprint(self, dao):
+        result = dao.execute_query("PRAGMA schema_version", True)
+        return None if result is None else str(result[0])
+
+
+# 方言名称与方言类
+DIALECTS = {"mysql": MySQLDialect, "sqlite": SQLiteDialect}
+
+
+def get_dialect(dialect=None, creator=None):
+    '''
+    获取方言对象
+    - :dialect: 方言名称("mysql"/"sqlite")、Dialect 对象或 None
+    - :creator: dialect 为 None 时按 creator 模块名判断, sqlite3 使用 SQLiteDialect, 其它使用 MySQLDialect
+    '''
+    if isinstance(dialect, Dialect):
+        return dialect
+    if dialect is None:
+        dialect = "sqlite" if getattr(creator, "__name__", "") == "sqlite3" else "mysql"
+    if dialect not in DIALECTS:
+        raise ValueError("Parameter [dialect] must be one of %s." % (tuple(DIALECTS),))
+    return DIALECTS[dialect]()
+
+
+class ResultCache(object):
+    '''
+    查询结果缓存后端接口, 自定义后端(如 Redis)需要实现以下方法
+    - 缓存的值是驱动返回的原始结果(元组)，命中后再按 row_format 解析，调用方修改结果不会影响缓存
+    - key 为 (表名, SQL 模板, 参数元组)
+    '''
+    # 未命中时 get 返回的对象(缓存的值可能是 None)
+    MISS = object()
+
+    def get(self, key):
+        '''读取缓存, 未命中时返回 ResultCache.MISS'''
+        raise NotImplementedError
+
+    def set(self, key, value, ttl):
+        '''写入缓存
+        - :ttl: 有效秒数
+        '''
+        raise NotImplementedError
+
+    def invalidate(self, table_name=None):
+        '''删除表的所有缓存, table_name 为 None 时清空缓存'''
+        raise NotImplementedError
+
+    def stats(self):
+        '''返回统计信息字典, 至少包含 hits 和 misses'''
+        raise NotImplementedError
+
+
+class MemoryResultCache(ResultCache):
+    '''
+    进程内的 LRU 查询结果缓存
+    - :maxsize: 最多缓存的结果数(默认: 1024), 超出时淘汰最久未使用的结果
+    '''
+
+    def __init__(self, maxsize=1024):
+        if maxsize is None or maxsize <= 0:
+            raise ValueError("Parameter [maxsize] must be greater than 0.")
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # {key: (过期时间, 结果)}, 按使用顺序排列
+        self._entries = OrderedDict()
+        # {表名: set(key)}
+        self._table_keys = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                self._remove(key)
+            self.misses += 1
+            return self.MISS
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            self._entries[key] = (time.time() + ttl, value)
+            self._table_keys.setdefault(key[0], set()).add(key)
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        del self._entries[key]
+        keys = self._table_keys.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+
+    def invalidate(self, table_name=None):
+        with self._lock:
+            if table_name is None:
+                self._entries.clear()
+                self._table_keys.clear()
+                return
+            for key in self._table_keys.pop(table_name, ()):
+                self._entries.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "evictions": self.evictions, "size": len(self._entries)}
+
+
+# 按 (host, port, database) 共享的进程内查询结果缓存
+_result_caches = {}
+_result_caches_lock = threading.Lock()
+
+
+def get_result_cache(host, port, database, maxsize=1024):
+    '''
+    获取 (host, port, database) 对应的进程内查询结果缓存，不存在时创建,
+    同一进程中任意 BaseDao 的写操作都会使其它 BaseDao 的缓存失效
+    - :maxsize: 最多缓存的结果数，只在首次创建时生效
+    '''
+    key = (host, port, database)
+    with _result_caches_lock:
+        cache = _result_caches.get(key)
+        if cache is None:
+            cache = _result_caches[key] = MemoryResultCache(maxsize)
+        return cache
+
+
+class ExecuteEvent(object):
+    '''
+    执行 SQL 的事件，传给 before_execute / after_execute 钩子
+    - database / table / method: 数据库名、表名和调用的 BaseDao 方法名(直接调用 execute_* 时表名为 None)
+    - sql / param_count: SQL 模板和参数个数
+    - build_time: 从调用方法(或上一条语句结束)到开始执行的秒数, 即 SQL 构建耗时
+    - row_count / execute_time / fetch_time / error: 只在 after_execute 中有值，
+    fetch_time 为读取结果(更新语句为提交)的秒数
+    '''
+    __slots__ = ("database", "table", "method", "sql", "param_count", "build_time",
+                 "row_count", "execute_time", "fetch_time", "error")
+
+    def __init__(self, database, table, method, sql, params, build_time=0.0):
+        self.database = database
+        self.table = table
+        self.method = method
+        self.sql = sql
+        self.param_count = len(params) if params else 0
+        self.build_time = build_time
+        self.row_count = None
+        self.execute_time = None
+        self.fetch_time = None
+        self.error = None
+
+
+class LatencyHistogram(object):
+    '''固定分桶的耗时直方图(毫秒)'''
+    # 各个桶的上界(毫秒)
+    BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, ms):
+        '''记录一次耗时'''
+        self.counts[bisect_left(self.BUCKETS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        if ms > self.max:
+            self.max = ms
+
+    def percentile(self, p):
+        '''按桶上界估算的百分位耗时(毫秒)'''
+        if not self.count:
+            return 0.0
+        rank = self.count * p / 100.0
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return float(min(self.BUCKETS[i], self.max)) if i < len(self.BUCKETS) else self.max
+        return self.max
+
+    def to_dict(self):
+        '''转换为字典'''
+        labels = ["<=%s" % b for b in self.BUCKETS] + [">%s" % self.BUCKETS[-1]]
+        return {
+            "count": self.count,
+            "total_ms": self.total,
+            "avg_ms": self.total / self.count if self.count else 0.0,
+            "max_ms": self.max,
+            "p50_ms": self.percentile(50),
+            "p90_ms": self.percentile(90),
+            "p99_ms": self.percentile(99),
+            "buckets": {label: n for label, n in zip(labels, self.counts) if n}
+        }
+
+
+class CSVFormat(object):
+    '''
+    bulk_load / bulk_dump 的 CSV 格式
+    - 字段以逗号分隔，包含逗号、双引号、换行或等于 NULL 的字段用双引号包围，其中的双引号写两次
+    - 空值写为不带引号的 NULL(与 LOAD DATA 的规则一致)，读取时 NULL 转换为空值
+    '''
+    name = "csv"
+    # LOAD DATA 的格式子句
+    LOAD_DATA_OPTIONS = "FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' ESCAPED BY '' " \
+        "LINES TERMINATED BY '\\n'"
+
+    @staticmethod
+    def _field(value):
+        if value is None:
+            return "NULL"
+        if isinstance(value, bytes):
+            value = value.decode("utf-8", "replace")
+        value = str(value)
+        if value == "NULL" or any(c in value for c in ',"\r\n'):
+            return '"%s"' % value.replace('"', '""')
+        return value
+
+    def format_row(self, row):
+        '''将一行转换为文件中的一行文本'''
+        return ",".join([self._field(value) for value in row]) + "\n"
+
+    @staticmethod
+    def _quoted_fields(record):
+        '''一条记录的原始文本中各字段是否以双引号包围'''
+        quoted = []
+        start = True
+        in_quotes = False
+        for c in record:
+            if start:
+                quoted.append(c == '"')
+                start = False
+                if c == '"':
+                    in_quotes = True
+                    continue
+            if c == '"':
+                in_quotes = not in_quotes
+            elif c == "," and not in_quotes:
+                start = True
+        if start:
+            quoted.append(False)
+        return quoted
+
+    def read_rows(self, f):
+        '''逐行读取文件, 生成字段列表；不带引号的 NULL 转换为空值, 带引号的 "NULL" 保留为字符串'''
+        lines = []
+
+        def source():
+            for line in f:
+                lines.append(line)
+                yield line
+        for row in csv.reader(source()):
+            if "NULL" in row:
+                quoted = self._quoted_fields("".join(lines))
+                row = [None if value == "NULL" and not is_quoted else value
+                       for value, is_quoted in zip(row, quoted)]
+            del lines[:]
+            yield row
+
+
+class TSVFormat(object):
+    '''
+    bulk_load / bulk_dump 的 TSV 格式(与 LOAD DATA 和 SELECT ... INTO OUTFILE 的默认格式相同)
+    - 字段以制表符分隔，字段中的反斜杠、制表符、换行符用反斜杠转义，空值写为 \\N
+    '''
+    name = "tsv"
+    LOAD_DATA_OPTIONS = "FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n'"
+    # 转义字符与原字符
+    ESCAPES = {"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r", "\0": "\\0"}
+    UNESCAPES = {"\\": "\\", "t": "\t", "n": "\n", "r": "\r", "0": "\0"}
+    ESCAPE_PATTERN = re.compile(r"[\\\t\n\r\0]")
+    UNESCAPE_PATTERN = re.compile(r"\\(.)")
+
+    def _field(self, value):
+        if value is None:
+            return "\\N"
+        if isinstance(value, bytes):
+            value = value.decode("utf-8", "replace")
+        return self.ESCAPE_PATTERN.sub(lambda m: self.ESCAPES[m.group(0)], str(value))
+
+    def format_row(self, row):
+        '''将一行转换为文件中的一行文本'''
+        return "\t".join([self._field(value) for value in row]) + "\n"
+
+    def read_rows(self, f):
+        '''逐行读取文件, 生成字段列表'''
+        unescape = lambda m: self.UNESCAPES.get(m.group(1), m.group(1))
+        for line in f:
+            line = line.rstrip("\n")
+            yield [None if value == "\\N" else self.UNESCAPE_PATTERN.sub(unescape, value)
+                   for value in line.split("\t")]
+
+
+# bulk_load / bulk_dump 支持的文件格式
+FILE_FORMATS = {"csv": CSVFormat(), "tsv": TSVFormat()}
+
+
+class UnindexedQueryError(Exception):
+    '''advisor 为 "raise" 模式时, 查询的过滤条件不能使用索引'''
+
+
+class QueryAdvisor(object):
+    '''
+    索引顾问(见 BaseDao 的 advisor 参数)，按过滤条件结构(即编译后的 SQL 模板)检查查询能否使用索引
+    - 索引结构从 information_schema.`STATISTICS` 读取，与表结构一起缓存在 SchemaRegistry 中
+    - 能使用索引定位的条件: 等于、in、大于/小于、右 like(前缀匹配)，其中至少一个字段是某个索引的第一个字段；
+    不等于、not in、like 和左 like 不能使用索引
+    - orderby 字段不在索引中(或前面的索引字段不全是等于条件)时需要额外排序
+    - :mode: "warn" 第一次遇到不能使用索引的结构时记录 WARNING 日志，"raise" 每次执行前抛出 UnindexedQueryError
+    - :explain: 第一次遇到每种结构时是否执行 EXPLAIN，记录估算的扫描行数(默认: False)
+    '''
+    MODES = ("warn", "raise")
+
+    def __init__(self, mode="warn", explain=False):
+        if mode not in self.MODES:
+            raise ValueError("Parameter [mode] must be one of %s." % (self.MODES,))
+        self.mode = mode
+        self.explain = explain
+        # {SQL 模板: 结构统计}
+        self._shapes = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def analyze(indexes, filters):
+        '''检查过滤条件能否使用索引
+        - :indexes: {索引名: (字段, ...)}
+        - :filters: QueryUtil 过滤条件
+        - :return: 问题列表, 为空表示可以使用索引
+        '''
+        filters = filters or {}
+        conditions = [QueryUtil.split_key(key) for key, value in filters.items()
+                      if key not in QueryUtil.RESERVED and value is not None]
+        leading = {columns[0] for columns in indexes.values() if columns}
+        issues = []
+        for prefix, column in conditions:
+            if prefix in (QueryUtil.LIKE, QueryUtil.LEFT_LIKE):
+                issues.append("`%s` 以通配符开头的 LIKE 不能使用索引" % column)
+        sargable = [column for prefix, column in conditions if prefix in (
+            "", QueryUtil.IN, QueryUtil.LT, QueryUtil.LE, QueryUtil.GT, QueryUtil.GE,
+            QueryUtil.RIGHT_LIKE)]
+        if conditions and not leading.intersection(sargable):
+            issues.append("过滤字段 %s 没有可以使用索引的条件" % [c for _, c in conditions])
+        order = filters.get(QueryUtil.ORDER)
+        if order:
+            equals = {column for prefix, column in conditions if prefix == ""}
+            if not any(order in columns and set(columns[:columns.index(order)]) <= equals
+                       for columns in indexes.values()):
+                issues.append("排序字段 `%s` 不能使用索引" % order)
+        return issues
+
+    def check(self, dao, table_name, filters, sql, params):
+        '''执行查询前检查, 第一次遇到的结构按 mode 记录日志并按 explain 执行 EXPLAIN'''
+        shape = self._shapes.get(sql)
+        if shape is None:
+            issues = self.analyze(dao._get_indexes(table_name), filters)
+            shape = {"table": table_name, "sql": sql, "issues": issues, "count": 0,
+                     "total_ms": 0.0, "max_ms": 0.0, "rows_examined": None, "full_scan": None}
+            if self.explain:
+                try:
+                    plan = dao._dialect.explain(dao, sql, params)
+                    shape["rows_examined"] = plan["rows"]
+                    shape["full_scan"] = plan["full_scan"]
+                    if plan["full_scan"] and not issues:
+                        issues.append("EXPLAIN 显示全表扫描")
+                except Exception as e:
+                    logger.warning("[%s] EXPLAIN 失败: %s", table_name, e)
+            with self._lock:
+                shape = self._shapes.setdefault(sql, shape)
+            if issues and self.mode == "warn":
+                logger.warning("[%s] 查询不能使用索引: %s >>> %s", table_name, "; ".join(issues), sql)
+        if shape["issues"] and self.mode == "raise":
+            raise UnindexedQueryError("[%s] %s >>> %s" % (table_name, "; ".join(shape["issues"]), sql))
+
+    def record(self, event):
+        '''after_execute 钩子, 按 SQL 模板累计执行次数和耗时'''
+        shape = self._shapes.get(event.sql)
+        if shape is None:
+            return
+        elapsed = ((event.execute_time or 0) + (event.fetch_time or 0)) * 1000
+        with self._lock:
+            shape["count"] += 1
+            shape["total_ms"] += elapsed
+            shape["max_ms"] = max(shape["max_ms"], elapsed)
+
+    def report(self, top=10):
+        '''不能使用索引的查询结构报告
+        - :top: 每个列表最多返回的结构数(默认: 10)
+        - :return: {"slowest": 按平均耗时排序, "most_frequent": 按执行次数排序}，
+        每项包含 table、sql、issues、count、total_ms、avg_ms、max_ms、rows_examined、full_scan
+        '''
+        with self._lock:
+            shapes = [dict(shape, avg_ms=shape["total_ms"] / shape["count"] if shape["count"] else 0.0)
+                      for shape in self._shapes.values() if shape["issues"]]
+        return {
+            "slowest": sorted(shapes, key=lambda shape: shape["avg_ms"], reverse=True)[:top],
+            "most_frequent": sorted(shapes, key=lambda shape: shape["count"], reverse=True)[:top],
+        }
+
+    def reset(self):
+        '''清除已记录的结构'''
+        with self._lock:
+            self._shapes = {}
+
+
+class WriteBuffer(object):
+    '''
+    write-behind 缓冲(见 BaseDao 的 write_behind 参数)，按 (表名, 主键) 合并待执行的按主键更新
+    - 同一行的多次更新合并为一个字段字典，后写入的字段覆盖先写入的
+    - 待刷新的行数达到 max_size 或最早的更新等待超过 interval 秒时刷新，每张表按字段集合生成批量 UPDATE，在一个事务中执行
+    - 连接池模式下同一连接池的 BaseDao 共享一个缓冲和一个后台刷新线程，由 PoolFlusher 执行(见 get_write_buffer)；
+    非连接池模式下只有一个连接，没有后台线程，interval 只在下一次 add 时检查，在调用 add 的线程中由 BaseDao 执行
+    - 刷新总是在自己的事务中执行，不会放进调用方的事务(见 BaseDao.transaction)
+    - 刷新失败时更新放回缓冲(不覆盖之后的新值)，下一次再刷新
+    - 有未刷新的更新时缓冲(及其执行器)不会被回收，进程退出时(atexit)自动刷新，也可以调用 BaseDao.flush() 或 close()
+    - :executor: 执行刷新的对象，非连接池模式为 BaseDao，连接池模式为 PoolFlusher
+    - :name: 日志中的名称(数据库名)
+    - :max_size: 触发刷新的行数(默认: 1000)
+    - :interval: 最长刷新间隔秒数(默认: 1.0)
+    '''
+
+    def __init__(self, executor, name, max_size=1000, interval=1.0, background=True):
+        self.executor = executor
+        self.name = name
+        self.max_size = max_size
+        self.interval = interval
+        # {(表名, 主键元组): 字段字典}
+        self._pending = OrderedDict()
+        # {表名: TableDescriptor}, 加入更新时的表描述
+        self._descriptors = {}
+        # 最早一条未刷新的更新的时间
+        self._oldest = None
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        # 同一时间只有一个刷新
+        self._flush_lock = threading.Lock()
+        self._closed = False
+        self.queued = 0
+        self.coalesced = 0
+        self.flushes = 0
+        self.flushed_rows = 0
+        self.errors = 0
+        self.latency = LatencyHistogram()
+        self._thread = None
+        if background:
+            self._thread = threading.Thread(target=self._run, name="basedao-write-behind")
+            self._thread.daemon = True
+            self._thread.start()
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def _due(self):
+        return self._oldest is not None and time.time() - self._oldest >= self.interval
+
+    def add(self, descriptor, key, obj):
+        '''加入一行更新, 与同一主键未刷新的更新合并
+        - :descriptor: 表的 TableDescriptor
+        - :key: 主键值元组
+        '''
+        with self._cond:
+            if self._closed:
+                raise Exception("WriteBuffer is closed.")
+            self._descriptors[descriptor.name] = descriptor
+            pending_key = (descriptor.name, key)
+            current = self._pending.get(pending_key)
+            if current is None:
+                self._pending[pending_key] = dict(obj)
+                if self._oldest is None:
+                    self._oldest = time.time()
+                _dirty_write_buffers.add(self)
+            else:
+                current.update(obj)
+                self.coalesced += 1
+            self.queued += 1
+            full = len(self._pending) >= self.max_size
+            if self._thread is not None:
+                if full or len(self._pending) == 1:
+                    self._cond.notify()
+                return
+            due = full or self._due()
+        if due:
+            self.flush()
+
+    def flush(self, table_name=None):
+        '''立即刷新
+        - :table_name: 只刷新该表(默认: None, 刷新全部)
+        - :return: 刷新的行数, 失败时更新放回缓冲并抛出异常
+        '''
+        with self._flush_lock:
+            with self._lock:
+                if table_name is None:
+                    pending, self._pending = self._pending, OrderedDict()
+                    self._oldest = None
+                else:
+                    pending = OrderedDict((key, self._pending.pop(key))
+                                          for key in list(self._pending) if key[0] == table_name)
+                    if not self._pending:
+                        self._oldest = None
+                if not self._pending:
+                    _dirty_write_buffers.discard(self)
+                descriptors = dict(self._descriptors)
+            if not pending:
+                return 0
+            start = time.time()
+            try:
+                self.executor._flush_updates(pending, descriptors)
+            except Exception:
+                with self._lock:
+                    self.errors += 1
+                    for key, obj in pending.items():
+                        newer = self._pending.get(key)
+                        if newer is not None:
+                            obj = dict(obj)
+                            obj.update(newer)
+                        self._pending[key] = obj
+                    # 失败后等待一个 interval 再重试
+                    self._oldest = time.time()
+                    _dirty_write_buffers.add(self)
+                raise
+            finally:
+                elapsed = (time.time() - start) * 1000
+                with self._lock:
+                    self.latency.record(elapsed)
+            with self._lock:
+                self.flushes += 1
+                self.flushed_rows += len(pending)
+            return len(pending)
+
+    def _run(self):
+        '''后台刷新线程'''
+        while True:
+            with self._cond:
+                while not self._closed and len(self._pending) < self.max_size and not self._due():
+                    timeout = None if self._oldest is None else \
+                        max(self.interval - (time.time() - self._oldest), 0)
+                    self._cond.wait(timeout)
+                if self._closed:
+                    return
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error("[%s] write-behind 刷新失败: %s", self.name, e)
+
+    def close(self):
+        '''停止后台线程并刷新剩余的更新'''
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self.flush()
+
+    def stats(self):
+        '''统计信息: 缓冲深度、合并次数、刷新次数和刷新耗时直方图'''
+        with self._lock:
+            return {
+                "depth": len(self._pending),
+                "queued": self.queued,
+                "coalesced": self.coalesced,
+                "flushes": self.flushes,
+                "flushed_rows": self.flushed_rows,
+                "errors": self.errors,
+                "flush_latency": self.latency.to_dict(),
+            }
+
+
+class PoolFlusher(object):
+    '''
+    连接池模式下共享的 write-behind 缓冲的执行器(见 get_write_buffer)
+    - 从连接池借出连接，在一个事务中执行缓冲的更新，不经过任何 BaseDao 的钩子、索引顾问和统计
+    - 提交后通知使用该缓冲的每个 BaseDao 清除这些表的查询结果缓存、分页 count 缓存和当前线程的 identity map
+    - 只保存 BaseDao 的弱引用，不影响 BaseDao 被回收
+    - :pool: ConnectionPool 对象
+    - :dialect: 数据库方言
+    - :name: 日志中的名称(数据库名)
+    '''
+
+    def __init__(self, pool, dialect, name):
+        self._pool = pool
+        self._dialect = dialect
+        self.name = name
+        self._daos = weakref.WeakSet()
+        self._lock = threading.Lock()
+
+    def attach(self, dao):
+        '''登记使用该缓冲的 BaseDao, 刷新后通知'''
+        with self._lock:
+            self._daos.add(dao)
+
+    def _flush_updates(self, pending, descriptors):
+        '''在一个事务中执行缓冲的更新
+        - :pending: {(表名, 主键元组): 字段字典}
+        - :descriptors: {表名: TableDescriptor}
+        '''
+        tables = OrderedDict()
+        for (table_name, _), obj in pending.items():
+            tables.setdefault(table_name, []).append(obj)
+        with self._pool.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                self._dialect.begin(conn)
+                for table_name, objs in tables.items():
+                    for sql, params in descriptors[table_name].update_rows_sql(objs):
+                        logger.debug("[%s] write-behind SQL >>> [%s] %s", self.name, sql, params)
+                        cursor.execute(self._dialect.convert(sql), self._dialect.params(params))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                cursor.close()
+        with self._lock:
+            daos = list(self._daos)
+        for dao in daos:
+            for table_name in tables:
+                dao._after_write(table_name)
+
+
+# 按连接池共享的 write-behind 缓冲
+_write_buffers = {}
+_write_buffers_lock = threading.Lock()
+# 有未刷新更新的缓冲，进程退出时刷新；刷新完成后移除，不再阻止缓冲和 BaseDao 被回收
+_dirty_write_buffers = set()
+
+
+def get_write_buffer(pool, dao, max_size=1000, interval=1.0):
+    '''
+    获取连接池对应的 write-behind 缓冲，不存在时创建，同一 DSN 的 BaseDao 共享一个缓冲和一个后台刷新线程,
+    由 PoolFlusher 直接使用连接池执行
+    - :pool: ConnectionPool 对象
+    - :dao: 使用缓冲的 BaseDao, 登记到 PoolFlusher，刷新后清除它的缓存
+    - :max_size: 触发刷新的行数，只在首次创建时生效
+    - :interval: 最长刷新间隔秒数，只在首次创建时生效
+    '''
+    with _write_buffers_lock:
+        buffer = _write_buffers.get(pool)
+        if buffer is None or buffer.closed:
+            buffer = _write_buffers[pool] = WriteBuffer(
+                PoolFlusher(pool, dao._dialect, dao._database), dao._database, max_size, interval)
+    buffer.executor.attach(dao)
+    return buffer
+
+
+@atexit.register
+def _close_write_buffers():
+    '''进程退出时停止后台线程并刷新所有缓冲'''
+    with _write_buffers_lock:
+        buffers = set(_write_buffers.values())
+    for buffer in buffers | set(_dirty_write_buffers):
+        try:
+            buffer.close()
+        except Exception as e:
+            logger.error("[%s] write-behind 刷新失败: %s", buffer.name, e)
+
+
+def _operation(func):
+    '''
+    BaseDao CRUD 方法的装饰器, 在当前线程记录 [方法名, 表名, 开始时间]，
+    供 _execute 计算 SQL 构建耗时、调用钩子和按表统计；嵌套调用时保留最外层的方法
+    '''
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        local = self._local
+        if getattr(local, "operation", None) is not None or not (
+                self._metrics or self.before_execute or self.after_execute):
+            return func(self, *args, **kwargs)
+        table_name = args[0] if args else kwargs.get("table_name")
+        local.operation = [func.__name__, table_name or self._table, time.time()]
+        try:
+            return func(self, *args, **kwargs)
+        finally:
+            local.operation = None
+    return wrapper
+
+
 class BaseDao(object):
     """
     简便的数据库操作基类，该类所操作的表必须有主键
     初始化参数如下：
-    - :creator: 创建连接对象（默认: pymysql）
+    - :creator: 创建连接对象（默认: pymysql）, 也可以是 sqlite3
     - :host: 连接数据库主机地址(默认: localhost)
     - :port: 连接数据库端口(默认: 3306)
     - :user: 连接数据库用户名(默认: None), 如果为空，则会抛异常
@@ -61,348 +1889,1801 @@ class BaseDao(object):
     - :chatset: 编码(默认: utf8)
     - :table: 初始化 BaseDao 对象的数据库表名(默认: None), 如果为空，
     则会初始化该数据库下所有表的信息, 如果不为空，则只初始化传入的 table 的表
+    - :pool: 是否使用连接池(默认: False), 为 True 时每次执行 SQL 都从连接池借出连接，
+    也可以用 `with dao.connection():` 让当前线程在代码块内固定使用同一个连接
+    - :mincached: 连接池初始空闲连接数(默认: 0)
+    - :maxcached: 连接池最多保留的空闲连接数(默认: 10)
+    - :maxshared: 连接池最多共享的连接数(默认: 0)
+    - :maxconnections: 连接池最大连接数(默认: 0, 不限制)
+    - :pool_timeout: 连接池耗尽时的最长等待秒数(默认: None, 一直等待)
+    - :count_ttl: 分页 count 查询结果的缓存秒数(默认: 60, 0 表示不缓存)，本对象写入该表时清除
+    - :lazy: 是否延迟加载表结构(默认: True), 为 True 时表结构在第一次使用该表时才加载，
+    为 False 时初始化时一次性加载整个数据库
+    - :schema_cache: 表结构磁盘缓存文件路径(默认: None, 不缓存)，按数据库名和表结构指纹保存，
+    指纹不变时直接使用缓存
+    - :schema_version: 表结构版本(默认: None), 设置后作为缓存指纹，启动时不再查询 information_schema
+    - :schema_ttl: 表结构的有效秒数(默认: None, 永久有效)。表结构由同一 (host, port, database)
+    的所有 BaseDao 对象共享，第一个创建的对象决定该值。非连接池模式的 SQLite ":memory:" 每个连接是独立的数据库，
+    表结构和 result_cache=True 的查询结果缓存由每个 BaseDao 对象单独持有
+    - :row_format: 查询结果的行格式(默认: "dict")，查询方法也可以通过 row_format 参数单独指定
+        - "dict": 字典
+        - "tuple": 驱动返回的元组，不做转换
+        - "namedtuple": 每张表生成一次的 namedtuple
+        - "record": 每张表生成一次的 __slots__ 记录类(Record)，支持属性访问和 record["字段"]
+    - :result_cache: 查询结果缓存(默认: None, 不缓存)。为 True 时使用 (host, port, database)
+    共享的进程内 LRU 缓存(见 get_result_cache)，也可以传入 ResultCache 实现。
+    select_one、select_pk、select_all、select_page、count 和 aggregate 的结果按 (表名, SQL, 参数) 缓存，
+    save、update_* 和 remove_* 方法会使对应表的缓存失效；execute_update 执行的 SQL 不会，需要调用 clear_cache
+    - :cache_ttl: 缓存的有效秒数(默认: 60)，为字典 {表名: 秒数} 时只缓存其中的表
+    - :autocommit: 是否每条更新语句后提交(默认: True)。为 False 时 save、update_* 和 remove_* 不再提交，
+    需要调用 commit() / rollback() 或在 `with dao.transaction():` 中执行，连接池模式下未提交期间当前线程固定使用同一个连接
+    - :commit_every: autocommit 为 False 时每执行多少条更新语句自动提交一次(默认: None, 不自动提交)
+    - 事务中(transaction 代码块内或 autocommit 为 False)执行 SQL 出错时直接抛出异常，不再只记录日志
+    - :log_sql: 是否以 INFO 级别记录每条 SQL(默认: True)，日志参数延迟格式化，由 logging 的级别决定是否输出
+    - :log_sample: 记录 SQL 的采样比例(默认: 1.0, 全部记录)
+    - :slow_query: 慢查询秒数(默认: None)，执行耗时超过该值的 SQL 以 WARNING 级别记录
+    - :metrics: 是否按 (表名, 方法名) 统计 SQL 耗时直方图(默认: False)，通过 latency_stats() 查询
+    - :before_execute: 执行 SQL 前调用的钩子(默认: None)，接收 ExecuteEvent，也可以用 add_hook 添加
+    - :after_execute: 执行 SQL 后调用的钩子(默认: None)，接收带有行数和耗时的 ExecuteEvent
+    - :ping_idle: 空闲超过该秒数的连接在使用前先 ping, 失败则重新连接(默认: None)。
+    连接池模式下不设置时由 DBUtils 在每次借出时 ping
+    - :max_lifetime: 连接最长存活秒数，超过后使用前重新连接(默认: None, 不限制)
+    - :retries: 查询(execute_query 及 select_* 等)遇到连接断开、死锁等暂时性错误时的重试次数(默认: 2)，
+    不在事务中才重试；更新语句不会重试，只重新连接以便后续使用
+    - :retry_backoff: 第一次重试前等待的秒数(默认: 0.1)，之后每次翻倍
+    - :retry_max_backoff: 重试等待的最长秒数(默认: 2)
+    - :dialect: 数据库方言(默认: None, 按 creator 判断)，"mysql"、"sqlite" 或 Dialect 对象。
+    SQLite 不需要 host、port、user 和 password，database 为文件路径或 ":memory:"
+    - :replicas: 从库列表(默认: None, 不做读写分离)，每项为覆盖主库连接参数的字典，如 [{"host": "10.0.0.2"}]。
+    查询语句路由到从库，更新语句、事务中和 `with dao.connection():` 代码块内的查询使用主库；
+    从库使用各自的连接池，连接或执行失败的从库会被暂时摘除，此时查询回到其它从库或主库
+    - :balance: 从库负载均衡策略(默认: "round_robin" 轮询)，"least_outstanding" 选择执行中请求最少的从库
+    - :eject_seconds: 失败的从库摘除秒数(默认: 30)
+    - :sticky_after_write: 当前线程执行更新语句后多少秒内的查询也使用主库(默认: 0)，
+    也可以用 `with dao.sticky():` 让代码块内写入之后的查询都读主库
+    - :advisor: 索引顾问(默认: None, 不检查)，True 或 "warn" 在查询不能使用索引时记录日志，"raise" 抛出
+    UnindexedQueryError，也可以传入 QueryAdvisor 对象(如 QueryAdvisor(explain=True))。
+    检查 select_one、select_all、select_page、iter_all、count 和 aggregate 的过滤条件，通过 index_report() 查看报告
+    - :local_infile: 是否允许 LOAD DATA LOCAL INFILE(默认: False)，为 True 时 bulk_load 导入文件使用 LOAD DATA，
+    服务端也需要开启 local_infile；否则使用多行 INSERT
+    - :write_behind: 是否开启 write-behind 缓冲(默认: False)。开启后事务外的 update_by_primarykey 和
+    update_by_primarikey_selective 只把更新放入缓冲并返回 None，同一主键的更新合并后批量执行(见 WriteBuffer)；
+    刷新前查询读到的是旧值，事务外同一张表的其它写操作执行前和 transaction 开始前会先刷新。可以调用 flush() 立即刷新，
+    close() 或进程退出时自动刷新。连接池模式下同一连接池的 BaseDao 共享一个缓冲，由连接池直接执行，
+    不调用钩子和索引顾问，刷新后清除每个共享缓冲的 BaseDao 的缓存(见 get_write_buffer)；
+    非连接池模式下没有后台线程，flush_interval 只在下一次放入更新时检查，不再更新时需要调用 flush() 或 close()
+    - :flush_size: 待刷新的行数达到该值时刷新(默认: 1000)，连接池模式下只在创建共享缓冲时生效
+    - :flush_interval: 最长刷新间隔秒数(默认: 1.0)，连接池模式下只在创建共享缓冲时生效
+    - :relations: 声明的表关联(默认: None)，Relation 列表，也可以调用 add_relation 添加。
+    select_all 和 select_page 的 include 参数使用的关联没有声明时，按外键(information_schema.`KEY_COLUMN_USAGE`)推断:
+    外键所在的表以关联表名关联到一行，被引用的表以外键所在的表名关联到行列表
+    - :raise_errors: 事务外执行 SQL 出错时是否抛出异常(默认: False, 与旧版本一样只记录日志，
+    execute_query、execute_update 及 CRUD 方法返回 None)。事务中(transaction 代码块内或 autocommit 为 False)总是抛出
     """
+    ROW_FORMATS = ("dict", "tuple", "namedtuple", "record")
 
     def __init__(self, creator=pymysql, host="localhost", port=3306, user=None, password=None,
-                 database=None, charset="utf8", table=None):
-        if host is None:
-            raise ValueError("Parameter [host] is None.")
-        if port is None:
-            raise ValueError("Parameter [port] is None.")
-        if user is None:
-            raise ValueError("Parameter [user] is None.")
-        if password is None:
-            raise ValueError("Parameter [password] is None.")
+                 database=None, charset="utf8", table=None, pool=False, mincached=0,
+                 maxcached=10, maxshared=0, maxconnections=0, pool_timeout=None,
+                 count_ttl=60, lazy=True, schema_cache=None, schema_version=None,
+                 schema_ttl=None, row_format="dict", result_cache=None, cache_ttl=60,
+                 autocommit=True, commit_every=None, log_sql=True, log_sample=1.0,
+                 slow_query=None, metrics=False, before_execute=None, after_execute=None,
+                 dialect=None, ping_idle=None, max_lifetime=None, retries=2, retry_backoff=0.1,
+                 retry_max_backoff=2.0, replicas=None, balance="round_robin",
+                 eject_seconds=30, sticky_after_write=0, advisor=None, local_infile=False,
+                 write_behind=False, flush_size=1000, flush_interval=1.0, relations=None,
+                 raise_errors=False):
+        self._dialect = get_dialect(dialect, creator)
         if database is None:
             raise ValueError("Parameter [database] is None.")
+        if row_format not in self.ROW_FORMATS:
+            raise ValueError("Parameter [row_format] must be one of %s." % (self.ROW_FORMATS,))
         start = time.time()
         # 执行初始化
-        self._config = dict({
-            "creator": creator, "charset": charset, "host": host, "port": port,
-            "user": user, "password": password, "database": database
-        })
+        self._config = self._dialect.connect_config(
+            creator, host, port, user, password, database, charset)
+        if local_infile:
+            self._config["local_infile"] = True
+        if not self._dialect.requires_server:
+            host, port = self._dialect.name, None
+            if pool and database == ":memory:":
+                self._config.update(database=SQLiteDialect.SHARED_MEMORY, uri=True)
+                # 保留一个空闲连接，避免共享的内存数据库随最后一个连接关闭而清空
+                mincached = max(mincached, 1)
         self._database = database
         self._table = table
-        self._init_connect()
+        self._pool = None
+        self._conn = None
+        self._cursor = None
+        self._local = threading.local()
+        self._count_ttl = count_ttl
+        self._count_cache = {}
+        self._count_cache_lock = threading.Lock()
+        self._lazy = lazy
+        self._schema_cache = schema_cache
+        self._schema_version = schema_version
+        self._row_format = row_format
+        if self._dialect.requires_server or pool or database != ":memory:":
+            self._schema = get_schema_registry(host, port, database, schema_ttl)
+            if result_cache is True:
+                result_cache = get_result_cache(host, port, database)
+        else:
+            # 非连接池模式的 ":memory:" 每个连接都是独立的数据库，表结构和查询结果缓存不能共享
+            self._schema = SchemaRegistry(database, schema_ttl)
+            if result_cache is True:
+                result_cache = MemoryResultCache()
+        self._result_cache = result_cache or None
+        self._cache_ttl = cache_ttl
+        self._autocommit = autocommit
+        self._commit_every = commit_every
+        self._log_sql = log_sql
+        self._log_sample = log_sample
+        self._raise_errors = raise_errors
+        self._slow_query = slow_query
+        self._metrics = metrics
+        self._histograms = {}
+        self._metrics_lock = threading.Lock()
+        # 执行 SQL 的钩子列表
+        self.before_execute = [before_execute] if before_execute else []
+        self.after_execute = [after_execute] if after_execute else []
+        self._retries = retries
+        self._retry_backoff = retry_backoff
+        self._retry_max_backoff = retry_max_backoff
+        self._checker = ConnectionChecker(ping_idle, max_lifetime)
+        if pool:
+            self._pool = get_pool(
+                self._config, mincached=mincached, maxcached=maxcached, maxshared=maxshared,
+                maxconnections=maxconnections, timeout=pool_timeout, ping_idle=ping_idle,
+                max_lifetime=max_lifetime)
+            self._checker = self._pool.checker
+        else:
+            self._init_connect()
+        self._replicas = None
+        self._sticky_after_write = sticky_after_write
+        if advisor is True:
+            advisor = QueryAdvisor()
+        elif isinstance(advisor, str):
+            advisor = QueryAdvisor(advisor)
+        self._advisor = advisor or None
+        if self._advisor is not None:
+            self.after_execute.append(self._advisor.record)
+        if replicas:
+            self._replicas = ReplicaSet([
+                self._create_replica(replica, maxcached, maxshared, maxconnections,
+                                     pool_timeout, ping_idle, max_lifetime)
+                for replica in replicas], balance, eject_seconds)
+        # {表名: {关联名: Relation}}
+        self._relations = {}
+        for relation in relations or ():
+            self._relations.setdefault(relation.table, {})[relation.name] = relation
         self._init_params()
+        self._write_buffer = None
+        if write_behind and self._pool is not None:
+            self._write_buffer = get_write_buffer(self._pool, self, flush_size, flush_interval)
+        elif write_behind:
+            self._write_buffer = WriteBuffer(
+                self, database, flush_size, flush_interval, background=False)
         end = time.time()
-        logging.info("[{0}] 数据库初始化成功。耗时：{1} ms。".format(database, (end - start)))
+        logger.info("[%s] 数据库初始化成功。耗时：%s ms。", database, (end - start))
 
-    def __del__(self):
-        '重写类被清除时调用的方法'
-        if self._cursor:
+    def close(self):
+        '''关闭: 刷新 write-behind 缓冲，非连接池模式下关闭连接；连接池和共享的缓冲为多个对象共享，不在这里关闭
+        - 没有调用 close 时，非连接池模式的连接在对象被回收时由 DBUtils 关闭，write-behind 缓冲在进程退出时刷新
+        '''
+        if self._write_buffer is not None:
+            if self._pool is not None:
+                self.flush()
+            else:
+                self._write_buffer.close()
+        if self._cursor is not None:
             self._cursor.close()
-        if self._conn:
+            self._cursor = None
+        if self._conn is not None:
             self._conn.close()
-        logging.debug("[{0}] 连接关闭。".format(self._database))
+            self._conn = None
+        logger.debug("[%s] 连接关闭。", self._database)
+
+    def __enter__(self):
+        return self
 
-    def _init_connect(self):
-        '初始化连接'
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _init_connect(self, raise_error=False):
+        '''初始化连接
+        - :raise_error: 连接失败时是否抛出异常(默认: False, 只记录日志, 下次使用时重新连接)
+        '''
         try:
-            self._conn = PooledDB.connect(**self._config)
+            self._conn = PooledDB.connect(failures=_NoFailover, **self._config)
             self._cursor = self._conn.cursor()
         except Exception as e:
-            logging.error(e)
+            if raise_error:
+                raise
+            logger.error(e)
+
+    @contextmanager
+    def connection(self):
+        '''获取当前线程使用的连接
+        - 连接池模式下，最外层调用从连接池借出连接并绑定到当前线程，退出时归还；
+        嵌套调用复用同一个连接
+        - 非连接池模式下，返回共享连接
+        '''
+        if self._pool is None:
+            if self._conn is None:
+                self._init_connect(True)
+            elif self._checker.on_checkout(self._conn):
+                self._cursor = self._conn.cursor()
+            try:
+                yield self._conn
+            finally:
+                self._checker.on_checkin(self._conn)
+            return
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            yield conn
+            return
+        with self._pool.connection() as conn:
+            self._local.conn = conn
+            try:
+                yield conn
+            finally:
+                self._local.conn = None
+
+    @contextmanager
+    def _open_cursor(self, read=False):
+        '''获取执行 SQL 的 (连接, 游标)，连接池模式下每次使用新的游标
+        - :read: 是否为查询语句, 配置了从库时按路由规则使用从库的连接
+        '''
+        replica, conn = self._checkout_replica() if read else (None, None)
+        if replica is not None:
+            with self._replica_cursor(replica, conn, conn.cursor()) as cursor:
+                yield conn, cursor
+            return
+        with self.connection() as conn:
+            if self._pool is None:
+                yield conn, self._cursor
+                return
+            cursor = conn.cursor()
+            try:
+                yield conn, cursor
+            finally:
+                cursor.close()
+
+    @contextmanager
+    def _open_stream_cursor(self):
+        '''获取流式查询使用的 (连接, 服务端游标)
+        - 连接池模式下单独借出一个连接(同样经过连接检查)，避免未读完的结果集影响当前线程的其它查询
+        - 驱动没有 cursors.SSCursor 时使用普通游标
+        '''
+        cursors = getattr(self._config["creator"], "cursors", None)
+        cursor_class = getattr(cursors, "SSCursor", None)
+        replica, conn = self._checkout_replica()
+        if replica is not None:
+            cursor = conn.cursor(cursor_class) if cursor_class else conn.cursor()
+            with self._replica_cursor(replica, conn, cursor) as cursor:
+                yield conn, cursor
+            return
+        # 非连接池模式与 _open_cursor 一样经过 connection(): 连接失败时重新连接，借出前检查连接
+        with (self.connection() if self._pool is None else self._pool.connection()) as conn:
+            cursor = conn.cursor(cursor_class) if cursor_class else conn.cursor()
+            try:
+                yield conn, cursor
+            finally:
+                cursor.close()
+
+    def _create_replica(self, replica, maxcached, maxshared, maxconnections, timeout,
+                        ping_idle, max_lifetime):
+        '''创建从库及其连接池
+        - :replica: 覆盖主库连接参数的字典
+        - 不预先创建连接，从库不可用时不影响初始化
+        '''
+        if not isinstance(replica, dict):
+            raise ValueError("Parameter [replicas] must be a list of dict.")
+        config = dict(self._config)
+        config.update(replica)
+        name = "%s:%s" % (config.get("host"), config.get("port")) \
+            if self._dialect.requires_server else str(config.get("database"))
+        return Replica(name, get_pool(
+            config, mincached=0, maxcached=maxcached, maxshared=maxshared,
+            maxconnections=maxconnections, timeout=timeout, ping_idle=ping_idle,
+            max_lifetime=max_lifetime))
+
+    def _use_primary(self):
+        '''当前线程的查询是否必须使用主库: 事务中、固定了连接或写入后的粘滞期内'''
+        if self._in_transaction() or getattr(self._local, "conn", None) is not None:
+            return True
+        scope = getattr(self._local, "sticky_scope", None)
+        if scope is not None and scope[0]:
+            return True
+        return time.time() < getattr(self._local, "sticky_until", 0)
+
+    def _mark_write(self):
+        '''记录当前线程执行了更新语句, 之后的查询按 sticky_after_write 和 sticky() 使用主库'''
+        scope = getattr(self._local, "sticky_scope", None)
+        if scope is not None:
+            scope[0] = True
+        if self._sticky_after_write:
+            self._local.sticky_until = time.time() + self._sticky_after_write
+
+    @contextmanager
+    def sticky(self):
+        '''读写一致的代码块: 代码块内执行更新语句之后，当前线程的查询都使用主库，嵌套时以最外层为准'''
+        if getattr(self._local, "sticky_scope", None) is not None:
+            yield
+            return
+        self._local.sticky_scope = [False]
+        try:
+            yield
+        finally:
+            self._local.sticky_scope = None
+
+    def _checkout_replica(self):
+        '''按路由规则借出从库连接，返回 (从库, 连接)；应该使用主库或没有可用从库时返回 (None, None)
+        - 借出连接失败的从库被摘除，然后尝试下一个从库
+        '''
+        if self._replicas is None or self._use_primary():
+            return None, None
+        while True:
+            replica = self._replicas.choose()
+            if replica is None:
+                return None, None
+            try:
+                return replica, replica.pool.checkout()
+            except PoolTimeoutError:
+                # 从库繁忙不摘除，本次查询使用主库
+                self._replicas.release(replica)
+                return None, None
+            except Exception as e:
+                self._replicas.release(replica)
+                self._replicas.eject(replica, e)
+
+    @contextmanager
+    def _replica_cursor(self, replica, conn, cursor):
+        '''使用从库连接的游标，连接断开时摘除该从库，退出时归还连接'''
+        try:
+            yield cursor
+        except Exception as e:
+            if self._dialect.is_disconnect(e):
+                self._replicas.eject(replica, e)
+            raise
+        finally:
+            try:
+                cursor.close()
+            finally:
+                replica.pool.checkin(conn)
+                self._replicas.release(replica)
+
+    def replica_stats(self):
+        '''各从库的路由统计 {名称: {"outstanding", "reads", "failures", "ejected"}}，没有配置从库时返回 {}'''
+        return self._replicas.stats() if self._replicas is not None else {}
 
     def _init_params(self):
-        '初始化参数'
-        self._table_dict = {}
-        self._information_schema_columns = []
-        self._table_column_dict_list = {}
-        if self._table is None:
+        '''初始化参数
+        - lazy 为 True 时表结构在第一次使用该表时才加载
+        - 配置了 schema_cache 时先从磁盘缓存读取表结构
+        - 表结构由 SchemaRegistry 在进程内共享，已经加载过的表不会再查询数据库
+        '''
+        if self._schema_cache and not self._schema.cache_loaded:
+            self._load_schema_cache()
+        if not self._lazy and not self._schema.all_loaded:
             self._init_table_dict_list()
-            self._init_table_column_dict_list()
-        else:
-            self._init_table_dict(self._table)
-            self._init_table_column_dict_list()
-            self._column_list = self._table_column_dict_list[self._table]
+        if self._table is not None:
+            self._ensure_tables(self._table)
+            self._column_list = self._schema.descriptors[self._table].columns
 
-    def _init_information_schema_columns(self):
-        "查询 information_schema.`COLUMNS` 中的列"
-        sql = """   SELECT COLUMN_NAME
-                    FROM information_schema.`COLUMNS`
-                    WHERE TABLE_SCHEMA='information_schema' AND TABLE_NAME='COLUMNS'
-                """
-        result_tuple = self.execute_query(sql)
-        column_list = [r[0] for r in result_tuple]
-        self._information_schema_columns = column_list
+    @property
+    def _table_dict(self):
+        '表结构字典 {表名: {字段名: 字段信息}}'
+        return self._schema.table_dict
+
+    @property
+    def _table_column_dict_list(self):
+        '表字段列表字典 {表名: [字段名]}'
+        return self._schema.table_column_dict_list
+
+    @property
+    def _information_schema_columns(self):
+        'information_schema.`COLUMNS` 中的列'
+        return self._schema.information_schema_columns
+
+    def _load_tables(self, table_names=None):
+        '''批量加载表结构(MySQL 从 information_schema.`COLUMNS` 读取，见 Dialect.load_tables)
+        - :table_names: 表名列表, 使用一条 TABLE_NAME IN (...) 查询；为 None 时加载整个数据库
+        '''
+        table_dict = self._dialect.load_tables(self, table_names)
+        if self._advisor is not None:
+            self._schema.update_indexes(self._dialect.load_indexes(self, table_names))
+        if self._schema_cache and table_dict:
+            self._save_schema_cache()
 
     def _init_table_dict(self, table_name):
         '初始化表'
-        if not self._information_schema_columns:
-            self._init_information_schema_columns()
-        stitch_str = stitch_sequence(self._information_schema_columns)
-        sql = """   SELECT %s FROM information_schema.`COLUMNS`
-                    WHERE TABLE_SCHEMA='%s' AND TABLE_NAME='%s'
-                """ % (stitch_str, self._database, table_name)
-        column_tuple = self.execute_query(sql)
-        column_dict = {}
-        for column in column_tuple:
-            column_dict_item = {key: value for key, value in zip(
-                self._information_schema_columns, column)}
-            column_dict[column_dict_item["COLUMN_NAME"]] = column_dict_item
-        self._table_dict[table_name] = column_dict
+        self._load_tables([table_name])
 
     def _init_table_dict_list(self):
-        "初始化表字典对象"
-        if not self._information_schema_columns:
-            self._init_information_schema_columns()
-        sql = "SELECT TABLE_NAME FROM information_schema.`TABLES` WHERE TABLE_SCHEMA='%s'" % (
-            self._database)
-        table_tuple = self.execute_query(sql)
-        self._table_dict = {t[0]: {} for t in table_tuple}
-        for table in table_tuple:
-            self._init_table_dict(table[0])
-
-    def _init_table_column_dict_list(self):
-        '''初始化表字段字典列表'''
-        for table, column_dict in self._table_dict.items():
-            column_list = [column for column in column_dict.keys()]
-            self._table_column_dict_list[table] = column_list
-
-    def _parse_result(self, result):
-        '用于解析单个查询结果，返回字典对象'
+        "初始化表字典对象, 一次查询加载数据库中所有表的结构"
+        self._load_tables()
+
+    def _ensure_tables(self, *table_names):
+        '''确保表结构已经加载，未加载或已过期的表使用一条查询批量加载'''
+        missing = self._schema.missing(table_names)
+        if not missing:
+            return
+        self._load_tables(missing)
+        for table_name in missing:
+            if table_name not in self._table_dict:
+                raise Exception(table_name, "is not exist.")
+
+    def preload_tables(self, *table_names):
+        '''预先加载多个表的结构(一条查询)，不传表名时加载整个数据库'''
+        if table_names:
+            self._ensure_tables(*table_names)
+        else:
+            self._init_table_dict_list()
+
+    def invalidate_schema(self, table_name=None):
+        '''使共享的表结构失效(所有相同数据库的 BaseDao 对象都会生效), 下次使用时重新加载
+        - :table_name: 表名(默认: None, 使所有表失效)
+        '''
+        self._schema.invalidate(table_name)
+
+    def _get_schema_fingerprint(self):
+        '''表结构版本指纹, 优先使用 schema_version, 否则由方言计算(MySQL 按表数量和最后建表时间)'''
+        if self._schema_version is not None:
+            return str(self._schema_version)
+        return self._dialect.fingerprint(self)
+
+    def _load_schema_cache(self):
+        '''从磁盘缓存读取表结构, 指纹不一致时忽略缓存'''
+        self._schema.fingerprint = self._get_schema_fingerprint()
+        self._schema.cache_loaded = True
+        if self._schema.fingerprint is None or not os.path.exists(self._schema_cache):
+            return
+        try:
+            with open(self._schema_cache, "r", encoding="utf-8") as f:
+                cache = json.load(f).get(self._database) or {}
+        except (OSError, ValueError) as e:
+            logger.warning("[%s] 读取表结构缓存失败: %s", self._database, e)
+            return
+        if cache.get("fingerprint") != self._schema.fingerprint:
+            return
+        self._schema.information_schema_columns = cache["information_schema_columns"]
+        self._schema.update(cache["tables"])
+
+    def _save_schema_cache(self):
+        '''将已加载的表结构写入磁盘缓存(按数据库名保存)'''
+        if self._schema.fingerprint is None:
+            return
+        try:
+            caches = {}
+            if os.path.exists(self._schema_cache):
+                with open(self._schema_cache, "r", encoding="utf-8") as f:
+                    caches = json.load(f)
+            caches[self._database] = {
+                "fingerprint": self._schema.fingerprint,
+                "information_schema_columns": self._information_schema_columns,
+                "tables": self._table_dict
+            }
+            tmp_path = "%s.%s.tmp" % (self._schema_cache, os.getpid())
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(caches, f, ensure_ascii=False, default=str)
+            os.replace(tmp_path, self._schema_cache)
+        except (OSError, ValueError) as e:
+            logger.warning("[%s] 写入表结构缓存失败: %s", self._database, e)
+
+    def _parse_result(self, result, column_list=None, parser=None):
+        '用于解析单个查询结果，返回字典对象, 指定 parser 时使用 parser 解析'
         if result is None:
             return None
-        obj = {key: value for key, value in zip(self._column_list, result)}
+        if parser is not None:
+            return parser(result)
+        column_list = column_list or self._column_list
+        obj = {key: value for key, value in zip(column_list, result)}
         return obj
 
-    def _parse_results(self, results):
-        '用于解析多个查询结果，返回字典列表对象'
+    def _parse_results(self, results, parser=None):
+        '用于解析多个查询结果，返回字典列表对象, 指定 parser 时使用 parser 解析每一行'
         if results is None:
             return None
+        if parser is not None:
+            return [parser(result) for result in results]
         objs = [self._parse_result(result) for result in results]
         return objs
 
+    def _get_row_parser(self, table_name, row_format=None, columns=None):
+        '''获取表的行解析函数
+        - :row_format: 行格式, 默认使用初始化时的 row_format
+        - :columns: 投影字段(默认: None, 全部字段)
+        '''
+        return self._get_descriptor(table_name).row_parser(row_format or self._row_format, columns)
+
+    def _get_descriptor(self, table_name):
+        '获取表描述对象'
+        self._ensure_tables(table_name)
+        return self._schema.descriptors[table_name]
+
+    def _get_indexes(self, table_name):
+        '''获取表的索引结构 {索引名: (字段, ...)}，未加载时从数据库读取'''
+        indexes = self._schema.indexes.get(table_name)
+        if indexes is None:
+            self._schema.update_indexes(self._dialect.load_indexes(self, [table_name]))
+            indexes = self._schema.indexes.get(table_name, {})
+        return indexes
+
+    def _advise(self, table_name, filters, sql, params):
+        '''开启 advisor 时检查查询能否使用索引'''
+        if self._advisor is not None:
+            self._advisor.check(self, table_name, filters, sql, params)
+
+    def index_report(self, top=10):
+        '''不能使用索引的查询结构报告(见 QueryAdvisor.report)，没有开启 advisor 时返回 None'''
+        return self._advisor.report(top) if self._advisor is not None else None
+
     def _get_primary_key(self, table_name):
-        '获取表对应的主键字段'
-        if self._table_dict.get(table_name) is None:
-            raise Exception(table_name, "is not exist.")
-        for column, column_dict in self._table_dict[table_name].items():
-            if column_dict["COLUMN_KEY"] == "PRI":
-                return column
+        '获取表对应的主键字段(联合主键时为第一个主键字段)'
+        return self._get_descriptor(table_name).primary_key
+
+    def _get_primary_keys(self, table_name):
+        '获取表对应的主键字段元组'
+        return self._get_descriptor(table_name).primary_keys
 
     def _get_table_column_list(self, table_name=None):
         '查询表的字段列表, 将查询出来的字段列表存入 __fields 中'
+        self._ensure_tables(table_name)
         return self._table_column_dict_list[table_name]
 
-    def _check_table_name(self, table_name):
-        '''验证 table_name 参数'''
-        if table_name is None:
-            if self._table is None:
-                raise Exception("Parameter [table_name] is None.")
+    def _check_table_name(self, table_name):
+        '''验证 table_name 参数, 返回实际使用的表名(为 None 时使用默认表)
+        - 不修改 self._table, 连接池模式下多个线程共享同一个 BaseDao
+        '''
+        if table_name is None:
+            if self._table is None:
+                raise Exception("Parameter [table_name] is None.")
+            else:
+                table_name = self._table
+        self._ensure_tables(table_name)
+        return table_name
+
+    def _cached_query(self, table_name, sql, params, single=False):
+        '''带结果缓存的 execute_query, 没有开启缓存、该表不缓存或在事务中时直接查询'''
+        if self._result_cache is None or self._in_transaction():
+            return self.execute_query(sql, single, params)
+        if isinstance(self._cache_ttl, dict):
+            ttl = self._cache_ttl.get(table_name)
+        else:
+            ttl = self._cache_ttl
+        if not ttl:
+            return self.execute_query(sql, single, params)
+        key = (table_name, sql, tuple(params), single)
+        try:
+            result = self._result_cache.get(key)
+        except TypeError:
+            # 参数不可哈希时不缓存
+            return self.execute_query(sql, single, params)
+        if result is ResultCache.MISS:
+            result = self.execute_query(sql, single, params)
+            if result is not None:
+                self._result_cache.set(key, result, ttl)
+        return result
+
+    def clear_cache(self, table_name=None):
+        '''清除查询结果缓存和分页 count 缓存
+        - :table_name: 表名(默认: None, 清除所有表)
+        '''
+        if self._result_cache is not None:
+            self._result_cache.invalidate(table_name)
+        with self._count_cache_lock:
+            if table_name is None:
+                self._count_cache.clear()
+            else:
+                for key in [k for k in self._count_cache if k[0] == table_name]:
+                    del self._count_cache[key]
+
+    def cache_stats(self):
+        '''查询结果缓存的统计信息(hits、misses 等), 没有开启缓存时返回 None'''
+        if self._result_cache is None:
+            return None
+        return self._result_cache.stats()
+
+    def _in_transaction(self):
+        '''当前线程是否在事务中(transaction 代码块内或有未提交的更新)'''
+        return bool(getattr(self._local, "tx_depth", 0) or getattr(self._local, "tx_pending", 0))
+
+    @contextmanager
+    def transaction(self, commit_every=None):
+        '''以上下文管理器的方式开启事务，代码块正常结束时提交，抛出异常时回滚并继续抛出
+        - 代码块内 save、update_* 和 remove_* 不再逐条提交，执行 SQL 出错时直接抛出异常
+        - 连接池模式下代码块内当前线程固定使用同一个连接
+        - 嵌套调用使用 SAVEPOINT，内层异常只回滚到内层开始的位置
+        - 开启 write_behind 时最外层事务开始前先刷新缓冲，缓冲中的更新不会随事务回滚
+        - :commit_every: 每执行多少条更新语句提交一次(默认: None, 只在代码块结束时提交)，
+        用于长时间的批处理，提交过的语句不会再被回滚
+        '''
+        if self._write_buffer is not None and not self._in_transaction():
+            self._write_buffer.flush()
+        with self._transaction(commit_every):
+            yield self
+
+    @contextmanager
+    def _transaction(self, commit_every=None):
+        '''transaction 的实现, 不刷新 write-behind 缓冲'''
+        depth = getattr(self._local, "tx_depth", 0)
+        with self.connection() as conn:
+            if depth:
+                savepoint = "sp_%d" % depth
+                self._local.tx_depth = depth + 1
+                self._execute_statement(conn, "SAVEPOINT %s" % savepoint)
+                try:
+                    yield self
+                except BaseException:
+                    self._execute_statement(conn, "ROLLBACK TO SAVEPOINT %s" % savepoint)
+                    raise
+                else:
+                    self._execute_statement(conn, "RELEASE SAVEPOINT %s" % savepoint)
+                finally:
+                    self._local.tx_depth = depth
+                return
+            self._local.tx_depth = 1
+            self._local.tx_commit_every = commit_every
+            try:
+                if not getattr(self._local, "tx_pending", 0):
+                    self._dialect.begin(conn)
+                yield self
+            except BaseException:
+                self.rollback()
+                raise
+            else:
+                self.commit()
+            finally:
+                self._local.tx_depth = 0
+                self._local.tx_commit_every = None
+
+    @staticmethod
+    def _execute_statement(conn, sql):
+        '''在连接上执行一条不返回结果的语句'''
+        cursor = conn.cursor()
+        try:
+            cursor.execute(sql)
+        finally:
+            cursor.close()
+
+    def commit(self):
+        '''提交当前线程未提交的更新'''
+        self._end_transaction(True)
+
+    def rollback(self):
+        '''回滚当前线程未提交的更新'''
+        self._end_transaction(False)
+
+    def _end_transaction(self, commit):
+        '''提交或回滚, 然后归还 autocommit 为 False 时固定的连接，并使事务中写过的表的缓存失效'''
+        conn = getattr(self._local, "conn", None) or self._conn
+        try:
+            if conn is not None:
+                if commit:
+                    conn.commit()
+                else:
+                    conn.rollback()
+        finally:
+            self._local.tx_pending = 0
+            if getattr(self._local, "pinned", False):
+                self._local.pinned = False
+                self._local.conn = None
+                self._pool.checkin(conn)
+            if commit and getattr(self._local, "tx_tables", None):
+                # 提交后的粘滞期从提交时开始计算
+                self._mark_write()
+            for table_name in getattr(self._local, "tx_tables", None) or ():
+                self.clear_cache(table_name)
+            self._local.tx_tables = None
+
+    def _execute_in_transaction(self, sql, params):
+        '''在事务中执行更新语句(不提交)，出错时直接抛出异常
+        - autocommit 为 False 且不在 transaction 代码块内时，连接池模式下把连接固定到当前线程直到提交
+        '''
+        depth = getattr(self._local, "tx_depth", 0)
+        if not depth and self._pool is not None and getattr(self._local, "conn", None) is None:
+            self._local.conn = self._pool.checkout()
+            self._local.pinned = True
+        result = self._execute(sql, params, update=True)
+        conn = getattr(self._local, "conn", None) or self._conn
+        self._local.tx_pending = getattr(self._local, "tx_pending", 0) + 1
+        commit_every = getattr(self._local, "tx_commit_every", None) if depth \
+            else self._commit_every
+        if commit_every and self._local.tx_pending >= commit_every and depth <= 1:
+            conn.commit()
+            self._local.tx_pending = 0
+            for table_name in getattr(self._local, "tx_tables", None) or ():
+                self.clear_cache(table_name)
+        return result
+
+    def add_hook(self, name, hook):
+        '''添加执行 SQL 的钩子
+        - :name: "before_execute" 或 "after_execute"
+        - :hook: 接收 ExecuteEvent 的函数, 钩子抛出的异常只记录日志
+        '''
+        if name not in ("before_execute", "after_execute"):
+            raise ValueError("Parameter [name] must be before_execute or after_execute.")
+        getattr(self, name).append(hook)
+
+    def _run_hooks(self, hooks, event):
+        '''调用钩子'''
+        for hook in hooks:
+            try:
+                hook(event)
+            except Exception:
+                logger.exception("[%s] 执行钩子 %r 失败", self._database, hook)
+
+    def latency_stats(self, table_name=None, method=None):
+        '''按 (表名, 方法名) 统计的 SQL 耗时直方图, 需要初始化时 metrics=True
+        - :table_name: 只返回该表(默认: None, 所有表)
+        - :method: 只返回该方法(默认: None, 所有方法)
+        - :return: {"表名.方法名": LatencyHistogram.to_dict()}
+        '''
+        with self._metrics_lock:
+            return {"%s.%s" % key: histogram.to_dict()
+                    for key, histogram in self._histograms.items()
+                    if (table_name is None or key[0] == table_name)
+                    and (method is None or key[1] == method)}
+
+    def reset_latency_stats(self):
+        '''清空耗时统计'''
+        with self._metrics_lock:
+            self._histograms = {}
+
+    def _execute(self, sql, params, single=False, update=False, commit=False):
+        '''执行 SQL，记录日志、调用钩子并统计耗时(见 _instrument)，出错时抛出异常
+        - :single: 查询时是否只读取一行
+        - :update: 是否为更新语句, 返回 cursor.execute 的结果(影响行数)
+        - :commit: 更新语句执行后是否提交, 出错时回滚
+        '''
+        with self._instrument(sql, params, update) as state:
+            with self._open_cursor(read=not update) as (conn, cursor):
+                try:
+                    result = cursor.execute(self._dialect.convert(sql), self._dialect.params(params))
+                    state[0] = time.time()
+                    if update:
+                        if self._replicas is not None:
+                            self._mark_write()
+                        result = self._dialect.affected_rows(cursor, result)
+                        if commit:
+                            conn.commit()
+                        state[1] = result
+                    else:
+                        result = cursor.fetchone() if single else cursor.fetchall()
+                        state[1] = (0 if result is None else 1) if single else len(result)
+                except Exception as e:
+                    if self._dialect.is_disconnect(e):
+                        self._reconnect(conn)
+                    elif commit:
+                        conn.rollback()
+                    raise
+            return result
+
+    @contextmanager
+    def _instrument(self, sql, params, update=False, operation=None):
+        '''在代码块中执行 SQL: 之前调用 before_execute 钩子并记录日志，之后记录慢查询、耗时统计并调用 after_execute 钩子
+        - yield [执行完成的时间, 行数] 列表, 由代码块在执行后填写
+        - :operation: [方法名, 表名, 开始时间](默认: None, 使用当前线程 _operation 记录的方法)，
+        用于方法返回之后才执行的流式查询
+        '''
+        if sql is None:
+            raise Exception("Parameter sql is None.")
+        now = time.time()
+        if operation is None:
+            operation = getattr(self._local, "operation", None)
+        event = None
+        if self.before_execute or self.after_execute:
+            if operation is not None:
+                event = ExecuteEvent(self._database, operation[1], operation[0], sql, params,
+                                     now - operation[2])
             else:
-                table_name = self._table
-        else:
-            if self._table != table_name:
-                self._table = table_name
-                self._column_list = self._table_column_dict_list[self._table]
+                event = ExecuteEvent(self._database, None,
+                                     "execute_update" if update else "execute_query", sql, params)
+            self._run_hooks(self.before_execute, event)
+        if self._log_sql and (self._log_sample >= 1 or random.random() < self._log_sample):
+            logger.info("[%s] SQL >>> [%s] %s", self._database, sql, params)
+        error = None
+        start = time.time()
+        state = [start, None]
+        try:
+            yield state
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            end = time.time()
+            executed, row_count = state
+            if operation is not None:
+                # 同一个方法的下一条语句从这里开始计算构建耗时
+                operation[2] = end
+            elapsed = end - start
+            if self._slow_query is not None and elapsed >= self._slow_query:
+                logger.warning("[%s] 慢查询 %.1f ms >>> [%s] %s",
+                               self._database, elapsed * 1000, sql, params)
+            if self._metrics:
+                key = (operation[1], operation[0]) if operation is not None else \
+                    (None, "execute_update" if update else "execute_query")
+                with self._metrics_lock:
+                    histogram = self._histograms.get(key)
+                    if histogram is None:
+                        histogram = self._histograms[key] = LatencyHistogram()
+                    histogram.record(elapsed * 1000)
+            if event is not None:
+                event.row_count = row_count
+                event.execute_time = executed - start
+                event.fetch_time = end - executed
+                event.error = error
+                self._run_hooks(self.after_execute, event)
+
+    def _query_dicts(self, sql, params=None):
+        '''执行查询并按 cursor.description 返回字典列表，用于 EXPLAIN 等结果列不固定的语句'''
+        with self._open_cursor(read=True) as (_, cursor):
+            cursor.execute(self._dialect.convert(sql), self._dialect.params(params))
+            names = [d[0] for d in cursor.description or ()]
+            return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+    def _reconnect(self, conn):
+        '''连接断开时重新连接，供下一次使用'''
+        if self._checker.reconnect(conn) and self._pool is None:
+            self._cursor = self._conn.cursor()
 
-    def execute_query(self, sql=None, single=False):
+    def execute_query(self, sql=None, single=False, params=None):
         '''执行查询 SQL 语句
-        - :sql: sql 语句
+        - :sql: sql 语句, 参数使用 %s 占位
         - :single: 是否查询单个结果集，默认False
+        - :params: sql 语句的参数序列(默认: None)
+        - 不在事务中时，暂时性错误按 retries 指数退避重试
+        - 出错时 raise_errors 为 True 或在事务中时抛出异常，否则记录日志并返回 None
         '''
-        try:
-            if sql is None:
-                raise Exception("Parameter sql is None.")
-            logging.info("[%s] SQL >>> [%s]" % (self._database, sql))
-            self._cursor.execute(sql)
-            return self._cursor.fetchone() if single else self._cursor.fetchall()
-        except Exception as e:
-            logging.error(e)
+        attempt = 0
+        while True:
+            try:
+                return self._execute(sql, params, single)
+            except Exception as e:
+                if self._in_transaction():
+                    raise
+                if attempt >= self._retries or not self._dialect.is_transient(e):
+                    if self._raise_errors:
+                        raise
+                    logger.error(e)
+                    return None
+                delay = min(self._retry_backoff * (2 ** attempt), self._retry_max_backoff)
+                attempt += 1
+                logger.warning("[%s] 查询失败, %.2f 秒后第 %d 次重试: %s",
+                               self._database, delay, attempt, e)
+                time.sleep(delay)
 
-    def execute_update(self, sql=None):
+    def execute_update(self, sql=None, params=None):
         '''执行更新 SQL 语句
-        - :sql: sql 语句
+        - :sql: sql 语句, 参数使用 %s 占位
+        - :params: sql 语句的参数序列(默认: None)
+        - 事务中(transaction 代码块内或 autocommit 为 False)不提交，出错时直接抛出异常
+        - 事务外出错时回滚, raise_errors 为 True 时抛出异常，否则记录日志并返回 None
         '''
+        if not self._autocommit or getattr(self._local, "tx_depth", 0):
+            return self._execute_in_transaction(sql, params)
         try:
-            if sql is None:
-                raise Exception("Parameter sql is None.")
-            logging.info("[%s] SQL >>> [%s]" % (self._database, sql))
-            result = self._cursor.execute(sql)
-            self._conn.commit()
-            return result
+            return self._execute(sql, params, update=True, commit=True)
         except Exception as e:
-            logging.error(e)
-            self._conn.rollback()
+            if self._raise_errors:
+                raise
+            logger.error(e)
 
-    def select_one(self, table_name=None, filters=None):
+    @_operation
+    def select_one(self, table_name=None, filters=None, row_format=None, columns=None):
         '''查询单个对象
         - @table_name 表名
         - @filters 过滤条件
+        - @row_format 行格式(默认: 初始化时的 row_format)
+        - @columns 查询的字段列表(默认: None, 全部字段)，结果只包含这些字段
         - @return 返回字典集合，集合中以表字段作为 key，字段值作为 value
         '''
-        self._check_table_name(table_name)
-        if filters is None:
-            filters = {}
-        stitch_str = stitch_sequence(
-            self._get_table_column_list(self._table))
-        sql = "SELECT %s FROM %s" % (stitch_str, self._table)
-        sql = QueryUtil.query_sql(sql, filters)
-        result = self.execute_query(sql, True)
-        return self._parse_result(result)
-
-    def select_pk(self, table_name=None, primary_key=None):
+        table_name = self._check_table_name(table_name)
+        sql, params = self._get_descriptor(table_name).select_sql(filters, columns)
+        self._advise(table_name, filters, sql, params)
+        result = self._cached_query(table_name, sql, params, True)
+        return self._parse_result(
+            result, parser=self._get_row_parser(table_name, row_format, columns))
+
+    @_operation
+    def select_pk(self, table_name=None, primary_key=None, row_format=None):
         '''按主键查询
         - @table_name 表名
-        - @primary_key 主键值
+        - @primary_key 主键值, 联合主键时为元组(按主键字段顺序)或字典
+        - @row_format 行格式(默认: 初始化时的 row_format)
+        '''
+        table_name = self._check_table_name(table_name)
+        descriptor = self._get_descriptor(table_name)
+        identity_map = getattr(self._local, "identity_map", None)
+        if identity_map is not None:
+            key = (table_name, descriptor.key_values(primary_key), row_format or self._row_format)
+            if key in identity_map:
+                return identity_map[key]
+        sql, params = descriptor.select_pk_sql(primary_key)
+        result = self._cached_query(table_name, sql, params, True)
+        obj = self._parse_result(result, parser=self._get_row_parser(table_name, row_format))
+        if identity_map is not None and result is not None:
+            identity_map[key] = obj
+        return obj
+
+    @_operation
+    def select_pks(self, table_name=None, keys=None, row_format=None, chunk_size=1000):
+        '''按主键批量查询, 按 chunk_size 分块执行 SELECT ... WHERE `pk` IN (...)
+        - @table_name 表名(只支持单一主键)
+        - @keys 主键值列表, 可以重复
+        - @row_format 行格式(默认: 初始化时的 row_format)
+        - @chunk_size 每块查询的主键个数(默认: 1000)
+        - @return 与 keys 顺序一致的列表，不存在的主键对应 None
+        '''
+        table_name = self._check_table_name(table_name)
+        if keys is None:
+            raise ValueError("Parameter [keys] can not be None.")
+        descriptor = self._get_descriptor(table_name)
+        parser = self._get_row_parser(table_name, row_format)
+        row_format = row_format or self._row_format
+        identity_map = getattr(self._local, "identity_map", None)
+        keys = list(keys)
+        found = {}
+        pending = []
+        for key in keys:
+            if key in found:
+                continue
+            if identity_map is not None and (table_name, (key,), row_format) in identity_map:
+                found[key] = identity_map[(table_name, (key,), row_format)]
+            else:
+                found[key] = None
+                pending.append(key)
+        index = descriptor.column_index[descriptor.single_primary_key()]
+        for sql, params in descriptor.select_pks_batches(pending, chunk_size):
+            for result in self.execute_query(sql, params=params) or ():
+                obj = parser(result)
+                found[result[index]] = obj
+                if identity_map is not None:
+                    identity_map[(table_name, (result[index],), row_format)] = obj
+        return [found.get(key) for key in keys]
+
+    def pk_loader(self, table_name=None, row_format=None, chunk_size=1000):
+        '''创建合并主键查询的加载器(PkLoader)
+        - @table_name 表名(只支持单一主键)
+        - @row_format 行格式(默认: 初始化时的 row_format)
+        - @chunk_size 每块查询的主键个数(默认: 1000)
+        '''
+        table_name = self._check_table_name(table_name)
+        return PkLoader(self, table_name, row_format, chunk_size)
+
+    @contextmanager
+    def unit_of_work(self):
+        '''以上下文管理器的方式开启当前线程的工作单元(identity map)
+        - 代码块内 select_pk / select_pks 对同一主键只查询一次，之后返回同一个对象
+        - 代码块内对某张表执行 save、update_* 或 remove_* 后清空该表的 identity map
+        - 嵌套调用复用外层的工作单元
+        '''
+        if getattr(self._local, "identity_map", None) is not None:
+            yield
+            return
+        self._local.identity_map = {}
+        try:
+            yield
+        finally:
+            self._local.identity_map = None
+
+    def flush(self, table_name=None):
+        '''立即刷新 write-behind 缓冲
+        - :table_name: 只刷新该表(默认: None, 刷新全部)
+        - :return: 刷新的行数, 没有开启 write_behind 时返回 0
+        '''
+        if self._write_buffer is None:
+            return 0
+        if self._in_transaction():
+            raise Exception("Can not flush write-behind buffer in a transaction.")
+        return self._write_buffer.flush(table_name)
+
+    def write_buffer_stats(self):
+        '''write-behind 缓冲的统计信息(见 WriteBuffer.stats)，没有开启时返回 None'''
+        return self._write_buffer.stats() if self._write_buffer is not None else None
+
+    def _buffer_update(self, table_name, obj, selective):
+        '''开启 write_behind 且不在事务中时把按主键更新放入缓冲, 返回是否已放入
+        - selective 为 True 时跳过空值字段
+        '''
+        if self._write_buffer is None or self._in_transaction():
+            return False
+        descriptor = self._get_descriptor(table_name)
+        for primary_key in descriptor.primary_keys:
+            if obj.get(primary_key) is None:
+                raise ValueError("Parameter [obj.%s] is None." % primary_key)
+        if selective:
+            obj = {k: v for k, v in obj.items() if v is not None}
+        self._write_buffer.add(descriptor, descriptor.key_values(obj), obj)
+        # 当前线程的 identity map 不能再返回该表的旧对象
+        self._after_write(table_name)
+        return True
+
+    def _before_write(self, table_name):
+        '''其它写操作执行前先刷新该表在 write-behind 缓冲中的更新，保证同一行的写入顺序
+        - 事务中不刷新: 当前线程的更新已在事务开始前刷新，其它线程的更新由后台线程在自己的事务中刷新
+        '''
+        if self._write_buffer is not None and not self._in_transaction():
+            self._write_buffer.flush(table_name)
+
+    def _flush_updates(self, pending, descriptors):
+        '''在一个事务中执行非连接池模式 write-behind 缓冲的更新(连接池模式见 PoolFlusher)
+        - :pending: {(表名, 主键元组): 字段字典}
+        - :descriptors: {表名: TableDescriptor}
+        - 只在自己的事务中执行，当前线程在事务中时抛出异常(更新会放回缓冲)
         '''
-        self._check_table_name(table_name)
-        stitch_str = stitch_sequence(
-            self._get_table_column_list(self._table))
-        sql = "SELECT %s FROM %s" % (stitch_str, self._table)
-        sql = QueryUtil.query_sql(sql, {self._get_primary_key(self._table): primary_key})
-        result = self.execute_query(sql, True)
-        return self._parse_result(result)
+        if self._in_transaction():
+            raise Exception("Can not flush write-behind buffer in a transaction.")
+        tables = OrderedDict()
+        for (table_name, _), obj in pending.items():
+            tables.setdefault(table_name, []).append(obj)
+        with self._transaction():
+            for table_name, objs in tables.items():
+                try:
+                    for sql, params in descriptors[table_name].update_rows_sql(objs):
+                        self.execute_update(sql, params)
+                finally:
+                    self._after_write(table_name)
 
-    def select_all(self, table_name=None, filters=None):
+    def _after_write(self, table_name):
+        '''写操作之后清除表的查询结果缓存和当前线程 identity map 中该表的对象，
+        事务中提交或回滚时会再清除一次
+        '''
+        self.clear_cache(table_name)
+        if self._in_transaction():
+            if getattr(self._local, "tx_tables", None) is None:
+                self._local.tx_tables = set()
+            self._local.tx_tables.add(table_name)
+        identity_map = getattr(self._local, "identity_map", None)
+        if identity_map:
+            for key in [k for k in identity_map if k[0] == table_name]:
+                del identity_map[key]
+
+    @_operation
+    def select_all(self, table_name=None, filters=None, row_format=None, columns=None,
+                   include=None, include_strategy="in"):
         '''查询所有
         - @table_name 表名
         - @filters 过滤条件
+        - @row_format 行格式(默认: 初始化时的 row_format)
+        - @columns 查询的字段列表(默认: None, 全部字段)，结果只包含这些字段
+        - @include 同时加载的关联名列表(默认: None)，见 add_relation，关联的行以关联名加入结果字典，只支持 dict 行格式
+        - @include_strategy 加载关联的方式, "in" 每个关联执行一次(分块的) IN 查询，
+        "join" 与主查询合并为一条 LEFT JOIN 查询(只支持非一对多关联)
         - @return 返回字典集合，集合中以表字段作为 key，字段值作为 value
         '''
-        self._check_table_name(table_name)
-        if filters is None:
-            filters = {}
-        stitch_str = stitch_sequence(
-            self._get_table_column_list(self._table))
-        sql = "SELECT %s FROM %s" % (stitch_str, self._table)
-        sql = QueryUtil.query_sql(sql, filters)
-        results = self.execute_query(sql)
-        return self._parse_results(results)
-
-    def count(self, table_name=None):
-        '''统计记录数'''
-        self._check_table_name(table_name)
-        sql = "SELECT count(*) FROM %s" % (self._table)
-        result = self.execute_query(sql, True)
-        return result[0]
-
-    def select_page(self, table_name=None, page=None, filters=None):
+        table_name = self._check_table_name(table_name)
+        descriptor = self._get_descriptor(table_name)
+        relations = self._include_relations(table_name, include, row_format, include_strategy)
+        order = (filters or {}).get(QueryUtil.ORDER) if include_strategy == "join" else None
+        columns = self._include_columns(descriptor, columns, relations, order)
+        sql, params = descriptor.select_sql(filters, columns)
+        self._advise(table_name, filters, sql, params)
+        if relations and include_strategy == "join":
+            return self._select_join(descriptor, sql, params, columns, relations,
+                                     order, (filters or {}).get(QueryUtil.ORDER_TYPE))[1]
+        results = self._cached_query(table_name, sql, params)
+        objs = self._parse_results(
+            results, self._get_row_parser(table_name, row_format, columns))
+        if relations:
+            self._load_relations(objs, relations)
+        return objs
+
+    def iter_all(self, table_name=None, filters=None, fetch_size=1000, raw=False,
+                 row_format=None):
+        '''流式查询所有，使用服务端游标(SSCursor)按 fetch_size 分块读取，内存占用与表大小无关
+        - 非连接池模式下迭代结束前不能在同一个对象上执行其它 SQL
+        - @table_name 表名
+        - @filters 过滤条件
+        - @fetch_size 每次读取的行数(默认: 1000)
+        - @raw 是否直接返回元组(默认: False), 等同于 row_format="tuple"
+        - @row_format 行格式(默认: 初始化时的 row_format)
+        - @return 返回生成器，逐条生成字典对象(raw 为 True 时为元组)；参数在调用时检查，第一次迭代时才执行查询
+        '''
+        table_name = self._check_table_name(table_name)
+        if fetch_size is None or fetch_size <= 0:
+            raise ValueError("Parameter [fetch_size] must be greater than 0.")
+        parser = self._get_row_parser(table_name, "tuple" if raw else row_format)
+        sql, params = self._get_descriptor(table_name).select_sql(filters)
+        self._advise(table_name, filters, sql, params)
+        return self._iter_rows(table_name, sql, params, parser, fetch_size)
+
+    def _iter_rows(self, table_name, sql, params, parser, fetch_size):
+        '''iter_all 的生成器: 用服务端游标执行查询并按 fetch_size 分块生成行'''
+        operation = ["iter_all", table_name, time.time()]
+        with self._open_stream_cursor() as (_, cursor):
+            with self._instrument(sql, params, operation=operation) as state:
+                cursor.execute(self._dialect.convert(sql), self._dialect.params(params))
+                state[0] = time.time()
+            while True:
+                results = cursor.fetchmany(fetch_size)
+                if not results:
+                    break
+                for result in results:
+                    yield parser(result)
+
+    @_operation
+    def count(self, table_name=None, filters=None):
+        '''统计记录数
+        - @table_name 表名
+        - @filters 过滤条件, 语法同 select_all(忽略分组、排序和分页)
+        - @return 记录数
+        '''
+        table_name = self._check_table_name(table_name)
+        sql, params = self._get_descriptor(table_name).count_sql(filters)
+        self._advise(table_name, {k: v for k, v in (filters or {}).items()
+                                   if k not in QueryUtil.RESERVED}, sql, params)
+        result = self._cached_query(table_name, sql, params, True)
+        return result[0] if result else 0
+
+    @_operation
+    def aggregate(self, table_name=None, aggregates=None, filters=None, groupby=None):
+        '''聚合查询, 在数据库中计算 COUNT、SUM 等，不读取整行
+        - @table_name 表名
+        - @aggregates 聚合表达式 {别名: 表达式}, 如 {"n": "COUNT(*)", "total": "SUM(`amount`)"}，
+        表达式原样拼接到 SQL 中，不能来自用户输入
+        - @filters 过滤条件, 可以用 orderby 按别名排序
+        - @groupby 分组字段名或字段名列表(默认: None, 不分组)
+        - @return 不分组时返回 {别名: 值}；分组时返回字典列表，每个字典包含分组字段和别名
+        '''
+        table_name = self._check_table_name(table_name)
+        sql, params, columns = self._get_descriptor(table_name).aggregate_sql(
+            aggregates, filters, groupby)
+        self._advise(table_name, filters, sql, params)
+        results = self._cached_query(table_name, sql, params)
+        if results is None:
+            return None
+        objs = [self._parse_result(result, columns) for result in results]
+        if not groupby:
+            return objs[0] if objs else {}
+        return objs
+
+    def _count_filters(self, table_name, filters):
+        '''按过滤条件统计记录数(忽略分组、排序和分页)'''
+        sql, params = self._get_descriptor(table_name).count_sql(filters)
+        result = self.execute_query(sql, True, params)
+        return result[0] if result else 0
+
+    def _estimate_count(self, table_name):
+        '''估算的记录数(MySQL 从 information_schema.`TABLES` 读取，没有估算值的方言使用精确 count)'''
+        return self._dialect.estimate_count(self, table_name)
+
+    def _page_count(self, table_name, page, filters):
+        '''分页的 count 查询, 结果按 (表名, 过滤条件) 缓存 count_ttl 秒
+        - page.count 为 Page.ESTIMATE 且没有过滤条件时使用估算值
+        '''
+        conditions = {k: v for k, v in filters.items() if k not in QueryUtil.RESERVED}
+        if page.count == Page.ESTIMATE and not conditions:
+            return self._estimate_count(table_name)
+        if not self._count_ttl:
+            return self._count_filters(table_name, conditions)
+        key = (table_name, tuple(sorted((k, str(v)) for k, v in conditions.items())))
+        now = time.time()
+        with self._count_cache_lock:
+            cached = self._count_cache.get(key)
+        if cached is not None and cached[0] > now:
+            return cached[1]
+        total = self._count_filters(table_name, conditions)
+        with self._count_cache_lock:
+            self._count_cache[key] = (now + self._count_ttl, total)
+        return total
+
+    @_operation
+    def select_page(self, table_name=None, page=None, filters=None, row_format=None,
+                    columns=None, include=None, include_strategy="in"):
         '''分页查询
         - @table_name 表名
+        - @page 分页对象, Page(LIMIT 偏移分页) 或 KeysetPage(键集分页)，
+        page.count 不为 False 时会同时填充 page.total 和 page.pages
+        - @row_format 行格式(默认: 初始化时的 row_format)
+        - @columns 查询的字段列表(默认: None, 全部字段)，KeysetPage 的 key 不在其中时会追加
+        - @include 同时加载的关联名列表, 见 select_all
+        - @include_strategy 加载关联的方式, 见 select_all
         - @return 返回字典集合，集合中以表字段作为 key，字段值作为 value
         '''
-        self._check_table_name(table_name)
-        if filters is None:
-            filters = {}
+        table_name = self._check_table_name(table_name)
+        filters = dict(filters or {})
         if page is None:
             page = Page()
-        filters["page"] = page
-        stitch_str = stitch_sequence(
-            self._get_table_column_list(self._table))
-        sql = "SELECT %s FROM %s" % (stitch_str, self._table)
-        sql = QueryUtil.query_sql(sql, filters)
-        result_tuple = self.execute_query(sql)
-        return self._parse_results(result_tuple)
+        if page.count:
+            page.total = self._page_count(table_name, page, filters)
+            page.pages = max((page.total + page.page_size - 1) // page.page_size, 1)
+        descriptor = self._get_descriptor(table_name)
+        relations = self._include_relations(table_name, include, row_format, include_strategy)
+        order = filters.get(QueryUtil.ORDER) if include_strategy == "join" else None
+        columns = descriptor.page_columns(
+            page, filters, self._include_columns(descriptor, columns, relations, order))
+        sql, params = descriptor.page_sql(page, filters, columns)
+        self._advise(table_name, filters, sql, params)
+        if relations and include_strategy == "join":
+            if isinstance(page, KeysetPage):
+                order = page.key
+            result_tuple, objs = self._select_join(
+                descriptor, sql, params, columns, relations, order, filters.get(QueryUtil.ORDER_TYPE))
+            if isinstance(page, KeysetPage) and result_tuple is not None:
+                page.advance(result_tuple, descriptor, columns)
+            return objs
+        result_tuple = self._cached_query(table_name, sql, params)
+        if isinstance(page, KeysetPage):
+            page.advance(result_tuple, descriptor, columns)
+        objs = self._parse_results(
+            result_tuple, self._get_row_parser(table_name, row_format, columns))
+        if relations:
+            self._load_relations(objs, relations)
+        return objs
+
+    def add_relation(self, table_name, name, column, target, target_column=None, many=False):
+        '''声明表关联, 参数见 Relation，返回 Relation
+        - 如 dao.add_relation("city", "province", "province_id", "province", "province_id")
+        '''
+        relation = Relation(table_name, name, column, target, target_column, many)
+        self._relations.setdefault(table_name, {})[name] = relation
+        return relation
+
+    def _get_relation(self, table_name, name):
+        '''获取表关联, 没有声明时按外键推断'''
+        relation = self._relations.get(table_name, {}).get(name)
+        if relation is not None:
+            return relation
+        if self._schema.foreign_keys is None:
+            self._schema.foreign_keys = self._dialect.load_foreign_keys(self)
+        for source, column, target, target_column in self._schema.foreign_keys:
+            if source == table_name and target == name:
+                relation = Relation(table_name, name, column, target, target_column)
+            elif target == table_name and source == name:
+                relation = Relation(table_name, name, target_column or self._get_descriptor(
+                    table_name).single_primary_key(), source, column, True)
+            else:
+                continue
+            self._relations.setdefault(table_name, {})[name] = relation
+            return relation
+        raise ValueError("Relation [%s] of [%s] is not declared and no foreign key found." % (
+            name, table_name))
+
+    def _include_relations(self, table_name, include, row_format, strategy):
+        '''检查 include 参数, 返回 Relation 列表'''
+        if not include:
+            return []
+        if strategy not in ("in", "join"):
+            raise ValueError("Parameter [include_strategy] must be in or join.")
+        if (row_format or self._row_format) != "dict":
+            raise ValueError("Parameter [include] only supports row_format dict.")
+        if isinstance(include, str):
+            include = (include,)
+        relations = [self._get_relation(table_name, name) for name in include]
+        if strategy == "join" and any(relation.many for relation in relations):
+            raise ValueError("JOIN strategy does not support one-to-many relations.")
+        return relations
+
+    @staticmethod
+    def _include_columns(descriptor, columns, relations, order=None):
+        '''投影字段中缺少关联字段时追加到最后
+        - :order: JOIN 方式外层查询的排序字段，不在投影字段中时同样追加
+        '''
+        if columns is None or not relations:
+            return columns
+        columns = descriptor.projection_columns(columns)
+        extra = [relation.column for relation in relations]
+        if order:
+            extra.append(order)
+        return columns + tuple(dict.fromkeys(c for c in extra if c not in columns))
+
+    def _load_relations(self, objs, relations, chunk_size=1000):
+        '''每个关联执行一次(按 chunk_size 分块的) IN 查询，把关联的行加入 objs 中的字典'''
+        if not objs:
+            return
+        for relation in relations:
+            descriptor = self._get_descriptor(relation.target)
+            target_column = relation.target_column or descriptor.single_primary_key()
+            keys = [key for key in dict.fromkeys(obj.get(relation.column) for obj in objs)
+                    if key is not None]
+            related = {}
+            for sql, params in descriptor.select_in_batches(target_column, keys, chunk_size):
+                results = self._cached_query(relation.target, sql, params)
+                if results is None:
+                    raise Exception("[%s] Failed to load relation [%s]." % (
+                        relation.table, relation.name))
+                for row in self._parse_results(results, descriptor.row_parser("dict")):
+                    if relation.many:
+                        related.setdefault(row[target_column], []).append(row)
+                    else:
+                        related.setdefault(row[target_column], row)
+            for obj in objs:
+                value = related.get(obj.get(relation.column))
+                if relation.many:
+                    obj[relation.name] = list(value) if value else []
+                else:
+                    obj[relation.name] = value
+
+    def _select_join(self, descriptor, sql, params, columns, relations, order=None,
+                     order_type=None):
+        '''把查询作为子查询 LEFT JOIN 关联表, 返回 (父表部分的结果元组, 字典列表)
+        - 主查询的过滤、排序和分页在子查询中执行，外层按 order 再排序一次
+        '''
+        columns = columns or descriptor.columns
+        selects = ["`p`.`%s`" % c for c in columns]
+        joins = []
+        targets = []
+        for i, relation in enumerate(relations):
+            target = self._get_descriptor(relation.target)
+            alias = "r%d" % i
+            target_column = relation.target_column or target.single_primary_key()
+            selects.extend("`%s`.`%s`" % (alias, c) for c in target.columns)
+            joins.append(" LEFT JOIN `%s` AS `%s` ON `%s`.`%s`=`p`.`%s`" % (
+                relation.target, alias, alias, target_column, relation.column))
+            targets.append((relation.name, target, target.column_index[target_column]))
+        sql = "SELECT %s FROM (%s) AS `p`%s" % (stitch_sequence(selects, False), sql, "".join(joins))
+        if order:
+            sql += " ORDER BY `p`.`%s` %s" % (order, order_type or "asc")
+        results = self.execute_query(sql, params=params)
+        if results is None:
+            return None, None
+        size = len(columns)
+        parents = []
+        objs = []
+        for result in results:
+            parents.append(result[:size])
+            obj = dict(zip(columns, result))
+            offset = size
+            for name, target, key_index in targets:
+                part = result[offset:offset + len(target.columns)]
+                obj[name] = dict(zip(target.columns, part)) if part[key_index] is not None else None
+                offset += len(target.columns)
+            objs.append(obj)
+        return parents, objs
+
+    def select_page_iter(self, table_name=None, page_size=100, filters=None, row_format=None,
+                         columns=None):
+        '''按键集分页遍历整张表，每页只定位上一页最后一个键值之后的 page_size 行
+        - @table_name 表名
+        - @page_size 每页大小(默认: 100)
+        - @filters 过滤条件, 可以通过 orderby/ordertype 指定分页的键(默认为主键)，该键需要唯一
+        - @row_format 行格式(默认: 初始化时的 row_format)
+        - @columns 查询的字段列表(默认: None, 全部字段)
+        - @return 返回生成器，逐页生成字典集合
+        '''
+        table_name = self._check_table_name(table_name)
+        page = KeysetPage(page_size)
+        while page.has_next:
+            results = self.select_page(table_name, page, filters, row_format, columns)
+            if not results:
+                break
+            yield results
+
+    def parallel_scan(self, table_name=None, filters=None, workers=4, ordered=True,
+                      row_format=None, columns=None, partitions=None, split=None,
+                      processes=False):
+        '''按主键范围并行扫描整张表，每个范围在各自的连接上查询
+        - @table_name 表名, 需要单一主键
+        - @filters 过滤条件, 分组和分页条件不能使用
+        - @workers 并行数(默认: 4)，连接池模式下每个线程从连接池借出自己的连接；
+        非连接池模式下只有一个连接，各范围依次查询
+        - @ordered 是否按主键范围的顺序返回(默认: True)，为 False 时先完成的范围先返回
+        - @row_format 行格式(默认: 初始化时的 row_format)
+        - @columns 查询的字段列表(默认: None, 全部字段)
+        - @partitions 切分的范围数(默认: workers * 4)，同时执行和已完成未取走的范围最多 workers * 2 个
+        - @split 切分方式, "minmax" 按 MIN/MAX 等宽切分(整数主键的默认值)，"quantile" 按主键排序后的
+        分位数切分(其它主键的默认值, 适合分布不均匀的主键，每个分位点执行一次 LIMIT n,1 查询)
+        - @processes 是否使用进程池(默认: False)，行解析在子进程中执行，只支持 dict 和 tuple 行格式，
+        子进程各自创建非连接池模式的 BaseDao
+        - @return 返回生成器，每个范围生成一个结果列表
+        '''
+        table_name = self._check_table_name(table_name)
+        if workers is None or workers <= 0:
+            raise ValueError("Parameter [workers] must be greater than 0.")
+        if split not in (None, "minmax", "quantile"):
+            raise ValueError("Parameter [split] must be minmax or quantile.")
+        row_format = row_format or self._row_format
+        if processes and row_format not in ("dict", "tuple"):
+            raise ValueError("Parameter [row_format] must be dict or tuple when processes is True.")
+        filters = dict(filters or {})
+        if QueryUtil.GROUP in filters or "page" in filters:
+            raise ValueError("parallel_scan does not support groupby or page.")
+        descriptor = self._get_descriptor(table_name)
+        sql, params = descriptor.select_sql(filters, columns)
+        self._advise(table_name, filters, sql, params)
+        ranges = self._scan_ranges(descriptor, filters, partitions or workers * 4, split)
+        tasks = [(table_name, descriptor.range_filters(filters, lower, upper, inclusive),
+                  row_format, columns) for lower, upper, inclusive in ranges]
+        if processes:
+            executor = futures.ProcessPoolExecutor(max_workers=workers)
+            tasks = [(self._process_options(),) + task for task in tasks]
+            func = _process_scan
+        elif self._pool is not None and workers > 1:
+            executor = futures.ThreadPoolExecutor(max_workers=workers)
+            func = self._scan_range
+        else:
+            for task in tasks:
+                yield self._scan_range(*task)
+            return
+        with executor:
+            tasks = iter(tasks)
+            pending = [executor.submit(func, *task) for task in islice(tasks, workers * 2)]
+            try:
+                while pending:
+                    if ordered:
+                        future = pending.pop(0)
+                    else:
+                        done, _ = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+                        future = next(iter(done))
+                        pending.remove(future)
+                    result = future.result()
+                    for task in islice(tasks, 1):
+                        pending.append(executor.submit(func, *task))
+                    yield result
+            finally:
+                # 提前结束迭代或出错时取消未开始的范围
+                for future in pending:
+                    future.cancel()
+
+    def _scan_ranges(self, descriptor, filters, partitions, split=None):
+        '''按主键切分扫描范围，返回 [(下界, 上界, 是否包含上界)]，没有记录时返回 []'''
+        sql, params = descriptor.key_range_sql(filters)
+        result = self.execute_query(sql, True, params)
+        if result is None:
+            raise Exception("[%s] Failed to query the primary key range." % descriptor.name)
+        lower, upper = result
+        if lower is None:
+            return []
+        if split is None:
+            split = "minmax" if isinstance(lower, int) and isinstance(upper, int) else "quantile"
+        bounds = [lower]
+        if split == "minmax":
+            bounds.extend(lower + (upper - lower) * i // partitions for i in range(1, partitions))
+        else:
+            total = self._count_filters(descriptor.name, filters)
+            sql, params = descriptor.key_at_sql(filters)
+            for i in range(1, partitions):
+                result = self.execute_query(sql, True, params + [total * i // partitions])
+                if result is not None:
+                    bounds.append(result[0])
+        bounds.append(upper)
+        # 去掉重复和乱序的分界点(记录数少于范围数或主键分布集中时)
+        bounds = [bound for i, bound in enumerate(bounds) if i == 0 or bound > max(bounds[:i])]
+        if len(bounds) == 1:
+            return [(lower, upper, True)]
+        return [(bounds[i], bounds[i + 1], i == len(bounds) - 2) for i in range(len(bounds) - 1)]
+
+    def _scan_range(self, table_name, filters, row_format=None, columns=None):
+        '''查询一个主键范围, 查询失败时抛出异常(不像 select_all 返回 None)'''
+        descriptor = self._get_descriptor(table_name)
+        sql, params = descriptor.select_sql(filters, columns)
+        results = self.execute_query(sql, params=params)
+        if results is None:
+            raise Exception("[%s] Failed to scan range %s." % (table_name, params))
+        return self._parse_results(results, descriptor.row_parser(row_format or self._row_format, columns))
+
+    def _file_format(self, file_format):
+        '''获取文件格式对象'''
+        if file_format not in FILE_FORMATS:
+            raise ValueError("Parameter [format] must be one of %s." % (tuple(FILE_FORMATS),))
+        return FILE_FORMATS[file_format]
+
+    def _check_columns(self, table_name, columns):
+        '''验证字段都在表中, 返回字段元组'''
+        column_list = self._get_table_column_list(table_name)
+        columns = tuple(columns)
+        unknown = [c for c in columns if c not in column_list]
+        if not columns or unknown:
+            raise ValueError("Columns %s not in [%s]." % (unknown or columns, table_name))
+        return columns
+
+    @_operation
+    def bulk_load(self, table_name=None, source=None, format="csv", columns=None, header=True,
+                  batch_size=1000, ignore=False, on_duplicate=None, commit_every=None):
+        '''批量导入文件或行数据
+        - @table_name 表名
+        - @source 文件路径(格式见 CSVFormat / TSVFormat, 与 bulk_dump 的输出一致)，或行的可迭代对象(元组、列表或字典)
+        - @format 文件格式, "csv" 或 "tsv"(默认: "csv")
+        - @columns 字段列表(默认: None)，为空时使用文件的第一行(header 为 True)、第一个字典的 key 或表的全部字段
+        - @header 文件第一行是否为字段名(默认: True)
+        - @batch_size 多行 INSERT 每批的行数(默认: 1000)
+        - @ignore 是否忽略重复的行(INSERT IGNORE / LOAD DATA ... IGNORE)
+        - @on_duplicate 主键或唯一键冲突时更新的字段, 同 save_many(只用于多行 INSERT)
+        - @commit_every 多行 INSERT 每执行多少批提交一次(默认: None, 全部导入后提交一次)
+        - 开启 local_infile 且没有 on_duplicate 时文件使用 LOAD DATA LOCAL INFILE 导入，被禁用时改用多行 INSERT
+        - @return 导入的行数(LOAD DATA 为影响行数)
+        '''
+        table_name = self._check_table_name(table_name)
+        if source is None:
+            raise ValueError("Parameter [source] can not be None.")
+        self._before_write(table_name)
+        if batch_size is None or batch_size <= 0:
+            raise ValueError("Parameter [batch_size] must be greater than 0.")
+        file_format = self._file_format(format)
+        try:
+            if not isinstance(source, (str, bytes, os.PathLike)):
+                rows = iter(source)
+                first = next(rows, None)
+                if first is None:
+                    return 0
+                if columns is None and isinstance(first, dict):
+                    columns = tuple(first.keys())
+                columns = self._check_columns(table_name, columns or self._get_table_column_list(table_name))
+                rows = (tuple(row.get(c) for c in columns) if isinstance(row, dict) else row
+                        for row in chain((first,), rows))
+                return self._bulk_insert(table_name, columns, rows, batch_size, ignore,
+                                         on_duplicate, commit_every)
+            path = os.path.abspath(source)
+            with open(path, "r", encoding="utf-8", newline="") as f:
+                rows = file_format.read_rows(f)
+                names = next(rows, None) if header else None
+                columns = self._check_columns(
+                    table_name, columns or names or self._get_table_column_list(table_name))
+                if self._config.get("local_infile") and not on_duplicate:
+                    result = self._load_data(table_name, path, columns, file_format, header, ignore)
+                    if result is not None:
+                        return result
+                return self._bulk_insert(table_name, columns, rows, batch_size, ignore,
+                                         on_duplicate, commit_every)
+        finally:
+            self._after_write(table_name)
+
+    def _load_data(self, table_name, path, columns, file_format, header, ignore):
+        '''使用 LOAD DATA LOCAL INFILE 导入文件，方言不支持或被禁用时返回 None'''
+        statement = self._dialect.load_data_sql(
+            table_name, path, columns, file_format, header, ignore, self._config.get("charset"))
+        if statement is None:
+            return None
+        try:
+            if self._in_transaction():
+                return self._execute_in_transaction(*statement)
+            return self._execute(statement[0], statement[1], update=True, commit=True)
+        except Exception as e:
+            if not self._dialect.is_load_data_disabled(e):
+                raise
+            logger.warning("[%s] LOAD DATA LOCAL INFILE 不可用, 使用多行 INSERT: %s", table_name, e)
+            return None
+
+    def _bulk_insert(self, table_name, columns, rows, batch_size, ignore, on_duplicate,
+                     commit_every=None):
+        '''在一个事务中按 batch_size 行一批执行多行 INSERT，返回导入的行数'''
+        descriptor = self._get_descriptor(table_name)
+        update_columns = None
+        if on_duplicate is True:
+            update_columns = tuple(c for c in columns if c not in descriptor.primary_keys)
+        elif on_duplicate:
+            update_columns = tuple(on_duplicate)
+        size = len(columns)
+        total = 0
+        with self.transaction(commit_every):
+            params = []
+            count = 0
+            for row in rows:
+                if len(row) != size:
+                    raise ValueError("Row %s has %s values, expected %s." % (
+                        total + count + 1, len(row), size))
+                params.extend(row)
+                count += 1
+                if count == batch_size:
+                    self.execute_update(QueryUtil.insert_sql(
+                        table_name, columns, count, ignore, update_columns), params)
+                    total += count
+                    params = []
+                    count = 0
+            if count:
+                self.execute_update(QueryUtil.insert_sql(
+                    table_name, columns, count, ignore, update_columns), params)
+                total += count
+        return total
 
+    @_operation
+    def bulk_dump(self, table_name=None, path=None, filters=None, format="csv", columns=None,
+                  header=True, fetch_size=1000):
+        '''使用服务端游标(SSCursor)把查询结果直接写入文件，不转换为字典，内存占用与表大小无关
+        - @table_name 表名
+        - @path 文件路径
+        - @filters 过滤条件
+        - @format 文件格式, "csv" 或 "tsv"(默认: "csv")，可以由 bulk_load 导入
+        - @columns 导出的字段列表(默认: None, 全部字段)
+        - @header 是否在第一行写入字段名(默认: True)
+        - @fetch_size 每次读取的行数(默认: 1000)
+        - @return 导出的行数
+        '''
+        table_name = self._check_table_name(table_name)
+        if path is None:
+            raise ValueError("Parameter [path] can not be None.")
+        if fetch_size is None or fetch_size <= 0:
+            raise ValueError("Parameter [fetch_size] must be greater than 0.")
+        file_format = self._file_format(format)
+        descriptor = self._get_descriptor(table_name)
+        columns = descriptor.projection_columns(columns)
+        sql, params = descriptor.select_sql(filters, columns)
+        self._advise(table_name, filters, sql, params)
+        total = 0
+        format_row = file_format.format_row
+        with open(path, "w", encoding="utf-8", newline="") as f, \
+                self._open_stream_cursor() as (_, cursor):
+            if header:
+                f.write(format_row(columns))
+            with self._instrument(sql, params) as state:
+                cursor.execute(self._dialect.convert(sql), self._dialect.params(params))
+                state[0] = time.time()
+            while True:
+                results = cursor.fetchmany(fetch_size)
+                if not results:
+                    break
+                f.writelines([format_row(result) for result in results])
+                total += len(results)
+        return total
+
+    def _process_options(self):
+        '''子进程创建 BaseDao 的参数(creator 为模块名)'''
+        options = {k: v for k, v in self._config.items() if k in (
+            "host", "port", "user", "password", "database", "charset")}
+        options["creator"] = self._config["creator"].__name__
+        options["dialect"] = self._dialect.name
+        return options
+
+    @_operation
     def save(self, table_name=None, obj=None):
         '''保存方法
         - @param table_name 表名
         - @param obj 对象
         - @return 影响行数
         '''
-        self._check_table_name(table_name)
+        table_name = self._check_table_name(table_name)
         if obj is None:
             obj = {}
-        primary_key = self._get_primary_key(self._table)
-        if primary_key not in obj.keys():
-            obj[primary_key] = None
-        stitch_str = stitch_sequence(obj.keys())
-        value_list = []
-        for key, value in obj.items():
-            if self._table_dict[self._table][key]["COLUMN_KEY"] != "PKI":
-                value = "null" if value is None else '"%s"' % value
-            value_list.append(escape_quotes(value))
-        stitch_value_str = stitch_sequence(value_list, False)
-        sql = 'INSERT INTO `%s` (%s) VALUES(%s)' % (
-            self._table, stitch_str, stitch_value_str)
-        return self.execute_update(sql)
+        self._before_write(table_name)
+        sql, params = self._get_descriptor(table_name).insert_sql(obj)
+        try:
+            return self.execute_update(sql, params)
+        finally:
+            self._after_write(table_name)
+
+    @_operation
+    def save_many(self, table_name=None, objs=None, batch_size=500, ignore=False,
+                  on_duplicate=None):
+        '''批量保存方法, 按字段集合分组后使用多行 INSERT ... VALUES (...),(...) 插入，每批提交一次
+        - @param table_name 表名
+        - @param objs 对象列表
+        - @param batch_size 每批插入的行数(默认: 500)
+        - @param ignore 是否使用 INSERT IGNORE(默认: False)
+        - @param on_duplicate 主键或唯一键冲突时更新的字段列表(默认: None)，
+        为 True 时更新除主键外的所有插入字段，即 ON DUPLICATE KEY UPDATE
+        - @return 每批影响行数的列表
+        '''
+        table_name = self._check_table_name(table_name)
+        self._before_write(table_name)
+        batches = self._get_descriptor(table_name).insert_batches(
+            objs, batch_size, ignore, on_duplicate)
+        try:
+            return [self.execute_update(sql, params) for sql, params in batches]
+        finally:
+            self._after_write(table_name)
 
+    @_operation
     def update_by_primarykey(self, table_name=None, obj=None):
         '''更新方法(根据主键更新，包含空值)
         - @param table_name 表名
         - @param obj 对象
-        - @return 影响行数
+        - @return 影响行数, 开启 write_behind 时放入缓冲并返回 None
         '''
-        self._check_table_name(table_name)
+        table_name = self._check_table_name(table_name)
         if obj is None:
             obj = {}
-        primary_key = self._get_primary_key(self._table)
-        if primary_key not in obj.keys() or obj.get(primary_key) is None:
-            raise ValueError("Parameter [obj.%s] is None." % primary_key)
-        kv_list = []
-        where = "WHERE "
-        for key, value in obj.items():
-            if self._table_dict[table_name][key]["COLUMN_KEY"] != "PRI":
-                if value is None:
-                    if self._table_dict[table_name][key]["IS_NULLABLE"] == "YES":
-                        kv_list.append("%s=null" % (key))
-                    else:
-                        kv_list.append("%s=''" % (key))
-                else:
-                    kv_list.append("%s='%s'" % (key, escape_quotes(value)))
-            else:
-                where += "%s='%s'" % (key, escape_quotes(value))
-        sql = "UPDATE `%s` SET %s %s" % (
-            self._table, stitch_sequence(kv_list, False), where)
-        return self.execute_update(sql)
+        if self._buffer_update(table_name, obj, False):
+            return None
+        self._before_write(table_name)
+        sql, params = self._get_descriptor(table_name).update_sql(obj, False)
+        try:
+            return self.execute_update(sql, params)
+        finally:
+            self._after_write(table_name)
 
+    @_operation
     def update_by_primarikey_selective(self, table_name=None, obj=None):
         '''更新方法(根据主键更新，不包含空值)
         - @param table_name 表名
         - @param obj 对象
-        - @return 影响行数
+        - @return 影响行数, 开启 write_behind 时放入缓冲并返回 None
         '''
-        self._check_table_name(table_name)
+        table_name = self._check_table_name(table_name)
         if obj is None:
             obj = {}
-        primary_key = self._get_primary_key(self._table)
-        if primary_key not in obj.keys() or obj.get(primary_key) is None:
-            raise ValueError("Parameter [obj.%s] is None." % primary_key)
-        where = "WHERE "
-        kv_list = []
-        for key, value in obj.items():
-            if self._table_dict[self._table][key]["COLUMN_KEY"] != "PRI":
-                if value is None:
-                    continue
-                kv_list.append("%s='%s'" % (key, escape_quotes(value)))
-            else:
-                where += "%s='%s'" % (key, escape_quotes(value))
-        sql = "UPDATE `%s` SET %s %s" % (
-            self._table, stitch_sequence(kv_list, False), where)
-        return self.execute_update(sql)
+        if self._buffer_update(table_name, obj, True):
+            return None
+        self._before_write(table_name)
+        sql, params = self._get_descriptor(table_name).update_sql(obj, True)
+        try:
+            return self.execute_update(sql, params)
+        finally:
+            self._after_write(table_name)
+
+    @_operation
+    def update_many_by_primarykey(self, table_name=None, objs=None, batch_size=500):
+        '''批量更新方法(根据主键更新，包含空值)
+        - 按字段集合分组，每批编译为一条 UPDATE ... SET `col`=CASE `pk` WHEN ... THEN ... END
+        WHERE `pk` IN (...)，每批提交一次
+        - @param table_name 表名
+        - @param objs 对象列表，每个对象都必须包含主键
+        - @param batch_size 每批更新的行数(默认: 500)
+        - @return 影响行数
+        '''
+        table_name = self._check_table_name(table_name)
+        self._before_write(table_name)
+        total = 0
+        try:
+            for sql, params in self._get_descriptor(table_name).update_batches(objs, batch_size):
+                total += self.execute_update(sql, params) or 0
+        finally:
+            self._after_write(table_name)
+        return total
 
+    @_operation
     def remove_by_primarykey(self, table_name=None, value=None):
         '''删除方法（根据主键删除）
         - @param table_name 表名
-        - @param valuej 主键值
+        - @param value 主键值, 联合主键时为元组(按主键字段顺序)或字典
         - @return 影响行数
         '''
-        self._check_table_name(table_name)
-        if value is None:
-            raise ValueError("Parameter [value] can not be None.")
-        primary_key = self._get_primary_key(self._table)
-        sql = "DELETE FROM `%s` WHERE `%s`='%s'" % (
-            self._table, primary_key, value)
-        return self.execute_update(sql)
+        table_name = self._check_table_name(table_name)
+        self._before_write(table_name)
+        sql, params = self._get_descriptor(table_name).delete_sql(value)
+        try:
+            return self.execute_update(sql, params)
+        finally:
+            self._after_write(table_name)
+
+    @_operation
+    def remove_by_primarykeys(self, table_name=None, values=None, chunk_size=1000):
+        '''批量删除方法（根据主键删除）
+        - 按 chunk_size 分块执行 DELETE ... WHERE `pk` IN (...)，每块提交一次
+        - @param table_name 表名
+        - @param values 主键值列表
+        - @param chunk_size 每块删除的主键个数(默认: 1000)
+        - @return 影响行数
+        '''
+        table_name = self._check_table_name(table_name)
+        self._before_write(table_name)
+        total = 0
+        try:
+            for sql, params in self._get_descriptor(table_name).delete_batches(values, chunk_size):
+                total += self.execute_update(sql, params) or 0
+        finally:
+            self._after_write(table_name)
+        return total
+
+
+# parallel_scan 子进程中按连接参数复用的 BaseDao
+_process_daos = {}
+
+
+def _process_scan(options, table_name, filters, row_format, columns):
+    '''parallel_scan 的进程池任务, 子进程中创建非连接池模式的 BaseDao 扫描一个主键范围
+    - :options: BaseDao 的初始化参数, creator 为模块名
+    '''
+    key = tuple(sorted(options.items()))
+    dao = _process_daos.get(key)
+    if dao is None:
+        kwargs = dict(options)
+        creator = importlib.import_module(kwargs.pop("creator"))
+        dao = _process_daos[key] = BaseDao(creator=creator, log_sql=False, **kwargs)
+    return dao._scan_range(table_name, filters, row_format, columns)
 
 
 class Page(object):
     '分页对象'
+    # 使用 information_schema 中的估算记录数(仅在没有过滤条件时)
+    ESTIMATE = "estimate"
 
     def __init__(self, page_num=1, page_size=10, count=False):
         '''
         Page 初始化方法
         - @param page_num 页码，默认为1
         - @param page_size 页面大小, 默认为10
-        - @param count 是否包含 count 查询
+        - @param count 是否包含 count 查询, True 为精确 count(结果会按 count_ttl 缓存),
+        Page.ESTIMATE 为估算 count
         '''
         # 当前页数
         self.page_num = page_num if page_num > 0 else 1
         # 分页大小
         self.page_size = page_size if page_size > 0 else 10
+        # 是否包含 count 查询
+        self.count = count
         # 总记录数
         self.total = 0
         # 总页数
@@ -413,6 +3694,113 @@ class Page(object):
         self.end_row = self.start_row + self.page_size
 
 
+class KeysetPage(Page):
+    '''键集(seek)分页对象
+    - 按上一页最后一行的键值定位下一页(WHERE key > last ORDER BY key LIMIT n)，
+    不需要像 LIMIT offset 一样扫描并丢弃前面的行，深分页的耗时与第一页相同
+    - select_page 查询后会更新 last 和 has_next，可以直接用于下一次查询
+    '''
+    # 键集分页的 LIMIT 形式
+    SEEK = "seek"
+
+    def __init__(self, page_size=10, last=None, key=None, count=False):
+        '''
+        KeysetPage 初始化方法
+        - @param page_size 页面大小, 默认为10
+        - @param last 上一页最后一行的键值, 默认为 None(第一页)
+        - @param key 分页的键，需要唯一且有索引, 默认为 orderby 字段或主键
+        - @param count 是否包含 count 查询, 同 Page
+        '''
+        super(KeysetPage, self).__init__(1, page_size, count)
+        self.last = last
+        self.key = key
+        # 是否还有下一页
+        self.has_next = True
+
+    def advance(self, result_tuple, descriptor, columns=None):
+        '''根据本页的查询结果(元组)更新 last 和 has_next
+        - :columns: 投影字段(默认: None, 全部字段)
+        '''
+        if result_tuple is None:
+            return
+        self.has_next = len(result_tuple) >= self.page_size
+        if result_tuple:
+            index = columns.index(self.key) if columns is not None \
+                else descriptor.column_index[self.key]
+            self.last = result_tuple[-1][index]
+
+
+class PkLoader(object):
+    '''
+    合并主键查询的加载器(DataLoader)，通过 BaseDao.pk_loader 创建, 用于一次请求内的关联查询
+    - load(key) 只登记主键并返回 LoaderResult，第一次读取任意 LoaderResult.value 或调用 dispatch() 时，
+    所有已登记的主键合并为 select_pks 的一条(分块) IN 查询
+    - 已加载的主键在加载器的生命周期内不会再次查询
+    '''
+
+    def __init__(self, dao, table_name, row_format=None, chunk_size=1000):
+        self._dao = dao
+        self._table = table_name
+        self._row_format = row_format
+        self._chunk_size = chunk_size
+        # {主键: 对象}
+        self._loaded = {}
+        # 待加载的主键(保持顺序)
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def load(self, key):
+        '''登记待加载的主键, 返回 LoaderResult'''
+        with self._lock:
+            if key not in self._loaded:
+                self._pending[key] = None
+        return LoaderResult(self, key)
+
+    def load_many(self, keys):
+        '''加载多个主键, 立即返回与 keys 顺序一致的对象列表'''
+        keys = list(keys)
+        for key in keys:
+            self.load(key)
+        self.dispatch()
+        return [self._loaded.get(key) for key in keys]
+
+    def dispatch(self):
+        '''将所有待加载的主键合并查询'''
+        with self._lock:
+            pending, self._pending = list(self._pending), {}
+            if not pending:
+                return
+            results = self._dao.select_pks(
+                self._table, pending, self._row_format, self._chunk_size)
+            self._loaded.update(zip(pending, results))
+
+    def get(self, key):
+        '''获取主键对应的对象, 未加载时先执行 dispatch'''
+        if key not in self._loaded:
+            self.load(key)
+            self.dispatch()
+        return self._loaded.get(key)
+
+    def clear(self):
+        '''清空已加载的对象'''
+        with self._lock:
+            self._loaded = {}
+
+
+class LoaderResult(object):
+    '''PkLoader.load 返回的延迟结果, 读取 value 时才执行合并查询'''
+    __slots__ = ("_loader", "key")
+
+    def __init__(self, loader, key):
+        self._loader = loader
+        self.key = key
+
+    @property
+    def value(self):
+        '''主键对应的对象, 不存在时为 None'''
+        return self._loader.get(self.key)
+
+
 class QueryUtil(object):
     '''
     SQL 语句拼接工具类：
@@ -437,6 +3825,9 @@ class QueryUtil(object):
     - 11、like（如：{"_rlike_name": }，拼接后为：name LIKE 'zhang%'）
     - 12、分组（如：{"groupby": "status"}，拼接后为：GROUP BY status）
     - 13、排序（如：{"orderby": "createDate"}，拼接后为：ORDER BY createDate）
+
+    拼接结果为 (SQL 模板, 参数列表)，条件值全部以 %s 占位传给 cursor.execute，
+    相同条件结构(key、in 参数个数、分组、排序、分页)的 SQL 模板只编译一次
     '''
     NE = "_ne_"                 # 拼接不等于
     LT = "_lt_"                 # 拼接小于
@@ -452,98 +3843,530 @@ class QueryUtil(object):
     ORDER = "orderby"           # 拼接排序
     ORDER_TYPE = "ordertype"    # 排序类型：asc（升序）、desc（降序）
 
+    # 不作为查询条件的 key
+    RESERVED = (GROUP, ORDER, ORDER_TYPE, "page")
+    # 编译后 SQL 模板的缓存数量
+    CACHE_SIZE = 1024
+
     @staticmethod
     def __filter_params(filters):
-        '''过滤参数条件'''
-        res = " WHERE 1=1"
+        '''过滤参数条件, 返回 (条件结构, 参数列表)
+        - 条件结构只包含 key 以及 in/not in 的参数个数，相同结构的查询共用同一个 SQL 模板
+        '''
+        shape = []
+        params = []
         for key, value in filters.items():
-            if key.startswith(QueryUtil.IN):                  # 拼接 in
-                res += " AND `%s` IN (" % (key[len(QueryUtil.IN):])
-                value_list = value.split(",")
-                for value in value_list:
-                    res += " %s," % value
-                res = res[0:len(res) - 1] + ") "
-            elif key.startswith(QueryUtil.NE_IN):               # 拼接 not in
-                res += " AND `%s` NOT IN (" % (key[len(QueryUtil.NE_IN):])
-                value_list = value.split(",")
-                for value in value_list:
-                    res += " %s," % value
-                res = res[0:len(res) - 1] + ") "
-            elif key.startswith(QueryUtil.LIKE):                # 拼接 like
-                res += " AND `%s` LIKE '%%%s%%' " % (key[len(QueryUtil.LIKE):], value)
-            elif key.startswith(QueryUtil.LEFT_LIKE):           # 拼接左 like
-                res += " AND `%s` LIKE '%%%s' " % (
-                    key[len(QueryUtil.LEFT_LIKE):], value)
-            elif key.startswith(QueryUtil.RIGHT_LIKE):          # 拼接右 like
-                res += " AND `%s` LIKE '%s%%' " % (
-                    key[len(QueryUtil.RIGHT_LIKE):], value)
-            elif key.startswith(QueryUtil.NE):                  # 拼接不等于
-                res += " AND `%s` != '%s' " % (key[len(QueryUtil.NE):], value)
-            elif key.startswith(QueryUtil.LT):                  # 拼接小于
-                res += " AND `%s` < '%s' " % (key[len(QueryUtil.LT):], value)
-            elif key.startswith(QueryUtil.LE):                  # 拼接小于等于
-                res += " AND `%s` <= '%s' " % (key[len(QueryUtil.LE):], value)
-            elif key.startswith(QueryUtil.GT):                  # 拼接大于
-                res += " AND `%s` > '%s' " % (key[len(QueryUtil.GT):], value)
-            elif key.startswith(QueryUtil.GE):                  # 拼接大于等于
-                res += " AND `%s` >= '%s' " % (key[len(QueryUtil.GE):], value)
-            else:                                               # 拼接等于
+            if key in QueryUtil.RESERVED:
+                continue
+            if key.startswith(QueryUtil.IN) or key.startswith(QueryUtil.NE_IN):
                 if isinstance(value, str):
-                    res += " AND `%s`='%s' " % (key, value)
-                elif isinstance(value, int):
-                    res += " AND `%s`=%d " % (key, value)
-        return res
+                    value = [item.strip() for item in value.split(",")]
+                value = list(value)
+                shape.append((key, len(value)))
+                params.extend(value)
+                continue
+            if key.startswith(QueryUtil.LIKE):
+                value = "%%%s%%" % value
+            elif key.startswith(QueryUtil.LEFT_LIKE):
+                value = "%%%s" % value
+            elif key.startswith(QueryUtil.RIGHT_LIKE):
+                value = "%s%%" % value
+            elif value is None:
+                # 等于条件的值为空时忽略该条件
+                continue
+            shape.append((key, 1))
+            params.append(value)
+        return tuple(shape), params
 
     @staticmethod
-    def __filter_group(filters):
-        '''过滤分组'''
-        group = filters.pop(QueryUtil.GROUP)
-        res = " GROUP BY %s" % (group)
-        return res
+    def split_key(key):
+        '''拆分过滤条件的 key, 返回 (条件前缀, 字段名)，等于条件的前缀为 ""'''
+        for prefix in (QueryUtil.IN, QueryUtil.NE_IN, QueryUtil.LIKE, QueryUtil.LEFT_LIKE,
+                       QueryUtil.RIGHT_LIKE, QueryUtil.NE, QueryUtil.LT, QueryUtil.LE,
+                       QueryUtil.GT, QueryUtil.GE):
+            if key.startswith(prefix):
+                return prefix, key[len(prefix):]
+        return "", key
 
     @staticmethod
-    def __filter_order(filters):
-        '''过滤排序'''
-        order = filters.pop(QueryUtil.ORDER)
-        order_type = filters.pop(QueryUtil.ORDER_TYPE, "asc")
-        res = " ORDER BY `%s` %s" % (order, order_type)
-        return res
+    def __filter_condition(key, size):
+        '''拼接单个条件'''
+        if key.startswith(QueryUtil.IN):                    # 拼接 in
+            return " AND `%s` IN (%s)" % (
+                key[len(QueryUtil.IN):], stitch_sequence(["%s"] * size, False))
+        elif key.startswith(QueryUtil.NE_IN):               # 拼接 not in
+            return " AND `%s` NOT IN (%s)" % (
+                key[len(QueryUtil.NE_IN):], stitch_sequence(["%s"] * size, False))
+        elif key.startswith(QueryUtil.LIKE):                # 拼接 like
+            return " AND `%s` LIKE %%s" % (key[len(QueryUtil.LIKE):])
+        elif key.startswith(QueryUtil.LEFT_LIKE):           # 拼接左 like
+            return " AND `%s` LIKE %%s" % (key[len(QueryUtil.LEFT_LIKE):])
+        elif key.startswith(QueryUtil.RIGHT_LIKE):          # 拼接右 like
+            return " AND `%s` LIKE %%s" % (key[len(QueryUtil.RIGHT_LIKE):])
+        elif key.startswith(QueryUtil.NE):                  # 拼接不等于
+            return " AND `%s` != %%s" % (key[len(QueryUtil.NE):])
+        elif key.startswith(QueryUtil.LT):                  # 拼接小于
+            return " AND `%s` < %%s" % (key[len(QueryUtil.LT):])
+        elif key.startswith(QueryUtil.LE):                  # 拼接小于等于
+            return " AND `%s` <= %%s" % (key[len(QueryUtil.LE):])
+        elif key.startswith(QueryUtil.GT):                  # 拼接大于
+            return " AND `%s` > %%s" % (key[len(QueryUtil.GT):])
+        elif key.startswith(QueryUtil.GE):                  # 拼接大于等于
+            return " AND `%s` >= %%s" % (key[len(QueryUtil.GE):])
+        return " AND `%s`=%%s" % (key)                      # 拼接等于
 
     @staticmethod
-    def __filter_page(filters):
-        '''过滤 page 对象'''
-        page = filters.pop("page")
-        return " LIMIT %d,%d" % (page.start_row, page.end_row)
+    @lru_cache(maxsize=CACHE_SIZE)
+    def compile_sql(sql, shape, group=None, order=None, order_type=None, page=False):
+        '''按条件结构编译 SQL 模板(带 LRU 缓存)
+        - @param sql SQL 语句
+        - @param shape 条件结构, ((key, 参数个数), ...)
+        - @param group 分组字段
+        - @param order 排序字段
+        - @param order_type 排序类型
+        - @param page 是否分页, KeysetPage.SEEK 表示键集分页
+        - @return 返回 SQL 模板
+        '''
+        res = [sql, " WHERE 1=1"]
+        for key, size in shape:
+            res.append(QueryUtil.__filter_condition(key, size))
+        if group:
+            res.append(" GROUP BY %s" % (group))
+        if order:
+            res.append(" ORDER BY `%s` %s" % (order, order_type))
+        if page == KeysetPage.SEEK:
+            res.append(" LIMIT %s")
+        elif page:
+            res.append(" LIMIT %s,%s")
+        return "".join(res)
+
+    @staticmethod
+    @lru_cache(maxsize=CACHE_SIZE)
+    def insert_sql(table, columns, rows=1, ignore=False, update_columns=None):
+        '''编译 INSERT SQL 模板(带 LRU 缓存)
+        - @param table 表名
+        - @param columns 插入字段
+        - @param rows 插入行数, 大于 1 时生成多行 VALUES
+        - @param ignore 是否使用 INSERT IGNORE
+        - @param update_columns 冲突时更新的字段(ON DUPLICATE KEY UPDATE)
+        - @return 返回 SQL 模板
+        '''
+        values = "(%s)" % stitch_sequence(["%s"] * len(columns), False)
+        sql = 'INSERT %sINTO `%s` (%s) VALUES%s' % (
+            "IGNORE " if ignore else "", table, stitch_sequence(columns),
+            stitch_sequence([values] * rows, False))
+        if update_columns:
+            sql += " ON DUPLICATE KEY UPDATE %s" % stitch_sequence(
+                ["`%s`=VALUES(`%s`)" % (c, c) for c in update_columns], False)
+        return sql
+
+    @staticmethod
+    @lru_cache(maxsize=CACHE_SIZE)
+    def update_case_sql(table, primary_key, columns, rows):
+        '''编译批量 UPDATE SQL 模板(带 LRU 缓存)，WHERE 条件由 query_sql 拼接
+        - @param table 表名
+        - @param primary_key 主键字段
+        - @param columns 更新字段
+        - @param rows 更新行数
+        - @return 返回 SQL 模板, 每个字段的参数为 rows 组 (主键值, 字段值)
+        '''
+        case = "CASE `%s` %s END" % (
+            primary_key, " ".join(["WHEN %s THEN %s"] * rows))
+        return "UPDATE `%s` SET %s" % (
+            table, stitch_sequence(["`%s`=%s" % (c, case) for c in columns], False))
 
     @staticmethod
     def query_sql(sql=None, filters=None):
         '''拼接 SQL 查询条件
         - @param sql SQL 语句
         - @param filters 过滤条件
-        - @return 返回拼接 SQL
+        - @return 返回 (SQL 模板, 参数列表)，交给 cursor.execute(sql, params) 执行
         '''
         if filters is None:
-            return sql
-        else:
-            if not isinstance(filters, dict):
-                raise Exception("Parameter [filters] must be dict.")
-            group = None
-            order = None
-            page = None
-            if filters.get("groupby") != None:
-                group = QueryUtil.__filter_group(filters)
-            if filters.get("orderby") != None:
-                order = QueryUtil.__filter_order(filters)
-            if filters.get("page") != None:
-                page = QueryUtil.__filter_page(filters)
-            sql += QueryUtil.__filter_params(filters)
-            if group:
-                sql += group
-            if order:
-                sql += order
-            if page:
-                sql += page
-        return sql
+            return sql, []
+        if not isinstance(filters, dict):
+            raise Exception("Parameter [filters] must be dict.")
+        shape, params = QueryUtil.__filter_params(filters)
+        order = filters.get(QueryUtil.ORDER)
+        order_type = filters.get(QueryUtil.ORDER_TYPE, "asc") if order is not None else None
+        page = filters.get("page")
+        limit = None
+        if isinstance(page, KeysetPage):
+            if page.key is None:
+                raise Exception("Parameter [page.key] is None.")
+            if order is not None and order != page.key:
+                raise ValueError("KeysetPage must be ordered by its key [%s]." % page.key)
+            order = page.key
+            order_type = filters.get(QueryUtil.ORDER_TYPE, "asc")
+            if page.last is not None:
+                op = QueryUtil.LT if order_type.lower() == "desc" else QueryUtil.GT
+                shape += ((op + page.key, 1),)
+                params.append(page.last)
+            params.append(page.page_size)
+            limit = KeysetPage.SEEK
+        elif page is not None:
+            params.extend((page.start_row, page.page_size))
+            limit = True
+        sql = QueryUtil.compile_sql(
+            sql, shape, filters.get(QueryUtil.GROUP), order, order_type, limit)
+        return sql, params
+
+
+class AsyncBaseDao(object):
+    '''
+    基于 aiomysql 的异步 BaseDao，CRUD 方法与 BaseDao 同名且均为协程
+    - 与 BaseDao 共用表结构注册表(SchemaRegistry)、TableDescriptor、QueryUtil 编译的 SQL 模板和方言(Dialect)的表结构读取
+    - 使用前需要 await init()，或者使用 await AsyncBaseDao.create(...) / async with
+    - :host: 数据库ip地址
+    - :port: 数据库端口
+    - :user: 用户名
+    - :password: 用户密码
+    - :database: 数据库名
+    - :charset: 字符集(默认: utf8)
+    - :table: 默认操作的表名(默认: None)
+    - :minsize: 连接池最小连接数(默认: 1)
+    - :maxsize: 连接池最大连接数(默认: 10)
+    - :row_format: 查询结果的行格式(默认: dict), 见 BaseDao.ROW_FORMATS
+    - :schema_ttl: 表结构的有效秒数(默认: None, 永久有效)
+    - :dialect: 数据库方言(默认: None, 即 "mysql")，见 BaseDao 的 dialect 参数，
+    用 SQLite 实现的 aiomysql 兼容连接池做单元测试时为 "sqlite"
+    - :pool_kwargs: 传给 aiomysql.create_pool 的其它参数
+    '''
+
+    def __init__(self, host="localhost", port=3306, user=None, password=None, database=None,
+                 charset="utf8", table=None, minsize=1, maxsize=10, row_format="dict",
+                 schema_ttl=None, dialect=None, **pool_kwargs):
+        if aiomysql is None:
+            raise ImportError("AsyncBaseDao requires aiomysql.")
+        if row_format not in BaseDao.ROW_FORMATS:
+            raise ValueError("Parameter [row_format] must be one of %s." % (BaseDao.ROW_FORMATS,))
+        self._config = {
+            "host": host,
+            "port": port,
+            "user": user,
+            "password": password,
+            "db": database,
+            "charset": charset,
+            "minsize": minsize,
+            "maxsize": maxsize,
+        }
+        self._config.update(pool_kwargs)
+        self._dialect = get_dialect(dialect)
+        self._database = database
+        self._table = table
+        self._row_format = row_format
+        self._schema = get_schema_registry(host, port, database, schema_ttl)
+        self._pool = None
+
+    @classmethod
+    async def create(cls, **kwargs):
+        '''创建并初始化 AsyncBaseDao'''
+        dao = cls(**kwargs)
+        await dao.init()
+        return dao
+
+    async def init(self):
+        '''创建连接池，有默认表时加载其表结构'''
+        if self._pool is None:
+            self._pool = await aiomysql.create_pool(**self._config)
+        if self._table is not None:
+            await self._ensure_tables(self._table)
+        return self
+
+    async def close(self):
+        '''关闭连接池并等待所有连接释放'''
+        if self._pool is not None:
+            self._pool.close()
+            await self._pool.wait_closed()
+            self._pool = None
+
+    async def __aenter__(self):
+        return await self.init()
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def _ensure_tables(self, *table_names):
+        '''确保表结构已经加载，未加载或已过期的表使用一条查询批量加载'''
+        missing = self._schema.missing(table_names)
+        if not missing:
+            return
+        # 与 Dialect.load_tables 相同, 只是异步执行生成的查询
+        steps = self._dialect.load_tables_steps(self, missing)
+        result = None
+        try:
+            while True:
+                sql, params = steps.send(result)
+                result = await self.execute_query(sql, params=params)
+        except StopIteration:
+            pass
+        for table_name in missing:
+            if table_name not in self._schema.table_dict:
+                raise Exception(table_name, "is not exist.")
+
+    async def _get_descriptor(self, table_name=None):
+        '''验证表名并获取表描述对象, table_name 为 None 时使用默认表'''
+        if table_name is None:
+            if self._table is None:
+                raise Exception("Parameter [table_name] is None.")
+            table_name = self._table
+        await self._ensure_tables(table_name)
+        return self._schema.descriptors[table_name]
+
+    def _get_row_parser(self, descriptor, row_format=None, columns=None):
+        '''获取表的行解析函数'''
+        return descriptor.row_parser(row_format or self._row_format, columns)
+
+    async def execute_query(self, sql=None, single=False, params=None):
+        '''执行查询 SQL 语句，参数同 BaseDao.execute_query'''
+        try:
+            if sql is None:
+                raise Exception("Parameter sql is None.")
+            logger.info("[%s] SQL >>> [%s] %s", self._database, sql, params)
+            async with self._pool.acquire() as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.execute(self._dialect.convert(sql), self._dialect.params(params))
+                    return await (cursor.fetchone() if single else cursor.fetchall())
+        except Exception as e:
+            logger.error(e)
+
+    async def execute_update(self, sql=None, params=None):
+        '''执行更新 SQL 语句，参数同 BaseDao.execute_update'''
+        try:
+            if sql is None:
+                raise Exception("Parameter sql is None.")
+            logger.info("[%s] SQL >>> [%s] %s", self._database, sql, params)
+            async with self._pool.acquire() as conn:
+                async with conn.cursor() as cursor:
+                    try:
+                        result = await cursor.execute(
+                            self._dialect.convert(sql), self._dialect.params(params))
+                        await conn.commit()
+                        return result
+                    except Exception:
+                        await conn.rollback()
+                        raise
+        except Exception as e:
+            logger.error(e)
+
+    async def select_one(self, table_name=None, filters=None, row_format=None, columns=None):
+        '''查询单个对象，参数同 BaseDao.select_one'''
+        descriptor = await self._get_descriptor(table_name)
+        sql, params = descriptor.select_sql(filters, columns)
+        result = await self.execute_query(sql, True, params)
+        return None if result is None else \
+            self._get_row_parser(descriptor, row_format, columns)(result)
+
+    async def select_pk(self, table_name=None, primary_key=None, row_format=None):
+        '''按主键查询，参数同 BaseDao.select_pk'''
+        descriptor = await self._get_descriptor(table_name)
+        sql, params = descriptor.select_pk_sql(primary_key)
+        result = await self.execute_query(sql, True, params)
+        return None if result is None else self._get_row_parser(descriptor, row_format)(result)
+
+    async def select_pks(self, table_name=None, keys=None, row_format=None, chunk_size=1000):
+        '''按主键批量查询，参数同 BaseDao.select_pks'''
+        if keys is None:
+            raise ValueError("Parameter [keys] can not be None.")
+        descriptor = await self._get_descriptor(table_name)
+        parser = self._get_row_parser(descriptor, row_format)
+        keys = list(keys)
+        index = descriptor.column_index[descriptor.single_primary_key()]
+        found = {}
+        for sql, params in descriptor.select_pks_batches(dict.fromkeys(keys), chunk_size):
+            for result in await self.execute_query(sql, params=params) or ():
+                found[result[index]] = parser(result)
+        return [found.get(key) for key in keys]
+
+    def pk_loader(self, table_name=None, row_format=None, chunk_size=1000):
+        '''创建合并主键查询的异步加载器(AsyncPkLoader)，参数同 BaseDao.pk_loader'''
+        table_name = table_name or self._table
+        if table_name is None:
+            raise Exception("Parameter [table_name] is None.")
+        return AsyncPkLoader(self, table_name, row_format, chunk_size)
+
+    async def select_all(self, table_name=None, filters=None, row_format=None, columns=None):
+        '''查询所有，参数同 BaseDao.select_all'''
+        descriptor = await self._get_descriptor(table_name)
+        sql, params = descriptor.select_sql(filters, columns)
+        results = await self.execute_query(sql, params=params)
+        if results is None:
+            return None
+        parser = self._get_row_parser(descriptor, row_format, columns)
+        return [parser(result) for result in results]
+
+    async def iter_all(self, table_name=None, filters=None, fetch_size=1000, raw=False,
+                       row_format=None):
+        '''流式查询所有(异步迭代器)，使用 aiomysql.SSCursor 按 fetch_size 分块读取
+        - 用法: async for row in dao.iter_all("city"): ...
+        - 其它参数同 BaseDao.iter_all
+        '''
+        if fetch_size is None or fetch_size <= 0:
+            raise ValueError("Parameter [fetch_size] must be greater than 0.")
+        descriptor = await self._get_descriptor(table_name)
+        parser = self._get_row_parser(descriptor, "tuple" if raw else row_format)
+        sql, params = descriptor.select_sql(filters)
+        logger.info("[%s] SQL >>> [%s] %s", self._database, sql, params)
+        async with self._pool.acquire() as conn:
+            async with conn.cursor(aiomysql.SSCursor) as cursor:
+                await cursor.execute(self._dialect.convert(sql), self._dialect.params(params))
+                while True:
+                    results = await cursor.fetchmany(fetch_size)
+                    if not results:
+                        break
+                    for result in results:
+                        yield parser(result)
+
+    async def count(self, table_name=None, filters=None):
+        '''统计记录数
+        - @filters 过滤条件(忽略分组、排序和分页)
+        '''
+        descriptor = await self._get_descriptor(table_name)
+        sql, params = descriptor.count_sql(filters)
+        result = await self.execute_query(sql, True, params)
+        return result[0] if result else 0
+
+    async def aggregate(self, table_name=None, aggregates=None, filters=None, groupby=None):
+        '''聚合查询，参数和返回值同 BaseDao.aggregate'''
+        descriptor = await self._get_descriptor(table_name)
+        sql, params, columns = descriptor.aggregate_sql(aggregates, filters, groupby)
+        results = await self.execute_query(sql, params=params)
+        if results is None:
+            return None
+        objs = [dict(zip(columns, result)) for result in results]
+        if not groupby:
+            return objs[0] if objs else {}
+        return objs
+
+    async def select_page(self, table_name=None, page=None, filters=None, row_format=None,
+                          columns=None):
+        '''分页查询，参数同 BaseDao.select_page
+        - page.count 不为 False 时每次都执行 count 查询(不使用 BaseDao 的 count_ttl 缓存)，
+        Page.ESTIMATE 的估算语句由方言提供，方言没有估算值时使用精确 count
+        '''
+        descriptor = await self._get_descriptor(table_name)
+        if page is None:
+            page = Page()
+        if page.count:
+            conditions = {k: v for k, v in (filters or {}).items()
+                          if k not in QueryUtil.RESERVED}
+            statement = None
+            if page.count == Page.ESTIMATE and not conditions:
+                statement = self._dialect.estimate_count_sql(self._database, descriptor.name)
+            if statement is not None:
+                result = await self.execute_query(statement[0], True, statement[1])
+                page.total = (result[0] or 0) if result else 0
+            else:
+                page.total = await self.count(descriptor.name, conditions)
+            page.pages = max((page.total + page.page_size - 1) // page.page_size, 1)
+        columns = descriptor.page_columns(page, filters, columns)
+        sql, params = descriptor.page_sql(page, filters, columns)
+        result_tuple = await self.execute_query(sql, params=params)
+        if isinstance(page, KeysetPage):
+            page.advance(result_tuple, descriptor, columns)
+        if result_tuple is None:
+            return None
+        parser = self._get_row_parser(descriptor, row_format, columns)
+        return [parser(result) for result in result_tuple]
+
+    async def save(self, table_name=None, obj=None):
+        '''保存方法，参数同 BaseDao.save'''
+        descriptor = await self._get_descriptor(table_name)
+        sql, params = descriptor.insert_sql({} if obj is None else obj)
+        return await self.execute_update(sql, params)
+
+    async def save_many(self, table_name=None, objs=None, batch_size=500, ignore=False,
+                        on_duplicate=None):
+        '''批量保存方法，参数同 BaseDao.save_many'''
+        descriptor = await self._get_descriptor(table_name)
+        batches = descriptor.insert_batches(objs, batch_size, ignore, on_duplicate)
+        return [await self.execute_update(sql, params) for sql, params in batches]
+
+    async def update_by_primarykey(self, table_name=None, obj=None):
+        '''更新方法(根据主键更新，包含空值)，参数同 BaseDao.update_by_primarykey'''
+        descriptor = await self._get_descriptor(table_name)
+        sql, params = descriptor.update_sql({} if obj is None else obj, False)
+        return await self.execute_update(sql, params)
+
+    async def update_by_primarikey_selective(self, table_name=None, obj=None):
+        '''更新方法(根据主键更新，不包含空值)，参数同 BaseDao.update_by_primarikey_selective'''
+        descriptor = await self._get_descriptor(table_name)
+        sql, params = descriptor.update_sql({} if obj is None else obj, True)
+        return await self.execute_update(sql, params)
+
+    async def update_many_by_primarykey(self, table_name=None, objs=None, batch_size=500):
+        '''批量更新方法(根据主键更新，包含空值)，参数同 BaseDao.update_many_by_primarykey'''
+        descriptor = await self._get_descriptor(table_name)
+        total = 0
+        for sql, params in descriptor.update_batches(objs, batch_size):
+            total += await self.execute_update(sql, params) or 0
+        return total
+
+    async def remove_by_primarykey(self, table_name=None, value=None):
+        '''删除方法（根据主键删除），参数同 BaseDao.remove_by_primarykey'''
+        descriptor = await self._get_descriptor(table_name)
+        sql, params = descriptor.delete_sql(value)
+        return await self.execute_update(sql, params)
+
+    async def remove_by_primarykeys(self, table_name=None, values=None, chunk_size=1000):
+        '''批量删除方法（根据主键删除），参数同 BaseDao.remove_by_primarykeys'''
+        descriptor = await self._get_descriptor(table_name)
+        total = 0
+        for sql, params in descriptor.delete_batches(values, chunk_size):
+            total += await self.execute_update(sql, params) or 0
+        return total
+
+
+class AsyncPkLoader(object):
+    '''
+    合并主键查询的异步加载器(DataLoader)，通过 AsyncBaseDao.pk_loader 创建
+    - 同一轮事件循环中 await loader.load(key) 的所有主键合并为 select_pks 的一条(分块) IN 查询
+    - 已加载的主键在加载器的生命周期内不会再次查询
+    '''
+
+    def __init__(self, dao, table_name, row_format=None, chunk_size=1000):
+        self._dao = dao
+        self._table = table_name
+        self._row_format = row_format
+        self._chunk_size = chunk_size
+        # {主键: Future}
+        self._futures = {}
+        # 待加载的主键
+        self._pending = []
+
+    def load(self, key):
+        '''加载主键对应的对象, 返回 Future，不存在时结果为 None'''
+        future = self._futures.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = self._futures[key] = loop.create_future()
+            if not self._pending:
+                loop.call_soon(lambda: asyncio.ensure_future(self.dispatch()))
+            self._pending.append(key)
+        return future
+
+    async def load_many(self, keys):
+        '''加载多个主键, 返回与 keys 顺序一致的对象列表'''
+        return await asyncio.gather(*[self.load(key) for key in keys])
+
+    async def dispatch(self):
+        '''将所有待加载的主键合并查询'''
+        pending, self._pending = self._pending, []
+        if not pending:
+            return
+        try:
+            results = await self._dao.select_pks(
+                self._table, pending, self._row_format, self._chunk_size)
+        except Exception as e:
+            for key in pending:
+                self._futures.pop(key).set_exception(e)
+            return
+        for key, result in zip(pending, results):
+            self._futures[key].set_result(result)
+
+    def clear(self):
+        '''清空已加载的对象'''
+        self._futures = {k: v for k, v in self._futures.items() if not v.done()}
 
 
 def _test1():
@@ -637,6 +4460,11 @@ def _test3():
 
 
 if __name__ == '__main__':
+    logging.basicConfig(
+        level=logging.INFO,
+        datefmt='%Y-%m-%d %H:%M:%S',
+        format='%(asctime)s [%(levelname)s] %(message)s'
+    )
     # _test1()
     # _test2()
     _test3()
@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+# -*- coding=utf-8 -*-
+
+'''
+BaseDao 基准测试脚本, 结果以 JSON 输出, 用于比较不同提交之间的性能变化.
+
+- 微基准(micro): 使用假的 DB-API creator, 不需要数据库，测试 SQL 拼接和结果解析的耗时
+- 宏基准(macro): 连接本地 MySQL/MariaDB, 导入 init_sql.sql 并扩充 city 表到指定行数，
+  按 1/8/32 个线程测试 select_pk、select_all、深分页、save 与 save_many、update 的吞吐量和 p50/p99 延迟
+
+用法:
+    python benchmark.py --micro-only --output micro.json
+    python benchmark.py --user root --password root --database bench --rows 1000000 --output bench.json
+'''
+__author__ = "阮程"
+
+import argparse
+import importlib
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+import types
+
+from basedao import BaseDao, KeysetPage, Page, QueryUtil
+
+# city 表结构, 与 init_sql.sql 一致
+CITY_COLUMNS = (
+    ("id", "int", "PRI", "NO"),
+    ("city_id", "varchar", "", "NO"),
+    ("city", "varchar", "", "NO"),
+    ("province_id", "varchar", "", "NO"),
+)
+# 假的 information_schema.`COLUMNS` 的列
+FAKE_INFORMATION_SCHEMA_COLUMNS = (
+    "TABLE_SCHEMA", "TABLE_NAME", "COLUMN_NAME", "ORDINAL_POSITION",
+    "DATA_TYPE", "COLUMN_KEY", "IS_NULLABLE")
+
+
+def percentile(values, p):
+    '''计算已排序列表的百分位数'''
+    if not values:
+        return 0.0
+    index = min(int(round(len(values) * p / 100.0 + 0.5)) - 1, len(values) - 1)
+    return values[max(index, 0)]
+
+
+def summarize(latencies, elapsed):
+    '''汇总延迟列表(秒), 返回毫秒表示的统计结果'''
+    latencies = sorted(latencies)
+    return {
+        "ops": len(latencies),
+        "seconds": elapsed,
+        "ops_per_sec": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "max_ms": latencies[-1] * 1000 if latencies else 0.0,
+    }
+
+
+def measure(func, iterations):
+    '''单线程执行 func(i) iterations 次'''
+    latencies = []
+    start = time.perf_counter()
+    for i in range(iterations):
+        begin = time.perf_counter()
+        func(i)
+        latencies.append(time.perf_counter() - begin)
+    return summarize(latencies, time.perf_counter() - start)
+
+
+def measure_concurrent(func, threads, iterations):
+    '''threads 个线程各执行 func(i) iterations 次'''
+    latencies = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(threads + 1)
+
+    def worker(offset):
+        local = []
+        barrier.wait()
+        for i in range(iterations):
+            begin = time.perf_counter()
+            func(offset + i)
+            local.append(time.perf_counter() - begin)
+        with lock:
+            latencies.extend(local)
+
+    workers = [threading.Thread(target=worker, args=(n * iterations,)) for n in range(threads)]
+    for t in workers:
+        t.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for t in workers:
+        t.join()
+    return summarize(latencies, time.perf_counter() - start)
+
+
+def fake_creator(rows=100):
+    '''
+    创建假的 DB-API 模块, 只返回固定结果, 用于不连接数据库的微基准
+    - information_schema 查询返回 city 的表结构
+    - 其它查询返回 rows 行 city 数据
+    '''
+    module = types.ModuleType("fakedb")
+    module.threadsafety = 1
+    module.apilevel = "2.0"
+    module.paramstyle = "format"
+    for name in ("Error", "OperationalError", "InterfaceError", "DatabaseError",
+                 "InternalError", "ProgrammingError", "IntegrityError", "DataError",
+                 "NotSupportedError"):
+        setattr(module, name, type(name, (Exception,), {}))
+    data = [(i, str(100000 + i), "市%d" % i, str(110000 + i % 34)) for i in range(1, rows + 1)]
+    schema = []
+    for i, (column, data_type, key, nullable) in enumerate(CITY_COLUMNS):
+        item = {"TABLE_SCHEMA": "bench", "TABLE_NAME": "city", "COLUMN_NAME": column,
+                "ORDINAL_POSITION": i + 1, "DATA_TYPE": data_type, "COLUMN_KEY": key,
+                "IS_NULLABLE": nullable}
+        schema.append(tuple(item[c] for c in FAKE_INFORMATION_SCHEMA_COLUMNS))
+
+    class Cursor(object):
+        def __init__(self):
+            self._rows = []
+
+        def execute(self, sql, params=None):
+            if "TABLE_NAME='COLUMNS'" in sql:
+                self._rows = [(c,) for c in FAKE_INFORMATION_SCHEMA_COLUMNS]
+            elif "information_schema" in sql:
+                self._rows = schema
+            elif sql.startswith("SELECT"):
+                self._rows = data
+            else:
+                self._rows = []
+                return 1
+            return len(self._rows)
+
+        def fetchone(self):
+            return self._rows[0] if self._rows else None
+
+        def fetchall(self):
+            return tuple(self._rows)
+
+        def fetchmany(self, size=1):
+            rows, self._rows = self._rows[:size], self._rows[size:]
+            return tuple(rows)
+
+        def close(self):
+            pass
+
+    class Connection(object):
+        def cursor(self, *args):
+            return Cursor()
+
+        def commit(self):
+            pass
+
+        def rollback(self):
+            pass
+
+        def ping(self, *args):
+            return True
+
+        def begin(self):
+            pass
+
+        def close(self):
+            pass
+
+    module.connect = lambda *args, **kwargs: Connection()
+    return module
+
+
+def run_micro(iterations):
+    '''SQL 拼接和结果解析的微基准'''
+    results = {}
+    dao = BaseDao(creator=fake_creator(), user="bench", password="bench", database="bench",
+                  table="city", log_sql=False)
+    descriptor = dao._get_descriptor("city")
+    filters = {"province_id": "110000", QueryUtil.GT + "id": 10, QueryUtil.IN + "city_id": [
+        "100001", "100002", "100003"], QueryUtil.ORDER: "id"}
+    results["query_sql"] = measure(
+        lambda i: QueryUtil.query_sql("SELECT * FROM city", filters), iterations)
+    results["select_sql"] = measure(lambda i: descriptor.select_sql(filters), iterations)
+    results["page_sql"] = measure(
+        lambda i: descriptor.page_sql(Page(i % 100 + 1, 20), filters), iterations)
+    results["keyset_page_sql"] = measure(
+        lambda i: descriptor.page_sql(KeysetPage(20, last=i), {}), iterations)
+    objs = [{"city_id": str(i), "city": "市", "province_id": "110000"} for i in range(500)]
+    results["insert_batches_500"] = measure(
+        lambda i: list(descriptor.insert_batches(objs, 500)), max(iterations // 100, 1))
+    updates = [{"id": i, "city": "市"} for i in range(1, 501)]
+    results["update_batches_500"] = measure(
+        lambda i: list(descriptor.update_batches(updates, 500)), max(iterations // 100, 1))
+    rows = dao.execute_query("SELECT rows")
+    for row_format in BaseDao.ROW_FORMATS:
+        parser = descriptor.row_parser(row_format)
+        results["parse_100_rows_%s" % row_format] = measure(
+            lambda i: [parser(r) for r in rows], max(iterations // 10, 1))
+    for row_format in BaseDao.ROW_FORMATS:
+        results["select_all_%s" % row_format] = measure(
+            lambda i: dao.select_all("city", filters, row_format=row_format),
+            max(iterations // 10, 1))
+    return results
+
+
+def load_init_sql(creator, config, path):
+    '''执行 init_sql.sql 中的语句'''
+    with open(path, "r", encoding="utf-8") as f:
+        content = f.read()
+    statements = []
+    for line in content.splitlines():
+        if line.startswith("--") or not line.strip():
+            continue
+        statements.append(line)
+    sql = "\n".join(statements)
+    # 去掉文件头的 /* */ 注释
+    if sql.startswith("/*"):
+        sql = sql[sql.index("*/") + 2:]
+    conn = creator.connect(**config)
+    try:
+        cursor = conn.cursor()
+        for statement in sql.split(";\n"):
+            if statement.strip():
+                cursor.execute(statement)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def scale_up(dao, rows, batch_size=5000):
+    '''创建 city_bench 表并扩充到 rows 行'''
+    dao.execute_update("DROP TABLE IF EXISTS `city_bench`")
+    dao.execute_update("CREATE TABLE `city_bench` LIKE `city`")
+    dao.execute_update("ALTER TABLE `city_bench` ENGINE=InnoDB, ADD INDEX `idx_province_id` "
+                       "(`province_id`)")
+    dao.invalidate_schema("city_bench")
+    provinces = [r["province_id"] for r in dao.select_all("province")] or ["110000"]
+    start = time.perf_counter()
+    for i in range(0, rows, batch_size):
+        dao.save_many("city_bench", [{
+            "city_id": str(100000 + n), "city": "市%d" % n,
+            "province_id": provinces[n % len(provinces)]
+        } for n in range(i, min(i + batch_size, rows))], batch_size)
+    return time.perf_counter() - start
+
+
+def run_macro(dao, rows, threads_list, iterations):
+    '''连接数据库的宏基准, 每项按 threads_list 中的线程数分别测试'''
+    results = {}
+    provinces = [r["province_id"] for r in dao.select_all("province")] or ["110000"]
+    deep_page = max(rows // 20 - 10, 1)
+    cases = {
+        "select_pk": lambda i: dao.select_pk("city_bench", random.randint(1, rows)),
+        "select_all_eq": lambda i: dao.select_all("city_bench", {
+            "province_id": provinces[i % len(provinces)], QueryUtil.ORDER: "id",
+            "page": Page(1, 100)}),
+        "select_all_in_range": lambda i: dao.select_all("city_bench", {
+            QueryUtil.GE + "id": i % rows, QueryUtil.LT + "id": i % rows + 100}),
+        "select_page_deep_offset": lambda i: dao.select_page(
+            "city_bench", Page(deep_page, 20)),
+        "select_page_deep_keyset": lambda i: dao.select_page(
+            "city_bench", KeysetPage(20, last=rows - 200)),
+        "update_by_primarikey_selective": lambda i: dao.update_by_primarikey_selective(
+            "city_bench", {"id": random.randint(1, rows), "city": "更新%d" % i}),
+        "save": lambda i: dao.save("city_bench", {
+            "city_id": "s%d" % i, "city": "保存", "province_id": provinces[0]}),
+    }
+    for name, func in cases.items():
+        results[name] = {}
+        for threads in threads_list:
+            results[name][str(threads)] = measure_concurrent(func, threads, iterations)
+    batch = [{"city_id": "b%d" % n, "city": "批量", "province_id": provinces[0]}
+             for n in range(1000)]
+    results["save_loop_1000"] = measure(
+        lambda i: [dao.save("city_bench", dict(obj)) for obj in batch], 3)
+    results["save_many_1000"] = measure(
+        lambda i: dao.save_many("city_bench", [dict(obj) for obj in batch]), 3)
+    return results
+
+
+def git_revision():
+    '''当前提交的 hash, 不在 git 仓库中时返回 None'''
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="BaseDao 基准测试")
+    parser.add_argument("--creator", default="pymysql", help="DB-API 模块名(默认: pymysql)")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=3306)
+    parser.add_argument("--user", default="root")
+    parser.add_argument("--password", default="root")
+    parser.add_argument("--database", default="bench")
+    parser.add_argument("--init-sql", default="init_sql.sql", help="初始化 SQL 文件")
+    parser.add_argument("--rows", type=int, default=1000000, help="city_bench 的行数")
+    parser.add_argument("--skip-load", action="store_true", help="使用已有的 city_bench 表")
+    parser.add_argument("--threads", default="1,8,32", help="并发线程数列表")
+    parser.add_argument("--iterations", type=int, default=200, help="每个线程的执行次数")
+    parser.add_argument("--micro-iterations", type=int, default=20000)
+    parser.add_argument("--micro-only", action="store_true", help="只运行微基准")
+    parser.add_argument("--output", default=None, help="JSON 输出文件(默认: 标准输出)")
+    args = parser.parse_args(argv)
+
+    report = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "micro": run_micro(args.micro_iterations),
+    }
+    if not args.micro_only:
+        creator = importlib.import_module(args.creator)
+        threads_list = [int(t) for t in args.threads.split(",") if t.strip()]
+        config = {"host": args.host, "port": args.port, "user": args.user,
+                  "password": args.password, "database": args.database, "charset": "utf8"}
+        if not args.skip_load:
+            load_init_sql(creator, config, args.init_sql)
+        dao = BaseDao(creator=creator, pool=True, maxconnections=max(threads_list) + 2,
+                      log_sql=False, **config)
+        macro = {"rows": args.rows, "threads": threads_list, "iterations": args.iterations}
+        if not args.skip_load:
+            macro["load_seconds"] = scale_up(dao, args.rows)
+        macro["results"] = run_macro(dao, args.rows, threads_list, args.iterations)
+        report["macro"] = macro
+    output = json.dumps(report, ensure_ascii=False, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    else:
+        sys.stdout.write(output + "\n")
+
+
+if __name__ == '__main__':
+    main()
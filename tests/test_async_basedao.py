@@ -0,0 +1,190 @@
+'''AsyncBaseDao 测试: 用 sqlite3 实现的 aiomysql 兼容连接池代替 MySQL'''
+import asyncio
+import sqlite3
+
+import pytest
+
+import basedao
+
+
+class StubCursor(object):
+    def __init__(self, pool, con):
+        self._pool = pool
+        self._cursor = con.cursor()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._cursor.close()
+
+    async def execute(self, sql, params=()):
+        self._pool.queries.append(sql)
+        self._cursor.execute(sql, params)
+        return self._cursor.rowcount
+
+    async def fetchone(self):
+        return self._cursor.fetchone()
+
+    async def fetchall(self):
+        return tuple(self._cursor.fetchall())
+
+    async def fetchmany(self, size):
+        self._pool.fetches += 1
+        return tuple(self._cursor.fetchmany(size))
+
+
+class StubConnection(object):
+    def __init__(self, pool, con):
+        self._pool = pool
+        self._con = con
+
+    def cursor(self, cursor_class=None):
+        return StubCursor(self._pool, self._con)
+
+    async def commit(self):
+        self._con.commit()
+
+    async def rollback(self):
+        self._con.rollback()
+
+
+class StubAcquire(object):
+    def __init__(self, pool):
+        self._pool = pool
+
+    async def __aenter__(self):
+        return StubConnection(self._pool, self._pool.con)
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+
+class StubPool(object):
+    def __init__(self, database):
+        self.con = sqlite3.connect(database)
+        self.queries = []
+        self.fetches = 0
+        self.closed = False
+
+    def acquire(self):
+        return StubAcquire(self)
+
+    def close(self):
+        self.closed = True
+
+    async def wait_closed(self):
+        self.con.close()
+
+
+class StubAiomysql(object):
+    SSCursor = object()
+
+    def __init__(self):
+        self.pools = []
+
+    async def create_pool(self, db=None, **kwargs):
+        pool = StubPool(db)
+        self.pools.append(pool)
+        return pool
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    module = StubAiomysql()
+    monkeypatch.setattr(basedao, "aiomysql", module)
+    return module
+
+
+@pytest.fixture
+def database(tmp_path):
+    path = str(tmp_path / "async.db")
+    con = sqlite3.connect(path)
+    con.executescript("""
+        CREATE TABLE city (id INTEGER PRIMARY KEY, name TEXT NOT NULL, province_id INTEGER);
+        INSERT INTO city (name, province_id) VALUES ('a', 1), ('b', 1), ('c', 2), ('d', 3);
+    """)
+    con.commit()
+    con.close()
+    return path
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_crud(stub, database):
+    async def main():
+        async with basedao.AsyncBaseDao(database=database, dialect="sqlite") as dao:
+            assert await dao.save("city", {"name": "e", "province_id": 3}) == 1
+            assert (await dao.select_one("city", {"name": "e"}))["id"] == 5
+            assert (await dao.select_pk("city", 2))["name"] == "b"
+            assert await dao.select_pks("city", [4, 9, 1]) == [
+                {"id": 4, "name": "d", "province_id": 3}, None,
+                {"id": 1, "name": "a", "province_id": 1}]
+            await dao.update_by_primarikey_selective("city", {"id": 1, "name": "A", "province_id": None})
+            assert await dao.select_pk("city", 1) == {"id": 1, "name": "A", "province_id": 1}
+            await dao.update_by_primarykey("city", {"id": 1, "name": "A", "province_id": None})
+            assert (await dao.select_pk("city", 1))["province_id"] is None
+            assert await dao.count("city", {"province_id": 3}) == 2
+            assert await dao.aggregate("city", {"n": "COUNT(*)"}, groupby="province_id",
+                                       filters={"orderby": "province_id"}) == [
+                {"province_id": None, "n": 1}, {"province_id": 1, "n": 1},
+                {"province_id": 2, "n": 1}, {"province_id": 3, "n": 2}]
+            page = basedao.Page(2, 2, count=True)
+            rows = await dao.select_page("city", page, {"orderby": "id"}, row_format="tuple")
+            assert [row[0] for row in rows] == [3, 4] and page.total == 5 and page.pages == 3
+            page = basedao.Page(1, 2, count=basedao.Page.ESTIMATE)
+            await dao.select_page("city", page)
+            assert page.total == 5
+            page = basedao.KeysetPage(3, key="id")
+            assert [row["id"] for row in await dao.select_page("city", page, columns=["name"])] == [1, 2, 3]
+            assert [row["id"] for row in await dao.select_page("city", page)] == [4, 5]
+            assert not page.has_next
+            assert await dao.remove_by_primarykey("city", 5) == 1
+            assert await dao.remove_by_primarykeys("city", [3, 4]) == 2
+            assert [row["id"] for row in await dao.select_all("city")] == [1, 2]
+    run(main())
+
+
+def test_schema_loaded_through_dialect(stub, database):
+    async def main():
+        dao = await basedao.AsyncBaseDao.create(database=database, dialect="sqlite", table="city")
+        assert any(sql.startswith("PRAGMA table_info") for sql in stub.pools[0].queries)
+        assert "information_schema" not in " ".join(stub.pools[0].queries)
+        with pytest.raises(Exception):
+            await dao.select_all("nope")
+        await dao.close()
+        assert stub.pools[0].closed
+    run(main())
+
+
+def test_iter_all(stub, database):
+    async def main():
+        async with basedao.AsyncBaseDao(database=database, dialect="sqlite") as dao:
+            await dao.save_many("city", [{"name": "n%d" % i} for i in range(20)], batch_size=7)
+            rows = [row async for row in dao.iter_all("city", fetch_size=5)]
+            assert len(rows) == 24 and rows[0] == {"id": 1, "name": "a", "province_id": 1}
+            # 每次读取 5 行, 最后一次读到空结果
+            assert stub.pools[0].fetches == 6
+            raw = [row async for row in dao.iter_all("city", {"province_id": 1}, raw=True)]
+            assert raw == [(1, "a", 1), (2, "b", 1)]
+            with pytest.raises(ValueError):
+                [row async for row in dao.iter_all("city", fetch_size=0)]
+    run(main())
+
+
+def test_pk_loader_coalesces(stub, database):
+    async def main():
+        async with basedao.AsyncBaseDao(database=database, dialect="sqlite") as dao:
+            await dao.select_all("city")
+            queries = stub.pools[0].queries
+            start = len(queries)
+            loader = dao.pk_loader("city")
+            rows = await asyncio.gather(*[loader.load(key) for key in (3, 1, 3, 9, 2)])
+            assert [row and row["name"] for row in rows] == ["c", "a", "c", None, "b"]
+            assert len(queries) - start == 1 and " IN " in queries[-1]
+            # 已加载的主键不再查询
+            assert [row["id"] for row in await loader.load_many([1, 2])] == [1, 2]
+            assert len(queries) - start == 1
+    run(main())
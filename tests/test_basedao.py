@@ -0,0 +1,567 @@
+'''BaseDao 测试: 使用 sqlite3 (SQLiteDialect)，非连接池模式为 ":memory:"，连接池模式为临时文件'''
+import gc
+import json
+import sqlite3
+import threading
+import weakref
+
+import pytest
+
+import basedao
+from basedao import BaseDao, KeysetPage, Page, QueryUtil
+
+SCHEMA = (
+    "CREATE TABLE province (id INTEGER PRIMARY KEY, province_id TEXT NOT NULL UNIQUE, "
+    "province TEXT NOT NULL)",
+    "CREATE TABLE city (id INTEGER PRIMARY KEY, city_id TEXT NOT NULL, city TEXT NOT NULL, "
+    "province_id TEXT REFERENCES province(province_id))",
+    "CREATE INDEX idx_city_pid ON city(province_id)",
+)
+PROVINCES = 5
+CITIES = 50
+
+
+def make_dao(database=":memory:", **kwargs):
+    kwargs.setdefault("log_sql", False)
+    return BaseDao(creator=sqlite3, database=database, **kwargs)
+
+
+def create_tables(dao):
+    for sql in SCHEMA:
+        dao.execute_update(sql)
+    dao.save_many("province", [{"province_id": "p%d" % i, "province": "省%d" % i}
+                               for i in range(1, PROVINCES + 1)])
+    dao.save_many("city", [{"city_id": "c%d" % i, "city": "市%d" % i,
+                            "province_id": "p%d" % (i % PROVINCES + 1)}
+                           for i in range(1, CITIES + 1)])
+    return dao
+
+
+@pytest.fixture
+def dao():
+    return create_tables(make_dao())
+
+
+@pytest.fixture
+def path(tmp_path):
+    '''连接池模式使用的数据库文件，已建表'''
+    database = str(tmp_path / "test.db")
+    create_tables(make_dao(database)).close()
+    return database
+
+
+def sql_log(dao):
+    '''记录 dao 执行的 SQL'''
+    executed = []
+    dao.add_hook("before_execute", lambda event: executed.append(event.sql))
+    return executed
+
+
+# 连接池
+def test_pool_threads_use_their_own_table(path):
+    dao = make_dao(path, pool=True)
+    errors = []
+
+    def run(table_name):
+        columns = set(dao._get_descriptor(table_name).columns)
+        for _ in range(30):
+            for row in dao.select_all(table_name, {"id": 1}):
+                if set(row) != columns:
+                    errors.append((table_name, row))
+
+    threads = [threading.Thread(target=run, args=("city" if i % 2 else "province",))
+               for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+
+
+def test_pool_connection_pins_connection(path):
+    dao = make_dao(path, pool=True)
+    with dao.connection() as conn:
+        with dao.connection() as inner:
+            assert inner is conn
+
+
+# 参数化查询
+def test_query_sql_parameters():
+    sql, params = QueryUtil.query_sql("SELECT * FROM city", {
+        "province_id": "p1", QueryUtil.IN + "id": "1,2", QueryUtil.LIKE + "city": "市",
+        QueryUtil.ORDER: "id", QueryUtil.ORDER_TYPE: "desc"})
+    assert sql == ("SELECT * FROM city WHERE 1=1 AND `province_id`=%s AND `id` IN (%s,%s) "
+                   "AND `city` LIKE %s ORDER BY `id` desc")
+    assert params == ["p1", "1", "2", "%市%"]
+    again, _ = QueryUtil.query_sql("SELECT * FROM city", {
+        "province_id": "p2", QueryUtil.IN + "id": [3, 4], QueryUtil.LIKE + "city": "x",
+        QueryUtil.ORDER: "id", QueryUtil.ORDER_TYPE: "desc"})
+    assert again is sql
+
+
+def test_values_are_not_interpolated(dao):
+    assert dao.select_all("city", {"city": "x' OR '1'='1"}) == []
+    assert dao.count("city", {"city": "市1"}) == 1
+
+
+# 批量插入
+def test_save_many(dao):
+    assert dao.save_many("province", [{"province_id": "n%d" % i, "province": "新"}
+                                      for i in range(5)], batch_size=2) == [2, 2, 1]
+    assert dao.save_many("province", [{"province_id": "n1", "province": "重复"}], ignore=True) == [0]
+    dao.save_many("province", [{"province_id": "n1", "province": "更新"}], on_duplicate=["province"])
+    assert dao.select_one("province", {"province_id": "n1"})["province"] == "更新"
+
+
+# 按主键批量更新和删除
+def test_update_and_remove_many(dao):
+    assert dao.update_many_by_primarykey(
+        "city", [{"id": i, "city": "改%d" % i} for i in range(1, 8)], batch_size=3) == 7
+    assert dao.select_pk("city", 7)["city"] == "改7"
+    assert dao.remove_by_primarykeys("city", range(1, 11), chunk_size=4) == 10
+    assert dao.count("city") == CITIES - 10
+
+
+# 流式查询
+def test_iter_all(dao):
+    rows = dao.iter_all("city", {QueryUtil.GT + "id": 40}, fetch_size=3)
+    assert [row["id"] for row in rows] == list(range(41, CITIES + 1))
+    assert next(dao.iter_all("city", raw=True))[:2] == (1, "c1")
+    with pytest.raises(ValueError):
+        dao.iter_all("city", fetch_size=0)
+
+
+def test_iter_all_reconnects(path):
+    dao = make_dao(path)
+    dao.preload_tables("city")
+    dao.close()
+    assert len(list(dao.iter_all("city"))) == CITIES
+
+
+# 键集分页
+def test_keyset_page(dao):
+    page = KeysetPage(20)
+    ids = []
+    while page.has_next:
+        ids.extend(row["id"] for row in dao.select_page("city", page))
+    assert ids == list(range(1, CITIES + 1))
+    page = KeysetPage(10, key="id")
+    rows = dao.select_page("city", page, {QueryUtil.ORDER_TYPE: "desc"})
+    assert [row["id"] for row in rows] == list(range(CITIES, CITIES - 10, -1))
+    assert page.last == CITIES - 9
+    pages = list(dao.select_page_iter("city", 16, columns=["city"]))
+    assert [len(rows) for rows in pages] == [16, 16, 16, 2]
+
+
+def test_offset_page_count(dao):
+    page = Page(2, 20, count=True)
+    assert [row["id"] for row in dao.select_page("city", page, {QueryUtil.ORDER: "id"})] == \
+        list(range(21, 41))
+    assert page.total == CITIES and page.pages == 3
+    dao.save("city", {"city_id": "new", "city": "新", "province_id": "p1"})
+    page = Page(1, 20, count=True)
+    dao.select_page("city", page)
+    assert page.total == CITIES + 1
+
+
+# 延迟加载和磁盘缓存
+def test_lazy_schema_and_disk_cache(tmp_path):
+    database = str(tmp_path / "cache.db")
+    cache = str(tmp_path / "schema.json")
+    # 建表时加载的表结构在同一数据库的 BaseDao 之间共享，先清空以检查延迟加载
+    setup = create_tables(make_dao(database))
+    setup.invalidate_schema()
+    setup.close()
+    dao = make_dao(database, schema_cache=cache)
+    assert dao._schema.descriptors == {}
+    dao.select_pk("city", 1)
+    assert set(dao._schema.descriptors) == {"city"}
+    with open(cache, encoding="utf-8") as f:
+        assert "city" in json.load(f)[database]["tables"]
+    # 模拟新进程: 清空注册表后从磁盘缓存读取，不再查询表结构
+    dao.invalidate_schema()
+    dao._schema.cache_loaded = False
+    executed = []
+    other = BaseDao(creator=sqlite3, database=database, schema_cache=cache, log_sql=False,
+                    before_execute=lambda event: executed.append(event.sql))
+    assert other.select_pk("city", 2)["city_id"] == "c2"
+    assert executed and not any(sql.startswith("PRAGMA table_info") for sql in executed)
+
+
+# 共享表结构注册表
+def test_schema_registry_is_shared(path):
+    first = make_dao(path)
+    first.select_pk("city", 1)
+    second = BaseDao(creator=sqlite3, database=path, log_sql=False)
+    assert second._schema is first._schema
+    executed = sql_log(second)
+    second.select_pk("city", 1)
+    assert not any(sql.startswith("PRAGMA") for sql in executed)
+
+
+# 预编译的表描述
+def test_table_descriptor(dao):
+    descriptor = dao._get_descriptor("city")
+    assert descriptor.primary_keys == ("id",)
+    assert descriptor.column_index["city"] == 2
+    assert descriptor.projection_columns(["city"]) == ("city",)
+    with pytest.raises(ValueError):
+        descriptor.projection_columns(["nope"])
+
+
+# 行格式
+def test_row_formats(dao):
+    assert dao.select_pk("city", 1, row_format="tuple") == (1, "c1", "市1", "p2")
+    row = dao.select_pk("city", 1, row_format="namedtuple")
+    assert row.city == "市1" and row._fields == ("id", "city_id", "city", "province_id")
+    record = dao.select_pk("city", 1, row_format="record")
+    assert record.city == "市1" and record["city_id"] == "c1"
+    assert record._asdict() == dao.select_pk("city", 1)
+    assert not hasattr(record, "__dict__")
+    with pytest.raises(ValueError):
+        make_dao(row_format="nope")
+
+
+# 查询结果缓存
+def test_result_cache():
+    dao = make_dao(result_cache=basedao.MemoryResultCache(), cache_ttl=60)
+    create_tables(dao)
+    executed = sql_log(dao)
+    assert dao.select_pk("city", 1)["city"] == "市1"
+    assert dao.select_pk("city", 1)["city"] == "市1"
+    assert len(executed) == 1 and dao.cache_stats()["hits"] == 1
+    dao.update_by_primarikey_selective("city", {"id": 1, "city": "新"})
+    assert dao.select_pk("city", 1)["city"] == "新"
+
+
+# identity map 和合并主键查询
+def test_select_pks_and_identity_map(dao):
+    rows = dao.select_pks("city", [3, 999, 1], chunk_size=1)
+    assert [row and row["id"] for row in rows] == [3, None, 1]
+    with dao.unit_of_work():
+        first = dao.select_pk("city", 2)
+        assert dao.select_pk("city", 2) is first
+        dao.update_by_primarikey_selective("city", {"id": 2, "city": "改"})
+        assert dao.select_pk("city", 2) is not first
+
+
+def test_pk_loader_coalesces(dao):
+    loader = dao.pk_loader("city")
+    executed = sql_log(dao)
+    results = [loader.load(key) for key in (5, 1, 5, 999)]
+    assert executed == []
+    assert [result.value and result.value["id"] for result in results] == [5, 1, 5, None]
+    assert len(executed) == 1
+    assert [row["id"] for row in loader.load_many([1, 5])] == [1, 5]
+    assert len(executed) == 1
+
+
+# 事务
+def test_transaction_commit_and_rollback(dao):
+    with dao.transaction():
+        dao.save("province", {"province_id": "t1", "province": "事务"})
+    assert dao.count("province", {"province_id": "t1"}) == 1
+    with pytest.raises(RuntimeError):
+        with dao.transaction():
+            dao.save("province", {"province_id": "t2", "province": "事务"})
+            raise RuntimeError
+    assert dao.count("province", {"province_id": "t2"}) == 0
+
+
+def test_transaction_errors_propagate(dao):
+    with pytest.raises(sqlite3.IntegrityError):
+        with dao.transaction():
+            dao.save("province", {"province_id": "p1", "province": "重复"})
+
+
+def test_nested_transaction_savepoints(dao):
+    with pytest.raises(RuntimeError):
+        with dao.transaction():
+            with dao.transaction():
+                dao.save("province", {"province_id": "n1", "province": "内层"})
+            raise RuntimeError
+    assert dao.count("province", {"province_id": "n1"}) == 0
+    with dao.transaction():
+        dao.save("province", {"province_id": "n2", "province": "外层"})
+        with pytest.raises(RuntimeError):
+            with dao.transaction():
+                dao.save("province", {"province_id": "n3", "province": "内层"})
+                raise RuntimeError
+    assert dao.count("province", {QueryUtil.IN + "province_id": ["n2", "n3"]}) == 1
+
+
+def test_autocommit_false_and_commit_every(path):
+    dao = make_dao(path, autocommit=False)
+    reader = make_dao(path)
+    dao.save("province", {"province_id": "a1", "province": "未提交"})
+    assert reader.count("province", {"province_id": "a1"}) == 0
+    dao.commit()
+    assert reader.count("province", {"province_id": "a1"}) == 1
+    with dao.transaction(commit_every=2):
+        for i in range(3):
+            dao.save("province", {"province_id": "b%d" % i, "province": "批"})
+        assert reader.count("province", {QueryUtil.RIGHT_LIKE + "province_id": "b"}) == 2
+    assert reader.count("province", {QueryUtil.RIGHT_LIKE + "province_id": "b"}) == 3
+
+
+def test_raise_errors(dao):
+    assert dao.execute_update("INSERT INTO nope VALUES (1)") is None
+    strict = make_dao(raise_errors=True)
+    with pytest.raises(sqlite3.OperationalError):
+        strict.execute_update("INSERT INTO nope VALUES (1)")
+    with pytest.raises(sqlite3.OperationalError):
+        strict.execute_query("SELECT * FROM nope")
+
+
+# 日志和钩子
+def test_hooks_and_latency_stats(tmp_path, caplog):
+    dao = make_dao(metrics=True, slow_query=0)
+    create_tables(dao)
+    dao.preload_tables("city")
+    events = []
+    dao.add_hook("after_execute", events.append)
+    caplog.set_level("INFO", logger=basedao.logger.name)
+    caplog.clear()
+    dao.select_all("city", {"province_id": "p1"})
+    assert len(list(dao.iter_all("city"))) == CITIES
+    assert dao.bulk_dump("city", str(tmp_path / "city.csv")) == CITIES
+    assert [(e.table, e.method, e.row_count) for e in events] == [
+        ("city", "select_all", CITIES // PROVINCES), ("city", "iter_all", None),
+        ("city", "bulk_dump", None)]
+    assert {"city.select_all", "city.iter_all", "city.bulk_dump"} <= set(dao.latency_stats())
+    assert not any("SQL >>>" in record.getMessage() for record in caplog.records)
+    assert sum("慢查询" in record.getMessage() for record in caplog.records) == 3
+
+
+# 基准测试脚本
+def test_benchmark_micro(tmp_path):
+    benchmark = pytest.importorskip("benchmark")
+    output = str(tmp_path / "micro.json")
+    benchmark.main(["--micro-only", "--micro-iterations", "20", "--output", output])
+    with open(output, encoding="utf-8") as f:
+        assert "select_sql" in json.load(f)["micro"]
+
+
+# 方言
+def test_sqlite_dialect_convert():
+    dialect = basedao.get_dialect(creator=sqlite3)
+    assert isinstance(dialect, basedao.SQLiteDialect)
+    assert dialect.convert("INSERT IGNORE INTO `t` (`a`) VALUES(%s)") == \
+        "INSERT OR IGNORE INTO `t` (`a`) VALUES(?)"
+    assert dialect.convert("INSERT INTO `t` (`a`) VALUES(%s) ON DUPLICATE KEY UPDATE `a`=VALUES(`a`)") \
+        == "INSERT INTO `t` (`a`) VALUES(?) ON CONFLICT DO UPDATE SET `a`=excluded.`a`"
+    assert isinstance(basedao.get_dialect(), basedao.MySQLDialect)
+
+
+def test_memory_databases_are_isolated():
+    first, second = make_dao(result_cache=True), make_dao(result_cache=True)
+    assert first._schema is not second._schema
+    assert first._result_cache is not second._result_cache
+    first.execute_update("CREATE TABLE t (id INTEGER PRIMARY KEY, code TEXT)")
+    second.execute_update("CREATE TABLE t (id INTEGER PRIMARY KEY, name TEXT)")
+    first.save("t", {"code": "a"})
+    assert first.select_all("t") == [{"id": 1, "code": "a"}]
+    second.save("t", {"name": "b"})
+    assert second.select_all("t") == [{"id": 1, "name": "b"}]
+
+
+# 重试
+def test_transient_errors_are_retried(monkeypatch):
+    dao = make_dao(retries=2, retry_backoff=0)
+    create_tables(dao)
+    execute = dao._execute
+    failures = []
+
+    def flaky(*args, **kwargs):
+        if len(failures) < 2:
+            failures.append(1)
+            raise sqlite3.OperationalError("database is locked")
+        return execute(*args, **kwargs)
+
+    monkeypatch.setattr(dao, "_execute", flaky)
+    assert dao.execute_query("SELECT COUNT(*) FROM city", True) == (CITIES,)
+    failures.clear()
+    monkeypatch.setattr(dao, "_retries", 1)
+    assert dao.execute_query("SELECT COUNT(*) FROM city", True) is None
+
+
+# 读写分离
+def test_replica_routing(path, tmp_path):
+    replica = str(tmp_path / "replica.db")
+    create_tables(make_dao(replica)).close()
+    make_dao(replica).execute_update("UPDATE city SET city='从库' WHERE id=1")
+    dao = make_dao(path, pool=True, replicas=[{"database": replica}], sticky_after_write=60)
+    dao.preload_tables("city")
+    reads = dao.replica_stats()[replica]["reads"]
+    assert dao.select_pk("city", 1)["city"] == "从库"
+    dao.update_by_primarikey_selective("city", {"id": 2, "city": "主库"})
+    # 写入后的粘滞期内读主库
+    assert dao.select_pk("city", 1)["city"] == "市1"
+    assert dao.replica_stats()[replica]["reads"] == reads + 1
+
+
+def test_replica_failure_falls_back_to_primary(path, tmp_path):
+    missing = str(tmp_path / "missing" / "replica.db")
+    dao = make_dao(path, pool=True, replicas=[{"database": missing}])
+    assert dao.select_pk("city", 1)["city"] == "市1"
+    assert dao.replica_stats()[missing]["ejected"]
+
+
+# 投影和聚合
+def test_projection_and_aggregate(dao):
+    assert dao.select_one("city", {"id": 1}, columns=["city"]) == {"city": "市1"}
+    assert dao.count("city", {"province_id": "p1"}) == CITIES // PROVINCES
+    assert dao.aggregate("city", {"n": "COUNT(*)", "top": "MAX(`id`)"}) == {"n": CITIES, "top": CITIES}
+    groups = dao.aggregate("city", {"n": "COUNT(*)"}, {QueryUtil.ORDER: "province_id"},
+                           groupby="province_id")
+    assert groups[0] == {"province_id": "p1", "n": CITIES // PROVINCES} and len(groups) == PROVINCES
+
+
+def test_aggregate_expression_with_percent(dao):
+    aggregates = {"month": "strftime('%Y-%m', '2024-05-01')", "epoch": "strftime('%s', '1970-01-02')"}
+    sql, params, _ = dao._get_descriptor("city").aggregate_sql(aggregates, {"province_id": "p1"})
+    # pymysql 按 sql % params 填充参数
+    assert "strftime('%Y-%m', '2024-05-01')" in sql % tuple(params)
+    assert dao.aggregate("city", aggregates) == {"month": "2024-05", "epoch": "86400"}
+
+
+# 索引顾问
+def test_advisor():
+    dao = make_dao(advisor="raise")
+    create_tables(dao)
+    assert len(dao.select_all("city", {"province_id": "p1"})) == CITIES // PROVINCES
+    with pytest.raises(basedao.UnindexedQueryError):
+        dao.select_all("city", {"city": "市1"})
+    shapes = dao.index_report()["most_frequent"]
+    assert [shape["table"] for shape in shapes] == ["city"] and shapes[0]["issues"]
+
+
+# 并行扫描
+def test_parallel_scan(path):
+    dao = make_dao(path, pool=True)
+    ranges = list(dao.parallel_scan("city", workers=3, partitions=6))
+    assert [row["id"] for rows in ranges for row in rows] == list(range(1, CITIES + 1))
+    rows = [row for rows in dao.parallel_scan("city", {"province_id": "p1"}, ordered=False,
+                                               row_format="tuple") for row in rows]
+    assert sorted(row[0] for row in rows) == list(range(5, CITIES + 1, PROVINCES))
+
+
+# 文件导入导出
+@pytest.mark.parametrize("file_format", ["csv", "tsv"])
+def test_bulk_dump_and_load(dao, tmp_path, file_format):
+    dao.execute_update("CREATE TABLE copy (id INTEGER PRIMARY KEY, city_id TEXT, city TEXT, "
+                       "province_id TEXT)")
+    dao.save_many("city", [{"city_id": "NULL", "city": 'a,"b"\n\tc', "province_id": None}])
+    target = str(tmp_path / ("city." + file_format))
+    assert dao.bulk_dump("city", target, format=file_format) == CITIES + 1
+    assert dao.bulk_load("copy", target, format=file_format, batch_size=7) == CITIES + 1
+    assert dao.select_all("copy") == dao.select_all("city")
+    assert dao.select_pk("copy", CITIES + 1) == {
+        "id": CITIES + 1, "city_id": "NULL", "city": 'a,"b"\n\tc', "province_id": None}
+
+
+def test_bulk_load_rows(dao):
+    rows = [{"province_id": "r%d" % i, "province": "行"} for i in range(10)]
+    assert dao.bulk_load("province", rows, batch_size=3) == 10
+    assert dao.count("province") == PROVINCES + 10
+
+
+# write-behind
+def test_write_behind_coalesces():
+    dao = make_dao(write_behind=True, flush_size=1000, flush_interval=60)
+    create_tables(dao)
+    executed = sql_log(dao)
+    for i in range(10):
+        assert dao.update_by_primarikey_selective("city", {"id": 1 + i % 2, "city": "v%d" % i}) is None
+    assert dao.select_pk("city", 1)["city"] == "市1"
+    assert dao.write_buffer_stats()["depth"] == 2
+    assert dao.flush() == 2
+    assert [row["city"] for row in dao.select_pks("city", [1, 2])] == ["v8", "v9"]
+    assert sum(sql.startswith("UPDATE") for sql in executed) == 1
+    # 同一张表的其它写操作执行前先刷新
+    dao.update_by_primarykey("city", {"id": 3, "city_id": "c3", "city": "缓冲", "province_id": "p4"})
+    dao.remove_by_primarykey("city", 3)
+    assert dao.select_pk("city", 3) is None and dao.write_buffer_stats()["depth"] == 0
+
+
+def test_write_behind_survives_caller_rollback():
+    dao = make_dao(write_behind=True, flush_interval=60)
+    create_tables(dao)
+    dao.update_by_primarikey_selective("city", {"id": 1, "city": "缓冲"})
+    with pytest.raises(RuntimeError):
+        with dao.transaction():
+            dao.save("province", {"province_id": "x", "province": "x"})
+            dao.save("city", {"city_id": "x", "city": "x", "province_id": "x"})
+            raise RuntimeError
+    assert dao.select_pk("city", 1)["city"] == "缓冲"
+    assert dao.count("city") == CITIES
+    with dao.transaction():
+        with pytest.raises(Exception):
+            dao.flush()
+
+
+def test_write_behind_buffers_are_released(path):
+    dao = make_dao(path, write_behind=True, flush_interval=60)
+    ref = weakref.ref(dao)
+    dao.update_by_primarikey_selective("city", {"id": 1, "city": "缓冲"})
+    del dao
+    gc.collect()
+    # 有未刷新的更新时不会被回收, 刷新后可以回收
+    assert ref() is not None
+    ref().flush()
+    gc.collect()
+    assert ref() is None
+    before = threading.active_count()
+    for _ in range(10):
+        pooled = make_dao(path, pool=True, write_behind=True)
+        pooled.update_by_primarikey_selective("city", {"id": 2, "city": "池"})
+        pooled.close()
+    assert threading.active_count() - before <= 1
+    assert make_dao(path).select_pk("city", 2)["city"] == "池"
+
+
+def test_shared_write_buffer_notifies_each_dao(path):
+    first = make_dao(path, pool=True, write_behind=True, flush_interval=60)
+    first_executed = sql_log(first)
+    ref = weakref.ref(first)
+    second = make_dao(path, pool=True, write_behind=True, result_cache=basedao.MemoryResultCache())
+    assert second._write_buffer is first._write_buffer
+    assert second.select_pk("city", 1)["city"] == "市1"
+    second.update_by_primarikey_selective("city", {"id": 1, "city": "共享"})
+    assert second.flush() == 1
+    # 刷新不经过创建缓冲的 BaseDao，但会清除 second 的缓存
+    assert first_executed == []
+    assert second.select_pk("city", 1)["city"] == "共享"
+    del first
+    gc.collect()
+    assert ref() is None
+
+
+# 关联加载
+def test_include_in_strategy(dao):
+    # 第一次使用时按外键推断关联
+    dao.select_all("city", {"id": 1}, include=["province"])
+    executed = sql_log(dao)
+    cities = dao.select_page("city", KeysetPage(CITIES), include=["province"])
+    assert len(executed) == 2
+    assert all(city["province"]["province_id"] == city["province_id"] for city in cities)
+    provinces = dao.select_all("province", include="city")
+    assert sum(len(province["city"]) for province in provinces) == CITIES
+    with pytest.raises(ValueError):
+        dao.select_all("city", include=["nope"])
+    with pytest.raises(ValueError):
+        dao.select_all("city", include=["province"], row_format="tuple")
+
+
+def test_include_join_strategy(dao):
+    dao.add_relation("city", "prov", "province_id", "province", "province_id")
+    rows = dao.select_all("city", {QueryUtil.ORDER: "id", QueryUtil.ORDER_TYPE: "desc"},
+                          columns=["city"], include="prov", include_strategy="join")
+    assert [row["id"] for row in rows] == list(range(CITIES, 0, -1))
+    assert rows[0]["prov"] == dao.select_one("province", {"province_id": rows[0]["province_id"]})
+    page = KeysetPage(20)
+    first = dao.select_page("city", page, include="province", include_strategy="join")
+    second = dao.select_page("city", page, include="province", include_strategy="join")
+    assert [first[-1]["id"] + 1, len(second)] == [second[0]["id"], 20]
+    with pytest.raises(ValueError):
+        dao.select_all("province", include="city", include_strategy="join")